@@ -0,0 +1,636 @@
+"""Benchmarks for the import hot paths"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from pathlib import Path
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from booru_csv_maker import (
+    Mappings, ResolutionData, calculate_rating, compile_metadata, finalize_tags
+)
+from precache_posts_sqlite import write_to_sqlite
+from functions.cooccurrence import CoOccurrenceMatrix
+from functions.minhash import MinHashMatrix
+from functions.rating_engine import RatingEngine
+from functions.tag_pipeline import TagPipeline, RESOLUTION_TAGS
+from functions.utils import (
+    THUMBNAIL_ENGINES, apply_tag_curation, compute_danbooru_pixel_hash, rating_from_score,
+    resolve_post
+)
+
+ALLOWED_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".jxl", ".avif"}
+SCRIPT_DIR = Path(__file__).parent.resolve()
+FIXTURE_VERSION = 1
+SUITE_STAGES = ("write_to_sqlite", "resolve_post", "compute_danbooru_pixel_hash",
+                "compile_metadata", "clean_wiki_body")
+
+def reset_peak_rss():
+    """
+    Resets this process's peak RSS where Linux allows it. A spawned child
+    otherwise inherits its parent's high-water mark through fork/exec.
+    """
+    try:
+        Path("/proc/self/clear_refs").write_text("5", encoding="ascii")
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its reaped children, in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        status = Path("/proc/self/status").read_text(encoding="ascii")
+        own = int(re.search(r"VmHWM:\s+(\d+) kB", status)[1]) / 1024
+    except (OSError, TypeError):
+        pass
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return round(own, 1), round(children, 1)
+
+def summarize(latencies):
+    """Reduces a list of per-item timings (seconds) to a small stats dict in ms."""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "total_s": round(sum(ordered), 3)
+    }
+
+def timed_call(func, *args):
+    """Calls func(*args); returns (result, seconds)."""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def in_fresh_process(func, *args):
+    """Runs `func` in a newly spawned interpreter so peak RSS isn't shared between runs."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(func, *args).result()
+
+def _run_thumbnail_engine(name, images, out_dir):
+    """Thumbnails every image with a single engine and reports latency and memory."""
+    engine = THUMBNAIL_ENGINES[name]
+    latencies, failures = [], 0
+    for i, img in enumerate(images):
+        dst = Path(out_dir) / name / f"{i}.webp"
+        start = time.perf_counter()
+        try:
+            engine(img, dst)
+        except Exception: # pylint: disable=broad-exception-caught
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    own, children = peak_rss_mb()
+    return {**summarize(latencies), "failures": failures,
+            "peak_rss_mb": own, "peak_child_rss_mb": children}
+
+def bench_thumbnails(args):
+    """Compares the in-process libvips thumbnailer against the magick/Pillow paths."""
+    images = sorted(f for f in Path(args.images).rglob("*")
+                    if f.suffix.lower() in ALLOWED_EXTS and "thumbnails" not in f.parts)
+    images = images[:args.limit]
+    print(f"[INFO] Thumbnailing {len(images)} image(s) per engine...")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for name in THUMBNAIL_ENGINES:
+            results[name] = in_fresh_process(_run_thumbnail_engine, name, images, out_dir)
+            print(f"  {name:<8} {results[name]}")
+    return results
+
+def synthetic_tag_corpus(images, seed=0):
+    """Deterministic posts, sidecars and mappings shaped like a real import."""
+    rng = random.Random(seed)
+    vocab = [f"tag_{i}" for i in range(5000)]
+    # A few shapes that exercise normalisation, cosplay folding and curation
+    vocab += ["two words", "thing_(some_series)", "char_1_(cosplay)", "series_3",
+              "absurdres", "tagme"]
+    chars = {f"char_{i}": f"series_{i % 300}" for i in range(2000)}
+    artists = {f"artist_{i}": f"artist_{i}" for i in range(1500)}
+    mappings = Mappings(chars, artists, {t: rng.choice((0, 1, 5, 40)) for t in vocab[:800]})
+    dynamic = {f"tag_{i}": f"tag_{i + 1}" for i in range(0, 400, 4)}
+    dynamic.update({"tag_401": "_DROP_", "tag_402": "series:series_7", "tag_403": "char_5"})
+
+    samples = []
+    for _ in range(images):
+        post = {
+            "general": rng.sample(vocab, rng.randint(5, 40)),
+            "character": rng.sample(list(chars), rng.randint(0, 3)),
+            "series": [f"series_{rng.randint(0, 299)}"],
+            "artist": rng.sample(list(artists), rng.randint(0, 2)),
+        }
+        sidecar = rng.sample(vocab, rng.randint(0, 20)) + rng.sample(list(chars), 1)
+        extra = ["highres", "source:https://www.pixiv.net/en/artworks/1"]
+        samples.append((post, sidecar, extra))
+    return mappings, dynamic, samples
+
+def enrich_tags(initial_tags, mappings):
+    """
+    Adds prefixes (series:, character:, artist:) based on mappings, as
+    booru_csv_maker.py did before TagPipeline; kept as legacy_row()'s reference.
+    """
+    # First pass: Add inferred tags, then remove the bare tag if it was successfully prefixed
+    temp_tags = []
+    for tag in initial_tags:
+        temp_tags.append(tag)
+        if tag in mappings.char:
+            inferred = mappings.char[tag]
+            temp_tags.append(f"character:{tag}")
+            if isinstance(inferred, (list, tuple, set)):
+                temp_tags.extend(f"series:{t}" for t in inferred)
+            else:
+                temp_tags.append(f"series:{inferred}")
+
+    # Second pass: remove bare tags that were identified as characters
+    stage_1 = [t for t in temp_tags if t not in mappings.char]
+
+    # Third pass: Handle artists
+    final_tags = []
+    for tag in stage_1:
+        final_tags.append(tag)
+        if tag in mappings.artist:
+            final_tags.append(f"artist:{tag}")
+
+    return [t for t in final_tags if t not in mappings.artist]
+
+def legacy_row(sample, mappings, dynamic, args):
+    """
+    The per-image chain compile_metadata used before TagPipeline, down to the
+    CSV tag string and rating for a (post, sidecar, extra) sample. It read the
+    sidecar twice, so sidecar tags were rated twice and counted twice towards
+    the 'tagme' (< 15 tags) check.
+    """
+    post, sidecar, extra = sample
+    image_tags = list(args.pretags)
+    image_tags.extend(post.get("general", []))
+    image_tags.extend(f"character:{t}" for t in post.get("character", []))
+    image_tags.extend(f"series:{t}" for t in post.get("series", []))
+    image_tags.extend(f"artist:{t}" for t in post.get("artist", []))
+    image_tags.extend(sidecar)
+    image_tags.extend(sidecar)
+    image_tags = enrich_tags(image_tags, mappings)
+    image_tags = [t for t in image_tags if t not in RESOLUTION_TAGS] + list(extra)
+    image_tags = [re.sub(r'\s+', '_', tag.strip()) for tag in image_tags]
+    image_tags = [re.sub(r'_series\)$', ')', tag.strip()) for tag in image_tags]
+    apply_tag_curation(image_tags, dynamic)
+
+    if len(image_tags) < 15:
+        image_tags.append("tagme")
+    rating = calculate_rating(image_tags, post.get("rating", []), mappings.rating, args)
+    for category in ("artist", "character", "series"):
+        if not any(tag.startswith(f"{category}:") for tag in image_tags):
+            image_tags.append(f"{category}:tagme")
+    return ", ".join(sorted(set(image_tags))), rating
+
+def pipeline_row(sample, pipeline, args):
+    """The same sample through TagPipeline and finalize_tags: (tag string, rating)."""
+    post, sidecar, extra = sample
+    return finalize_tags(pipeline.build(post, sidecar, extra), post.get("rating", []),
+                         pipeline, args)[:2]
+
+def bench_tags(args):
+    """
+    Per-image cost of the legacy tag chain versus the precompiled TagPipeline,
+    and how many CSV tag strings and ratings differ between them.
+    """
+    mappings, dynamic, samples = synthetic_tag_corpus(args.images)
+    row_args = argparse.Namespace(pretags=["imported"], smax=args.smax, qmax=args.qmax)
+
+    pipeline, setup = timed_call(TagPipeline, mappings, dynamic, row_args.pretags)
+
+    times = {"legacy": [], "pipeline": []}
+    differing = {"tags": 0, "ratings": 0}
+    for sample in samples:
+        expected, elapsed = timed_call(legacy_row, sample, mappings, dynamic, row_args)
+        times["legacy"].append(elapsed)
+        actual, elapsed = timed_call(pipeline_row, sample, pipeline, row_args)
+        times["pipeline"].append(elapsed)
+        differing["tags"] += expected[0] != actual[0]
+        differing["ratings"] += expected[1] != actual[1]
+
+    results = {name: summarize(latencies) for name, latencies in times.items()}
+    results["pipeline"]["setup_ms"] = round(setup * 1000, 3)
+    results["differing"] = differing
+    for name in times:
+        print(f"  {name:<8} {results[name]}")
+    print(f"  tag strings differing: {differing['tags']}, ratings differing: "
+          f"{differing['ratings']} (sidecar tags are no longer rated twice)")
+    return results
+
+def legacy_rating(image_tags, rating_map, smax, qmax):
+    """The per-tag loop update_ratings.py used before RatingEngine."""
+    total_score = 0
+    for tag in image_tags:
+        weight = rating_map.get(tag)
+        if weight is None:
+            continue
+        if weight == 1:
+            if total_score == 0:
+                total_score = 1
+        elif weight > 1:
+            total_score += weight
+    return rating_from_score(total_score, smax, qmax) if total_score > 0 else ""
+
+def csr_batch(images, lookup):
+    """(indptr, indices) for per-image tag lists, dropping tags `lookup` doesn't know."""
+    indptr, indices = [0], []
+    for image_tags in images:
+        indices.extend(i for i in map(lookup, image_tags) if i is not None)
+        indptr.append(len(indices))
+    return indptr, indices
+
+def bench_ratings(args):
+    """Per-image rating loop versus one vectorised pass over CSR batches."""
+    rng = random.Random(0)
+    rating_map = {f"tag_{i}": rng.choice((1, 10, 20, 25, 30, 50, 100, 150, 250))
+                  for i in range(30000)}
+    names = list(rating_map) + [f"unrated_{i}" for i in range(20000)]
+    images = [rng.sample(names, rng.randint(5, 60)) for _ in range(args.images)]
+
+    expected, legacy = timed_call(
+        lambda: [legacy_rating(tags, rating_map, args.smax, args.qmax) for tags in images])
+    engine, setup = timed_call(RatingEngine, rating_map)
+    # Building the CSR arrays mirrors streaming rows out of Postgres in update_ratings.py
+    csr, build = timed_call(csr_batch, images, engine.vocab.get)
+    letters, scoring = timed_call(
+        lambda: engine.letters(engine.score_csr(*csr), args.smax, args.qmax))
+
+    mismatches = sum(a != b for a, b in zip(expected, letters))
+    results = {
+        "images": len(images),
+        "legacy_s": round(legacy, 3),
+        "csr_build_s": round(build, 3),
+        "engine_score_s": round(scoring, 3),
+        "engine_setup_ms": round(setup * 1000, 3),
+        "mismatches": mismatches
+    }
+    print(f"  {results}")
+    return results
+
+def synthetic_mining_corpus(images, seed=0):
+    """Canonical tag sets plus sidecars in which a share of tags is renamed or missing."""
+    rng = random.Random(seed)
+    vocab = [f"tag_{i}" for i in range(20000)]
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocab))))
+    # Every tenth tag has a sidecar-side spelling that should map back to it
+    renamed = {t: f"{t}_alt" for t in vocab[::10]}
+    corpus = []
+    for _ in range(images):
+        canonical = set(rng.choices(vocab, cum_weights=weights, k=rng.randint(5, 40)))
+        sidecar = [renamed.get(t, t) if rng.random() < 0.9 else t
+                   for t in canonical if rng.random() < 0.6]
+        sidecar += rng.choices(vocab, k=rng.randint(0, 3))
+        corpus.append((sidecar, canonical))
+    return corpus
+
+def _mine_corpus(matrix, corpus, min_samples):
+    start = time.perf_counter()
+    for sidecar, canonical in corpus:
+        matrix.add(sidecar, canonical)
+    best = matrix.finish().best_matches(min_samples)
+    elapsed = time.perf_counter() - start
+    name = matrix.vocab.name
+    return {name(s): (name(c), score) for s, (c, score, _) in best.items()}, elapsed
+
+def bench_mining(args):
+    """Exact sparse co-occurrence mining versus MinHash/LSH candidates: speed and recall."""
+    corpus = synthetic_mining_corpus(args.images)
+    exact, exact_s = _mine_corpus(CoOccurrenceMatrix(), corpus, args.min_samples)
+    wanted = {s: best for s, best in exact.items() if best[1] >= args.confidence}
+    results = {"images": len(corpus), "exact_s": round(exact_s, 3),
+               "confident_matches": len(wanted), "lsh": {}}
+    print(f"  exact    {exact_s:.3f}s, {len(wanted)} matches >= {args.confidence}")
+
+    for setting in args.lsh.split(","):
+        bands, rows = (int(v) for v in setting.split("x"))
+        matrix = MinHashMatrix(bands, rows)
+        approx, approx_s = _mine_corpus(matrix, corpus, args.min_samples)
+        found = sum(approx.get(s) == best for s, best in wanted.items())
+        results["lsh"][setting] = {
+            "seconds": round(approx_s, 3),
+            "speedup": round(exact_s / approx_s, 2) if approx_s else None,
+            "candidates": matrix.candidates,
+            "recall": round(found / len(wanted), 4) if wanted else None,
+        }
+        print(f"  lsh {setting:<5} {results['lsh'][setting]}")
+    return results
+
+def import_time_ms(module):
+    """Cumulative import time of `module` in a fresh interpreter (-X importtime), or None."""
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=SCRIPT_DIR, capture_output=True, text=True, check=False)
+    if res.returncode != 0:
+        return None
+    for line in reversed(res.stderr.splitlines()):
+        if not line.startswith("import time:"):
+            continue
+        _, _, cumulative, name = (part.strip() for part in line.replace(":", "|", 1).split("|"))
+        if name == module:
+            return round(int(cumulative) / 1000, 1)
+    return None
+
+def bench_startup(args):
+    """Cold-start import cost of every CLI script, checked against a budget."""
+    scripts = sorted(p.stem for p in SCRIPT_DIR.glob("*.py") if p.stem != "benchmark")
+    results = {"budget_ms": args.budget_ms, "scripts": {}, "over_budget": [], "errors": []}
+    for name in scripts:
+        # Best of a few runs; the first can include writing .pyc files
+        timings = [import_time_ms(name) for _ in range(args.repeat)]
+        if None in timings:
+            results["errors"].append(name)
+            print(f"  {name:<24} import failed")
+            continue
+        best = min(timings)
+        results["scripts"][name] = best
+        flag = ""
+        if best > args.budget_ms:
+            results["over_budget"].append(name)
+            flag = "  <-- over budget"
+        print(f"  {name:<24} {best:>8.1f} ms{flag}")
+    return results
+
+def synthetic_posts(count, seed=0):
+    """Deterministic (md5, post) pairs in the shape parse_line produces."""
+    rng = random.Random(seed)
+    posts = []
+    for i in range(count):
+        md5 = hashlib.md5(f"post-{seed}-{i}".encode()).hexdigest()
+        posts.append((md5, {
+            "pixel_hash": hashlib.md5(f"pixels-{seed}-{i}".encode()).hexdigest(),
+            "rating": rng.choice("gsqe"),
+            "source": f"https://i.pximg.net/img-original/img/2024/01/01/00/00/00/{i}_p0.png",
+            "general": [f"tag_{rng.randint(0, 5000)}" for _ in range(rng.randint(10, 40))],
+            "character": [f"char_{rng.randint(0, 1999)}" for _ in range(rng.randint(0, 2))],
+            "artist": [f"artist_{rng.randint(0, 1499)}"],
+            "series": [f"series_{rng.randint(0, 299)}"]
+        }))
+    return posts
+
+def synthetic_wiki_bodies(count, seed=0):
+    """Deterministic DText bodies covering headers, ToCs, links and lists."""
+    rng = random.Random(seed)
+    bodies = []
+    for i in range(count):
+        lines = ["[expand=Table of Contents]",
+                 '* 1. "Appearance":#dtext-appearance', '** 1.1. "Outfits":#dtext-outfits',
+                 "[/expand]", "", f"h2#appearance. Appearance of tag_{i}"]
+        for j in range(rng.randint(5, 40)):
+            lines.append(rng.choice((
+                f'See "tag {j}":/wiki/tag_{j} and [[some tag {j}|label]].',
+                f'<a href="https://example.com/{j}">link {j}</a> !post #{j}',
+                f"* item {j}", f"** nested item {j}", "", "", "",
+                f"h4. Section {j}", "Premium users can see this line.")))
+        bodies.append((f"tag_{i}", "\n".join(lines)))
+    return bodies
+
+def _write_fixture_image(image_dir, i, rng):
+    """
+    Saves the i-th fixture image: md5-named, gelbooru-named (pixel hash only) or
+    unknown, in that rotation. Returns (path, md5 of the file).
+    """
+    from PIL import Image # pylint: disable=import-outside-toplevel
+    width, height = rng.choice(((640, 480), (1200, 900), (800, 2400), (2000, 1500)))
+    image = Image.frombytes("RGB", (width // 8, height // 8),
+                            rng.randbytes(width // 8 * height // 8 * 3))
+    image = image.resize((width, height))
+    ext = ".png" if i % 2 else ".jpg"
+    tmp = image_dir / f"tmp{ext}"
+    tmp.parent.mkdir(parents=True, exist_ok=True)
+    image.save(tmp)
+    md5 = hashlib.md5(tmp.read_bytes()).hexdigest()
+
+    subdir = image_dir / f"set_{i % 4}"
+    subdir.mkdir(exist_ok=True)
+    kind = i % 3
+    stem = md5 if kind == 0 else (f"gelbooru_{i}_{i:08x}" if kind == 1 else f"file_{i}")
+    path = subdir / f"{stem}{ext}"
+    tmp.rename(path)
+    return path, md5
+
+def build_fixtures(root, images, posts, seed=0):
+    """
+    Writes the suite's fixed fixtures under `root`, reusing them if they match.
+
+    An image tree with sidecars (md5-named, pixel-hash-only and unknown files in
+    equal parts) and a posts cache that knows the first two thirds of it, padded
+    with `posts` synthetic rows.
+    """
+    root = Path(root)
+    params = {"version": FIXTURE_VERSION, "images": images, "posts": posts, "seed": seed}
+    marker = root / "fixtures.json"
+    if marker.exists() and json.loads(marker.read_text(encoding="utf-8")) == params:
+        return root
+    shutil.rmtree(root, ignore_errors=True)
+
+    rng = random.Random(seed)
+    cache_rows = synthetic_posts(posts, seed)
+    template = cache_rows[0][1]
+    for i in range(images):
+        path, md5 = _write_fixture_image(root / "images", i, rng)
+        kind = i % 3
+        if kind != 2:
+            path.with_suffix(".txt").write_text(
+                ", ".join(f"tag_{rng.randint(0, 5000)}" for _ in range(rng.randint(3, 15))),
+                encoding="utf-8")
+
+        if kind == 0:
+            cache_rows.append((md5, dict(template, pixel_hash="")))
+        elif kind == 1:
+            # Only the pixel hash is known, as for re-encoded files
+            pixel_hash = compute_danbooru_pixel_hash(path)
+            cache_rows.append((hashlib.md5(path.name.encode()).hexdigest(),
+                               dict(template, pixel_hash=pixel_hash)))
+
+    write_to_sqlite(cache_rows, root / "posts_cache.db")
+    marker.write_text(json.dumps(params), encoding="utf-8")
+    return root
+
+def fixture_images(root):
+    """The fixture image paths, in a stable order."""
+    return sorted(p for p in (Path(root) / "images").rglob("*") if p.suffix in (".png", ".jpg"))
+
+def _timed(items, func):
+    """Calls func on every item; returns throughput, latency stats and peak RSS."""
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    own, _ = peak_rss_mb()
+    return {**summarize(latencies), "items_per_s": round(len(latencies) / elapsed, 1),
+            "peak_rss_mb": own}
+
+def _stage_write_to_sqlite(_root, params):
+    rows = synthetic_posts(params["posts"], params["seed"] + 1)
+    batches = [rows[i:i + 1000] for i in range(0, len(rows), 1000)]
+    with tempfile.TemporaryDirectory() as tmp, redirect_stdout(io.StringIO()):
+        db_path = Path(tmp) / "posts_cache.db"
+        result = _timed(batches, lambda batch: write_to_sqlite(batch, db_path))
+    result["items_per_s"] = round(len(rows) / result["total_s"], 1)
+    return {**result, "unit": "posts"}
+
+def _stage_resolve_post(root, _params):
+    with tempfile.TemporaryDirectory() as tmp:
+        # resolve_post adds unknown files to the cache, so work on a copy
+        cache = shutil.copy(Path(root) / "posts_cache.db", tmp)
+        return _timed(fixture_images(root),
+                      lambda img: resolve_post(img, None, False, None, cache))
+
+def _stage_compute_danbooru_pixel_hash(root, _params):
+    return _timed(fixture_images(root), compute_danbooru_pixel_hash)
+
+def _stage_compile_metadata(root, params):
+    mappings, dynamic, _ = synthetic_tag_corpus(0, params["seed"])
+    pipeline = TagPipeline(mappings, dynamic, ["imported"])
+    args = argparse.Namespace(smax=50, qmax=250)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = shutil.copy(Path(root) / "posts_cache.db", tmp)
+        resolved = [resolve_post(img, None, False, None, cache) for img in fixture_images(root)]
+    return _timed(resolved, lambda res: compile_metadata(ResolutionData(*res), pipeline, args))
+
+def _stage_clean_wiki_body(_root, params):
+    # Imported here: the wiki importer pulls in requests and psycopg2
+    from import_danbooru_wikis import clean_wiki_body # pylint: disable=import-outside-toplevel
+    bodies = synthetic_wiki_bodies(params["wikis"], params["seed"])
+    return _timed(bodies, lambda item: clean_wiki_body(item[1], item[0]))
+
+def _run_suite_stage(name, root, params):
+    os.chdir(SCRIPT_DIR)
+    reset_peak_rss()
+    return globals()[f"_stage_{name}"](root, params)
+
+def git_commit():
+    """Short hash of the checked-out commit, or None outside a git tree."""
+    res = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                         capture_output=True, text=True, check=False)
+    return res.stdout.strip() or None
+
+def bench_suite(args):
+    """Throughput and peak memory of each import hot path on fixed fixtures."""
+    params = {"images": args.images, "posts": args.posts, "wikis": args.wikis, "seed": 0}
+    stages = args.stages.split(",") if args.stages else SUITE_STAGES
+    results = {
+        "meta": {"commit": git_commit(), "python": platform.python_version(),
+                 "machine": platform.machine(), "cpus": os.cpu_count(), **params},
+        "stages": {}, "errors": []
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = build_fixtures(args.fixtures or Path(tmp) / "fixtures",
+                              args.images, args.posts, params["seed"])
+        for name in stages:
+            try:
+                stage = in_fresh_process(_run_suite_stage, name, str(root), params)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                results["errors"].append(name)
+                print(f"  {name:<28} failed: {e}")
+                continue
+            results["stages"][name] = stage
+            print(f"  {name:<28} {stage['items_per_s']:>10,.1f}/s  "
+                  f"p95 {stage['p95_ms']:>8.3f} ms  peak {stage['peak_rss_mb']:>7.1f} MB")
+    return results
+
+def bench_compare(args):
+    """Per-stage change between two suite result files (same machine)."""
+    base = json.loads(Path(args.base).read_text(encoding="utf-8"))
+    new = json.loads(Path(args.new).read_text(encoding="utf-8"))
+    results = {"base": base["meta"].get("commit"), "new": new["meta"].get("commit"),
+               "stages": {}, "regressions": []}
+    for name, after in new["stages"].items():
+        before = base["stages"].get(name)
+        if not before:
+            continue
+        speed = after["items_per_s"] / before["items_per_s"] - 1
+        memory = after["peak_rss_mb"] / before["peak_rss_mb"] - 1
+        results["stages"][name] = {"throughput_change": round(speed, 3),
+                                   "peak_rss_change": round(memory, 3)}
+        flag = ""
+        if speed < -args.threshold or memory > args.threshold:
+            results["regressions"].append(name)
+            flag = "  <-- regression"
+        print(f"  {name:<28} throughput {speed:+7.1%}  peak RSS {memory:+7.1%}{flag}")
+    return results
+
+def main(args):
+    """Runs the selected benchmark and optionally stores the result as JSON."""
+    results = args.func(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"\n[✓] Results written to {args.output}")
+    failed = results.get("over_budget") or results.get("regressions")
+    if failed:
+        print(f"\n[WARNING] Checks failed for: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for shimmie2-tools hot paths.")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    subparsers = parser.add_subparsers(required=True)
+
+    thumbs = subparsers.add_parser("thumbnails", help="Per-thumbnail latency and peak RSS")
+    thumbs.add_argument("--images", required=True, help="Directory of sample images")
+    thumbs.add_argument("--limit", type=int, default=200, help="Max images to thumbnail")
+    thumbs.set_defaults(func=bench_thumbnails)
+
+    tags = subparsers.add_parser("tags", help="Per-image tag compilation cost")
+    tags.add_argument("--images", type=int, default=20000, help="Synthetic images to tag")
+    tags.add_argument("--qmax", type=int, default=250, help="Questionable threshold")
+    tags.add_argument("--smax", type=int, default=50, help="Safe threshold")
+    tags.set_defaults(func=bench_tags)
+
+    ratings = subparsers.add_parser("ratings", help="Bulk rating throughput")
+    ratings.add_argument("--images", type=int, default=200000, help="Synthetic images to rate")
+    ratings.add_argument("--qmax", type=int, default=50, help="Questionable threshold")
+    ratings.add_argument("--smax", type=int, default=10, help="Safe threshold")
+    ratings.set_defaults(func=bench_ratings)
+
+    mining = subparsers.add_parser("mining", help="Exact vs MinHash/LSH equivalency mining")
+    mining.add_argument("--confidence", type=float, default=0.5,
+                        help="Only matches scoring this high count towards recall")
+    mining.add_argument("--images", type=int, default=50000, help="Synthetic images to mine")
+    mining.add_argument("--lsh", default="32x2,24x3,16x4",
+                        help="Comma-separated BANDSxROWS settings to compare")
+    mining.add_argument("--min-samples", type=int, default=10, help="Min sidecar tag count")
+    mining.set_defaults(func=bench_mining)
+
+    startup = subparsers.add_parser("startup", help="Import-time budget for every CLI script")
+    startup.add_argument("--budget-ms", type=float, default=250,
+                         help="Max cumulative import time per script")
+    startup.add_argument("--repeat", type=int, default=3, help="Runs per script (best is kept)")
+    startup.set_defaults(func=bench_startup)
+
+    suite = subparsers.add_parser("suite", help="Throughput and peak RSS per import stage")
+    suite.add_argument("--fixtures", help="Keep (and reuse) the fixtures in this directory")
+    suite.add_argument("--images", type=int, default=120, help="Fixture images")
+    suite.add_argument("--posts", type=int, default=20000, help="Synthetic posts in the cache")
+    suite.add_argument("--stages", help=f"Comma-separated subset of: {', '.join(SUITE_STAGES)}")
+    suite.add_argument("--wikis", type=int, default=2000, help="Synthetic wiki bodies")
+    suite.set_defaults(func=bench_suite)
+
+    compare = subparsers.add_parser("compare", help="Compare two suite result files")
+    compare.add_argument("base", help="Earlier --output JSON")
+    compare.add_argument("new", help="Later --output JSON")
+    compare.add_argument("--threshold", type=float, default=0.1,
+                         help="Relative slowdown / memory growth that counts as a regression")
+    compare.set_defaults(func=bench_compare)
+
+    main(parser.parse_args())
@@ -1,23 +1,32 @@
 """This is designed to help with batch importing into shimmie2"""
 from collections import namedtuple
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
 import argparse
 import csv
-import re
-import sqlite3
-import tqdm
+import itertools
+import os
 
-from PIL import Image
+from functions.core import lazy_import
 from functions.utils import (
     get_cpu_threads, resolve_best_source, rating_from_score,
-    resolve_post, save_post_to_cache, process_webp, apply_tag_curation,
+    resolve_post, save_post_to_cache, process_webp,
     get_video_resolution, VIDEO_EXTS, get_sidecar_tags,
-    get_shimmie_db_credentials, get_cache_conn, mine_tag_equivalencies,
-    load_dynamic_mappings
+    get_shimmie_db_credentials, get_cache_conn, close_pg_pools,
+    load_dynamic_mappings, ProbeCache, SidecarCache
 )
-
-Image.MAX_IMAGE_PIXELS = None
+from functions.mining import (
+    GlobalContextCache, MiningOptions, MiningStores, mine_tag_equivalencies
+)
+from functions.mapping_index import open_mapping_index, INT_VALUES
+from functions.source_resolver import SourceResolver, load_source_priority
+from functions.tag_pipeline import TagPipeline
+from functions.tag_relations import TagRelations, TagRelationStore
+from functions.tag_stats import TagStats
+from functions.thumb_queue import ThumbnailQueue
+
+futures = lazy_import("concurrent.futures")
+Image = lazy_import("PIL.Image", on_load=lambda im: setattr(im, "MAX_IMAGE_PIXELS", None))
+tqdm = lazy_import("tqdm")
 ALLOWED_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".jxl", ".avif"}
 
 # Paths setup
@@ -27,10 +36,21 @@ CDB_PATH = DB_DIR / "characters.db"
 ADB_PATH = DB_DIR / "artists.db"
 TAG_DB_PATH = DB_DIR / "tag_rating_dominant.db"
 CACHE_PATH = DB_DIR / "posts_cache.db"
+PROBE_CACHE_PATH = DB_DIR / "media_probe.db"
+SIDECAR_CACHE_PATH = DB_DIR / "sidecar_cache.db"
+MINING_CONTEXT_PATH = DB_DIR / "mining_context.db"
+MINING_STATE_PATH = DB_DIR / "mining_state.db"
+CDB_INDEX_PATH = DB_DIR / "characters.idx"
+ADB_INDEX_PATH = DB_DIR / "artists.idx"
+TAG_INDEX_PATH = DB_DIR / "tag_rating_dominant.idx"
+TAG_RELATIONS_PATH = DB_DIR / "tag_relations.db"
+TAG_STATS_PATH = DB_DIR / "tag_stats.db"
 
 # Data Structures
-ResolutionData = namedtuple('ResolutionData', ['image', 'post', 'md5', 'px_hash', 'exists'])
+ResolutionData = namedtuple('ResolutionData',
+                            ['image', 'post', 'md5', 'px_hash', 'exists', 'media'])
 Mappings = namedtuple('Mappings', ['char', 'artist', 'rating'])
+Caches = namedtuple('Caches', ['probe', 'sidecar', 'thumb_queue', 'resolver'])
 
 def collect_files(image_path, video_path, batch_size):
     """Finds all valid files from provided paths, handles duplicates, and chunks them."""
@@ -68,6 +88,12 @@ def collect_files(image_path, video_path, batch_size):
     batches = [final_files[i:i + batch_size] for i in range(0, len(final_files), batch_size)]
     return final_files, batches
 
+def use_db_dir(db_dir):
+    """Points every database path at `db_dir`, e.g. the output of generate_dataset.py."""
+    for name, value in list(globals().items()):
+        if name.endswith("_PATH") and isinstance(value, Path) and value.parent == DB_DIR:
+            globals()[name] = Path(db_dir) / value.name
+
 def check_paths():
     """Validates existence of required database files."""
     if not CDB_PATH.is_file():
@@ -80,56 +106,22 @@ def check_paths():
         raise FileNotFoundError(f"Cache not found: {CACHE_PATH}")
 
 def load_mappings():
-    """Loads character, artist, and tag rating mappings from SQLite."""
-    char_map = {}
-    with sqlite3.connect(CDB_PATH) as conn:
-        for row in conn.execute("SELECT * FROM data"):
-            if len(row) >= 2 and row[0].strip() and row[1].strip():
-                char_map[row[0].strip()] = row[1].strip()
-
-    artist_map = {}
-    with sqlite3.connect(ADB_PATH) as conn:
-        for row in conn.execute("SELECT * FROM data"):
-            if len(row) >= 2 and row[0].strip() and row[1].strip():
-                artist_map[row[0].strip()] = row[1].strip()
-
-    rating_map = {}
-    with sqlite3.connect(TAG_DB_PATH) as conn:
-        for row in conn.execute("SELECT * FROM dominant_tag_ratings"):
-            if len(row) >= 2:
-                rating_map[row[0].strip()] = row[1]
+    """Opens the character, artist, and tag rating mapping indexes (built from SQLite)."""
+    char_map = open_mapping_index(CDB_PATH, CDB_INDEX_PATH, "SELECT * FROM data")
+    artist_map = open_mapping_index(ADB_PATH, ADB_INDEX_PATH, "SELECT * FROM data")
+    rating_map = open_mapping_index(TAG_DB_PATH, TAG_INDEX_PATH,
+                                    "SELECT * FROM dominant_tag_ratings", INT_VALUES)
 
     print(f"[INFO] Loaded {len(char_map):,} chars, {len(artist_map):,} artists.")
     return Mappings(char_map, artist_map, rating_map)
 
-def enrich_tags(initial_tags, mappings):
-    """Adds prefixes (series:, character:, artist:) based on mappings."""
-    # First pass: Add inferred tags, then remove the bare tag if it was successfully prefixed
-    temp_tags = []
-    for tag in initial_tags:
-        temp_tags.append(tag)
-        if tag in mappings.char:
-            inferred = mappings.char[tag]
-            temp_tags.append(f"character:{tag}")
-            if isinstance(inferred, (list, tuple, set)):
-                temp_tags.extend(f"series:{t}" for t in inferred)
-            else:
-                temp_tags.append(f"series:{inferred}")
-
-    # Second pass: remove bare tags that were identified as characters
-    stage_1 = [t for t in temp_tags if t not in mappings.char]
-
-    # Third pass: Handle artists
-    final_tags = []
-    for tag in stage_1:
-        final_tags.append(tag)
-        if tag in mappings.artist:
-            final_tags.append(f"artist:{tag}")
-
-    return [t for t in final_tags if t not in mappings.artist]
-
-def calculate_rating(tags, post_rating_list, rating_map, smax, qmax):
-    """Determines rating based on tag weights or fallback to database if available"""
+def calculate_rating(tags, post_rating_list, rating_map, args, tagme="tagme"):
+    """
+    Determines rating based on tag weights or fallback to database if available.
+    `tags` may be strings or interned IDs, as long as rating_map and tagme match;
+    `args` supplies the smax/qmax thresholds.
+    """
+    smax, qmax = args.smax, args.qmax
     total_score = 0
     for tag in tags:
         weight = rating_map.get(tag, 0)
@@ -140,7 +132,7 @@ def calculate_rating(tags, post_rating_list, rating_map, smax, qmax):
             total_score = 1
 
     rating_letter = None
-    if 0 < total_score <= smax and "tagme" in tags:
+    if 0 < total_score <= smax and tagme in tags:
         rating_letter = "?"
     elif total_score > 0:
         rating_letter = rating_from_score(total_score, smax, qmax)
@@ -158,20 +150,22 @@ def calculate_rating(tags, post_rating_list, rating_map, smax, qmax):
 
     return "s" if rating_letter == "g" else rating_letter
 
-def clean_resolution_tags(tags, image_path):
-    """Calculates resolution tags based on pixel count and dimensions."""
-    res_group = {"lowres", "highres", "absurdres",
-                 "incredibly_absurdres", "wide_image", "tall_image"}
-    res_tags = [t for t in tags if not t in res_group]
-
+def get_dimensions(image_path, media=None):
+    """Returns (width, height) of an image or video, or (None, None) if unknown."""
+    # Reuse the buffer read during resolution when we have one
+    if media is not None:
+        return media.dimensions
     # Branch based on the file type
     if image_path.suffix.lower() in VIDEO_EXTS:
-        width, height = get_video_resolution(image_path)
-        if not width or not height:
-            return res_tags
-    else:
-        with Image.open(image_path) as img:
-            width, height = img.size
+        return get_video_resolution(image_path)
+    with Image.open(image_path) as img:
+        return img.size
+
+def resolution_tags(width, height):
+    """Resolution tags implied by the given dimensions."""
+    res_tags = []
+    if not width or not height:
+        return res_tags
 
     pixels = width * height
     ratio = width / height
@@ -195,53 +189,42 @@ def clean_resolution_tags(tags, image_path):
 
     return res_tags
 
-def compile_metadata(image, post, mappings, args, dynamic_mappings=None):
+def compile_metadata(res_data, pipeline, args, caches=None):
     """Generates the final tag string and rating letter."""
-    tags = []
-    tags.extend(args.pretags)
-    tags.extend(post.get("general", []))
-    tags.extend(f"character:{t}" for t in post.get("character", []))
-    tags.extend(f"series:{t}" for t in post.get("series", []))
-    tags.extend(f"artist:{t}" for t in post.get("artist", []))
-    tags.extend(get_sidecar_tags(image))
-
-    sidecar_tags = get_sidecar_tags(image)
-    tags.extend(sidecar_tags)
-
-    tags = enrich_tags(tags, mappings)
-    tags = clean_resolution_tags(tags, image)
+    image, post = res_data.image, res_data.post
+    extra_tags = resolution_tags(*get_dimensions(image, res_data.media))
 
     # --- Unified Source Resolution ---
-    best_source = resolve_best_source(post.get("source"), image)
+    best_source = resolve_best_source(post.get("source"), image,
+                                      caches.resolver if caches else None)
     if best_source:
-        tags.append(f"source:{best_source}")
-
-    # Clean whitespace and strip redundant _series) suffixes
-    tags = [re.sub(r'\s+', '_', tag.strip()) for tag in tags]
-    tags = [re.sub(r'_series\)$', ')', tag.strip()) for tag in tags]
+        extra_tags.append(f"source:{best_source}")
 
-    apply_tag_curation(tags, dynamic_mappings)
+    sidecar_tags = get_sidecar_tags(image, caches.sidecar if caches else None)
+    tag_ids = pipeline.build(post, sidecar_tags, extra_tags)
+    tag_str, rating, tags = finalize_tags(tag_ids, post.get("rating", []), pipeline, args)
+    return tag_str, rating, tags, best_source
 
-    if len(tags) < 15:
-        tags.append("tagme")
-    rating = calculate_rating(tags, post.get("rating", []), mappings.rating, args.smax, args.qmax)
-    if not any(tag.startswith("artist:") for tag in tags):
-        tags.append("artist:tagme")
-    if not any(tag.startswith("character:") for tag in tags):
-        tags.append("character:tagme")
-    if not any(tag.startswith("series:") for tag in tags):
-        tags.append("series:tagme")
+def finalize_tags(tag_ids, post_rating_list, pipeline, args):
+    """Adds the tagme placeholders, rates the image and returns (tag string, rating, tags)."""
+    if len(tag_ids) < 15:
+        tag_ids.append(pipeline.tagme)
+    rating = calculate_rating(tag_ids, post_rating_list, pipeline.weights, args, pipeline.tagme)
+    tag_ids.extend(pipeline.missing_placeholders(tag_ids))
 
-    return ", ".join(sorted(set(tags))), rating, tags, best_source
+    # Back to strings only for the CSV and the cache
+    tags = pipeline.vocab.decode(tag_ids)
+    return ", ".join(sorted(set(tags))), rating, tags
 
-def process_image_result(image, res_data, args, mappings, dynamic_mappings):
+def process_image_result(image, res_data, args, pipeline, caches=None):
     """
     Processes a single resolved file.
     Args:
         file (Path): Path to file.
-        res_data (ResolutionData): NamedTuple (post, md5, px_hash, exists).
+        res_data (ResolutionData): NamedTuple (post, md5, px_hash, exists, media).
         args (Namespace): CLI arguments.
-        mappings (Mappings): NamedTuple (char, artist, rating).
+        pipeline (TagPipeline): Tag pipeline prepared for this run.
+        caches (Caches): Sidecar store and source resolver for this run, or None.
     Returns:
         tuple: (csv_row_list, thumb_path_str_or_None)
     """
@@ -254,16 +237,16 @@ def process_image_result(image, res_data, args, mappings, dynamic_mappings):
     else:
         base_path = Path(args.video_path)
     rel_path = image.relative_to(base_path)
-    thumb_path = Path(args.prefix) / "thumbnails" / rel_path if args.thumbnail else ""
+    thumb_rel = content_addressed_path(res_data.md5) if args.thumb_layout == "md5" else rel_path
+    thumb_path = Path(args.prefix) / "thumbnails" / thumb_rel if args.thumbnail else ""
 
     # Check if exists in DB (skip metadata gen if so)
     if res_data.exists:
-        thumb_file = Path(args.image_path) / "thumbnails" / rel_path
+        thumb_file = get_thumbnail_path(image, args, res_data.md5)
         return None, str(thumb_file) if args.thumbnail else None
 
     # New Image Logic
-    tag_str, rating, tag_list, best_source = compile_metadata(image, res_data.post,
-                                                              mappings, args, dynamic_mappings)
+    tag_str, rating, tag_list, best_source = compile_metadata(res_data, pipeline, args, caches)
 
     if args.update_cache:
         save_post_to_cache(res_data, rating, tag_list, best_source, CACHE_PATH)
@@ -289,6 +272,10 @@ def print_summary(args):
     print(f"📦  Batch Size:      {args.batch}")
     print(f"🧵  Threads:         {args.threads}")
     print(f"📂  Prefix:          {args.prefix}")
+    if args.source_priority:
+        print(f"🔗  Source Priority: {args.source_priority}")
+    if args.thumbnail:
+        print(f"🖼️  Thumb Layout:    {args.thumb_layout}")
     print()
 
 def write_output(base_path, rows):
@@ -301,7 +288,7 @@ def write_output(base_path, rows):
 
 def resolve_batch_metadata(batch, args):
     """Handles the IO-bound task of resolving posts for a batch."""
-    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+    with futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
         resolver = executor.map(
             lambda img: resolve_post(img, args.spath, args.skip_existing,
                                      args.dbuser, CACHE_PATH),
@@ -314,31 +301,50 @@ def generate_thumbnails(tasks, threads):
     """Handles the CPU-bound task of processing images."""
     if not tasks:
         return
-    with ProcessPoolExecutor(max_workers=threads) as imgpro:
+    with futures.ProcessPoolExecutor(max_workers=threads) as imgpro:
         list(imgpro.map(process_webp, tasks))
 
-def get_thumbnail_path(img, args):
+def content_addressed_path(md5):
+    """Relative thumbnail path for the md5 layout, e.g. ab/cd/abcd....webp"""
+    return Path(md5[:2]) / md5[2:4] / f"{md5}.webp"
+
+def get_thumbnail_path(img, args, md5=None):
     """Helper to determine the correct thumbnail path to save local variables."""
     if args.image_path and img.is_relative_to(args.image_path):
-        return Path(args.image_path) / "thumbnails" / img.relative_to(args.image_path)
-    return Path(args.video_path) / "thumbnails" / img.relative_to(args.video_path)
-
-def process_batches(batches, mappings, args, dynamic_mappings):
+        base_path = Path(args.image_path)
+    else:
+        base_path = Path(args.video_path)
+    if md5 and args.thumb_layout == "md5":
+        return base_path / "thumbnails" / content_addressed_path(md5)
+    return base_path / "thumbnails" / img.relative_to(base_path)
+
+def index_thumbnails(args):
+    """Collects every existing thumbnail path with a single scan per thumbnails directory."""
+    index = set()
+    for base in (args.image_path, args.video_path):
+        if not base:
+            continue
+        root = Path(base) / "thumbnails"
+        if root.is_dir():
+            for dirpath, _, filenames in os.walk(root):
+                index.update(os.path.join(dirpath, name) for name in filenames)
+    return index
+
+def process_batches(batches, pipeline, args, caches):
     """Handles the batch processing logic."""
     csv_rows = []
-    existing_thumbs = set()
+    existing_thumbs = index_thumbnails(args) if args.thumbnail else set()
 
     for batch in tqdm.tqdm(batches, desc="Image batches", position=1, leave=False):
         results = resolve_batch_metadata(batch, args)
         thumb_tasks = []
 
+        caches.probe.probe([res[5] for res in results], args.threads)
+
         for img, res_tuple in zip(batch, results):
             res_data = ResolutionData(*res_tuple)
 
-            # Line break added here to fix line-too-long
-            row, thumb_key = process_image_result(
-                img, res_data, args, mappings, dynamic_mappings
-            )
+            row, thumb_key = process_image_result(img, res_data, args, pipeline, caches)
 
             if thumb_key:
                 existing_thumbs.add(thumb_key)
@@ -346,26 +352,91 @@ def process_batches(batches, mappings, args, dynamic_mappings):
             if row:
                 csv_rows.append(row)
                 if args.thumbnail:
-                    t_src = get_thumbnail_path(img, args)
-                    if str(t_src) not in existing_thumbs and not t_src.is_file():
+                    t_src = get_thumbnail_path(img, args, res_data.md5)
+                    if str(t_src) not in existing_thumbs:
+                        # Duplicates in the md5 layout share a path, so queue each once
+                        existing_thumbs.add(str(t_src))
                         thumb_tasks.append((img, t_src))
 
-        generate_thumbnails(thumb_tasks, args.threads)
+        if caches.thumb_queue:
+            # Hand off to thumbnail_worker.py instead of blocking the CSV run
+            caches.thumb_queue.enqueue(thumb_tasks)
+        else:
+            generate_thumbnails(thumb_tasks, args.threads)
 
     return csv_rows
 
 def run_mining_mode(args, files, mappings):
     """Isolates the mining phase to reduce local variables in main()."""
     db_conn = get_shimmie_db_credentials(args.spath)
-    with get_cache_conn(CACHE_PATH) as sqlite_conn:
-        mine_tag_equivalencies(
-            image_list=files,
-            conns=(db_conn, sqlite_conn),
-            output_path=args.create_map_csv,
-            mappings=mappings
-        )
+    sidecar_cache = SidecarCache(SIDECAR_CACHE_PATH)
+    sweep = None
+    if args.mining_sweep_samples or args.mining_sweep_confidence:
+        sweep = list(itertools.product(args.mining_sweep_samples or [10],
+                                       args.mining_sweep_confidence or [0.5]))
+    if args.mining_tag_stats and not TAG_STATS_PATH.is_file():
+        raise FileNotFoundError(f"Tag statistics not found: {TAG_STATS_PATH}")
+    context_cache = GlobalContextCache(MINING_CONTEXT_PATH, args.mining_context_ttl * 3600)
+    options = MiningOptions(
+        workers=args.threads,
+        memory_mb=args.mining_memory_mb,
+        spill_dir=args.mining_spill_dir,
+        lsh=args.mining_lsh,
+        state_path=MINING_STATE_PATH if args.mining_incremental else None,
+        sweep=sweep,
+        rebuild=args.mining_rebuild
+    )
+    try:
+        with get_cache_conn(CACHE_PATH) as sqlite_conn:
+            stores = MiningStores(
+                db_conn=db_conn,
+                sqlite_conn=sqlite_conn,
+                sidecar=sidecar_cache,
+                stats=TagStats.open(TAG_STATS_PATH) if args.mining_tag_stats else None,
+                context=context_cache
+            )
+            mine_tag_equivalencies(files, args.create_map_csv, mappings, options, stores)
+    finally:
+        sidecar_cache.close()
+        context_cache.close()
+        close_pg_pools()
     print("Mining complete. Exiting before standard import processing.")
 
+def open_caches(args):
+    """Opens the persistent stores and the source resolver used during a normal run."""
+    return Caches(
+        probe=ProbeCache(PROBE_CACHE_PATH),
+        sidecar=SidecarCache(SIDECAR_CACHE_PATH),
+        thumb_queue=ThumbnailQueue(args.thumb_queue) if args.thumb_queue else None,
+        resolver=SourceResolver(load_source_priority(args.source_priority))
+    )
+
+def close_caches(caches):
+    """Flushes and closes everything opened by open_caches."""
+    caches.probe.close()
+    caches.sidecar.close()
+    if caches.thumb_queue:
+        print(f"[INFO] Thumbnail queue: {caches.thumb_queue.counts()}")
+        caches.thumb_queue.close()
+
+def load_tag_relations(args):
+    """Syncs any given alias/implication dumps, then opens the closure if there is one."""
+    if args.aliases or args.implications:
+        store = TagRelationStore(TAG_RELATIONS_PATH)
+        try:
+            aliases, implications = store.update(args.aliases or (), args.implications or ())
+        finally:
+            store.close()
+        if aliases or implications:
+            print(f"[INFO] Tag relations updated ({aliases:,} alias and "
+                  f"{implications:,} implication antecedents changed).")
+    if not TAG_RELATIONS_PATH.exists():
+        return None
+    relations = TagRelations.open(TAG_RELATIONS_PATH)
+    print(f"[INFO] Loaded {len(relations.aliases):,} aliases, "
+          f"{len(relations.implications):,} implications.")
+    return relations
+
 def main(args):
     """The main execution flow."""
     check_paths()
@@ -388,8 +459,14 @@ def main(args):
     if args.use_map_csv:
         dynamic_mappings = load_dynamic_mappings(args.use_map_csv)
         print(f"[INFO] Loaded {len(dynamic_mappings)} dynamic tag mappings.")
+    pipeline = TagPipeline(mappings, dynamic_mappings, args.pretags,
+                           relations=load_tag_relations(args))
     # Process batches and get results
-    csv_rows = process_batches(batches, mappings, args, dynamic_mappings)
+    caches = open_caches(args)
+    try:
+        csv_rows = process_batches(batches, pipeline, args, caches)
+    finally:
+        close_caches(caches)
     csv_rows.sort()
 
     out_dir = args.image_path if args.image_path else args.video_path
@@ -398,19 +475,53 @@ def main(args):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Creates a CSV suitable for input into Shimmie2.")
+    parser.add_argument("--aliases", action="append",
+                        help="Danbooru tag_aliases dump (CSV/JSON); may be repeated")
     parser.add_argument("--batch", type=int, default=20, help="Batch size")
     parser.add_argument("--create-map", dest="create_map_csv",
                         help="Mine tags and create a CSV map at this path")
+    parser.add_argument("--db-dir", help="Read and write the .db files here instead of database/")
     parser.add_argument("--dbuser", default=None, help="Shimmie DB user")
     parser.add_argument("--images", dest="image_path", help="Path to images directory")
+    parser.add_argument("--implications", action="append",
+                        help="Danbooru tag_implications dump (CSV/JSON); may be repeated")
+    parser.add_argument("--mining-context-ttl", type=float, default=168,
+                        help="Hours before cached tag counts and wiki context are refetched")
+    parser.add_argument("--mining-incremental", action="store_true",
+                        help="Keep mining counts in database/mining_state.db and only count "
+                             "images added or removed since the last run")
+    parser.add_argument("--mining-lsh", type=lambda v: tuple(int(n) for n in v.split("x")),
+                        help="With --create-map, score only MinHash/LSH candidates (BANDSxROWS); "
+                             "not bounded by --mining-memory-mb")
+    parser.add_argument("--mining-memory-mb", type=float,
+                        help="With --create-map, spill pair counts to disk beyond this budget")
+    parser.add_argument("--mining-spill-dir",
+                        help="Where --mining-memory-mb spills go (default: system temp dir)")
+    parser.add_argument("--mining-rebuild", action="store_true",
+                        help="Recount database/mining_state.db from scratch, e.g. after tag "
+                             "changes in the DB (implies --mining-incremental)")
+    parser.add_argument("--mining-sweep-confidence",
+                        type=lambda v: [float(n) for n in v.split(",")],
+                        help="Sweep these minimum confidences (e.g. 0.4,0.5,0.6), one map each")
+    parser.add_argument("--mining-sweep-samples", type=lambda v: [int(n) for n in v.split(",")],
+                        help="Sweep these minimum sample sizes (e.g. 5,10,20), one map each")
+    parser.add_argument("--mining-tag-stats", action="store_true",
+                        help="Also weigh mappings against database/tag_stats.db "
+                             "(see build_tag_stats.py)")
     parser.add_argument("--prefix", default="import", help="Dir name inside Shimmie")
     parser.add_argument("--pretags", type=str, default="",
                         help="Comma-separated list of tags to prepend to all posts")
     parser.add_argument("--qmax", default=250, help="Max questionable rating.")
     parser.add_argument("--skip-existing", action="store_true", help="Check Shimmie for image")
     parser.add_argument("--smax", default=50, help="Max safe rating.")
+    parser.add_argument("--source-priority",
+                        help="JSON file of {\"domain\": score} source priorities (lower wins)")
     parser.add_argument("--spath", help="Path to shimmie root")
     parser.add_argument("--threads", type=int, default=get_cpu_threads() // 2, help="Thread count")
+    parser.add_argument("--thumb-layout", choices=["mirror", "md5"], default="mirror",
+                        help="mirror the source tree, or store thumbnails/ab/cd/<md5>.webp")
+    parser.add_argument("--thumb-queue",
+                        help="Queue thumbnails in this DB for thumbnail_worker.py")
     parser.add_argument("--thumbnail", action="store_true", help="Generate thumbnails")
     parser.add_argument("--update-cache", action="store_true", help="Flag to update the cache")
     parser.add_argument("--use-map", dest="use_map_csv",
@@ -422,6 +533,15 @@ if __name__ == "__main__":
         parser.error("You must provide at least one input path: --images or --videos")
     if preargs.skip_existing and not preargs.spath:
         parser.error("--spath is required when --skip-existing is set.")
+    if preargs.mining_rebuild:
+        preargs.mining_incremental = True
+    if preargs.mining_lsh and preargs.mining_memory_mb and not preargs.mining_incremental:
+        parser.error("--mining-lsh keeps every image's tags in memory and can't be combined "
+                     "with --mining-memory-mb.")
+    if preargs.thumb_queue:
+        preargs.thumbnail = True
+    if preargs.db_dir:
+        use_db_dir(preargs.db_dir)
 
     if preargs.pretags:
         preargs.pretags = [t.strip() for t in preargs.pretags.split(",") if t.strip()]
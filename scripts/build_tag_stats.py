@@ -0,0 +1,45 @@
+'''Builds or refreshes corpus-wide tag statistics from posts_cache.db'''
+from pathlib import Path
+import argparse
+import time
+
+from functions.tag_stats import DEFAULT_MEMORY_MB, TagStatsStore
+
+script_dir = Path(__file__).parent.resolve()
+db_dir = script_dir.parent / "database"
+
+def main(args):
+    """Syncs the statistics store with the posts cache."""
+    print("=== Tag Statistics Summary ===")
+    print(f"📄  Posts cache:     {args.cache}")
+    print(f"💾  Output DB:       {args.output}")
+    print(f"🔝  Top-k:           {args.top_k}")
+    print(f"🧠  Memory budget:   {args.memory_mb:g} MB")
+    print()
+
+    start = time.perf_counter()
+    store = TagStatsStore(args.output)
+    try:
+        stats = store.update(args.cache, args.top_k, (args.memory_mb, args.spill_dir))
+    finally:
+        store.close()
+
+    print(f"\n[✓] {stats['added']:,} added, {stats['changed']:,} changed and "
+          f"{stats['removed']:,} removed posts; re-ranked {stats['tags']:,} tags "
+          f"({stats['recounted']:,} recounted) in {time.perf_counter() - start:.1f}s.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Counts tags and tag co-occurrences across posts_cache.db, incrementally.")
+    parser.add_argument("--cache", default=str(db_dir / "posts_cache.db"),
+                        help="posts_cache.db to read")
+    parser.add_argument("--memory-mb", type=float, default=DEFAULT_MEMORY_MB,
+                        help="Spill pair deltas to disk beyond this budget")
+    parser.add_argument("-o", "--output", default=str(db_dir / "tag_stats.db"),
+                        help="Statistics DB to create or update")
+    parser.add_argument("--spill-dir",
+                        help="Where --memory-mb spills go (default: system temp dir)")
+    parser.add_argument("--top-k", type=int, default=50,
+                        help="Co-occurring tags kept per tag")
+
+    main(parser.parse_args())
@@ -0,0 +1,311 @@
+"""
+Sparse sidecar/canonical tag co-occurrence counting for shimmie2-tools
+"""
+
+from array import array
+from pathlib import Path
+import os
+import tempfile
+
+import numpy as np
+
+from functions.tag_vocab import TagVocabulary
+
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+# First-seen positions are (shard << SHARD_SHIFT) + position within the shard
+SHARD_SHIFT = 40
+# Columns of a reduced entry; a spilled run stores one .npy file per column
+FIELDS = ("keys", "shared", "overlap", "first")
+ENTRY_BYTES = 8 * len(FIELDS)
+
+def reduce_entries(keys, shared, overlap, first):
+    """
+    Sums duplicate COO entries.
+
+    Entries are packed as key = row << 32 | col. Shared and overlap counts are
+    added, `first` (the position the pair was first seen at) keeps the minimum.
+
+    Returns:
+        tuple: (keys, shared, overlap, first), sorted by key with keys unique.
+    """
+    if not len(keys):
+        return keys, shared, overlap, first
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return (keys[starts], np.add.reduceat(shared[order], starts),
+            np.add.reduceat(overlap[order], starts), np.minimum.reduceat(first[order], starts))
+
+def _grow(counts, size, fill=0):
+    """`counts` padded with `fill` up to `size` entries."""
+    if len(counts) >= size:
+        return counts
+    return np.concatenate((counts, np.full(size - len(counts), fill, dtype=counts.dtype)))
+
+class CoOccurrenceMatrix: # pylint: disable=too-many-instance-attributes
+    """
+    Sidecar x canonical tag co-occurrence as integer-ID sparse matrices.
+
+    Tags are interned into one TagVocabulary, so a tag has the same ID on both
+    axes. add() only appends IDs to flat buffers; once `chunk_pairs` pairs are
+    pending, the buffered images are expanded into COO (row = sidecar tag,
+    col = canonical tag) entries in one vectorised step and reduced into the
+    running matrix. Next to the shared count, every entry carries how many of
+    those images already had the canonical tag in their sidecar, and the
+    canonical-tag position it was first seen at, so ties resolve to the tag
+    the per-image Counter loop would have met first.
+
+    With a `memory_budget` (bytes), the reduced entries are written out as a
+    sorted run whenever they outgrow it, and blocks() later merges the runs a
+    few rows at a time. Only the per-tag count vectors stay in memory.
+    """
+    def __init__(self, vocab=None, chunk_pairs=4_000_000, shard=0,
+                 memory_budget=None, spill_dir=None):
+        self.vocab = vocab if vocab is not None else TagVocabulary()
+        self.chunk_pairs = chunk_pairs
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        if memory_budget:
+            # Leave room for the chunk being expanded next to the held entries
+            self.chunk_pairs = max(1, min(chunk_pairs, memory_budget // (4 * ENTRY_BYTES)))
+        self.valid = 0
+        self.runs = []
+
+        # Pending images: sidecar IDs (deduplicated), canonical IDs, lengths per image
+        self._s_ids, self._c_ids = array("q"), array("q")
+        self._s_lens, self._c_lens = array("q"), array("q")
+        self._pending = 0
+        # Positions count from the shard's base, so they stay ordered across shards
+        self._s_seen = self._c_seen = shard << SHARD_SHIFT
+        self._parts = []
+
+        self.keys = np.empty(0, np.int64)
+        self.shared = np.empty(0, np.int64)
+        self.overlap = np.empty(0, np.int64)
+        self.first = np.empty(0, np.int64)
+        self.sidecar_counts = np.empty(0, np.int64)
+        self.canonical_counts = np.empty(0, np.int64)
+        self.sidecar_first = np.empty(0, np.int64)
+
+    def add(self, sidecars, canonical):
+        """Counts one image. Images without canonical tags are skipped."""
+        if not canonical:
+            return
+        intern = self.vocab.intern
+        s_ids = dict.fromkeys(intern(t) for t in sidecars)
+        c_ids = [intern(t) for t in canonical]
+
+        self.valid += 1
+        self._s_ids.extend(s_ids)
+        self._c_ids.extend(c_ids)
+        self._s_lens.append(len(s_ids))
+        self._c_lens.append(len(c_ids))
+        self._pending += len(s_ids) * len(c_ids)
+        if self._pending >= self.chunk_pairs:
+            self._flush()
+
+    def _flush(self):
+        if not self._c_lens:
+            return
+        s_ids, c_ids, s_lens, c_lens = (np.array(buf, dtype=np.int64) for buf in (
+            self._s_ids, self._c_ids, self._s_lens, self._c_lens))
+        self._count_pairs(s_ids, c_ids, s_lens, c_lens)
+
+        size = len(self.vocab)
+        self.sidecar_counts = _grow(self.sidecar_counts, size)
+        self.sidecar_counts += np.bincount(s_ids, minlength=size)
+        self.canonical_counts = _grow(self.canonical_counts, size)
+        self.canonical_counts += np.bincount(c_ids, minlength=size)
+        self.sidecar_first = _grow(self.sidecar_first, size, np.iinfo(np.int64).max)
+        seen, at = np.unique(s_ids, return_index=True)
+        self.sidecar_first[seen] = np.minimum(self.sidecar_first[seen], at + self._s_seen)
+
+        self._s_seen += len(s_ids)
+        self._c_seen += len(c_ids)
+        for buf in (self._s_ids, self._c_ids, self._s_lens, self._c_lens):
+            del buf[:]
+        self._pending = 0
+
+    def _count_pairs(self, s_ids, c_ids, s_lens, c_lens):
+        """Expands a chunk of images into COO entries and queues them, reduced."""
+        images = np.arange(len(c_lens))
+
+        # Every sidecar entry pairs with each canonical entry of its image
+        s_rows = np.repeat(images, s_lens)
+        c_rows = np.repeat(images, c_lens)
+        c_starts = np.cumsum(c_lens) - c_lens
+        reps = c_lens[s_rows]
+        pair_starts = np.cumsum(reps) - reps
+        c_index = (np.repeat(c_starts[s_rows], reps)
+                   + np.arange(reps.sum()) - np.repeat(pair_starts, reps))
+
+        # Canonical entries whose tag is also in the same image's sidecar
+        in_sidecar = np.isin((c_rows << ID_BITS) | c_ids, (s_rows << ID_BITS) | s_ids)
+
+        self._add_part(reduce_entries(
+            (np.repeat(s_ids, reps) << ID_BITS) | c_ids[c_index],
+            np.ones(len(c_index), np.int64),
+            in_sidecar[c_index].astype(np.int64),
+            c_index + self._c_seen))
+
+    def _add_part(self, part):
+        """Queues reduced entries; folds them in, or spills once over budget."""
+        self._parts.append(part)
+        queued = sum(len(p[0]) for p in self._parts)
+        if self.memory_budget and (len(self.keys) + queued) * ENTRY_BYTES >= self.memory_budget:
+            self._merge_parts()
+            self._spill()
+        # Fold the reduced chunks in once they outgrow the matrix, so each
+        # entry is re-sorted only a logarithmic number of times
+        elif queued >= len(self.keys):
+            self._merge_parts()
+
+    def _merge_parts(self):
+        parts = [(self.keys, self.shared, self.overlap, self.first)] + self._parts
+        self.keys, self.shared, self.overlap, self.first = reduce_entries(
+            *(np.concatenate(column) for column in zip(*parts)))
+        self._parts = []
+
+    def _spill(self):
+        """Writes the held entries out as a sorted run and empties them."""
+        if not len(self.keys):
+            return
+        run = []
+        for field in FIELDS:
+            fd, path = tempfile.mkstemp(prefix=f"cooc-{field}-", suffix=".npy",
+                                        dir=self.spill_dir)
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, getattr(self, field))
+            run.append(Path(path))
+            setattr(self, field, np.empty(0, np.int64))
+        self.runs.append(tuple(run))
+
+    def finish(self):
+        """Reduces whatever is still pending and returns the matrix."""
+        self._flush()
+        if self._parts:
+            self._merge_parts()
+        if self.runs:
+            self._spill()
+        size = len(self.vocab)
+        self.sidecar_counts = _grow(self.sidecar_counts, size)
+        self.canonical_counts = _grow(self.canonical_counts, size)
+        self.sidecar_first = _grow(self.sidecar_first, size, np.iinfo(np.int64).max)
+        return self
+
+    def blocks(self, block_entries=None):
+        """
+        Yields the finished matrix as reduced (keys, shared, overlap, first)
+        blocks in key order. A sidecar tag's row never spans two blocks.
+
+        Spilled runs are memory-mapped and merged about `block_entries` entries
+        per run at a time (by default, whatever fits the memory budget).
+        """
+        if not self.runs:
+            yield self.keys, self.shared, self.overlap, self.first
+            return
+
+        runs = [[np.load(path, mmap_mode="r") for path in run] for run in self.runs]
+        if not block_entries:
+            budget = self.memory_budget or len(runs) * self.chunk_pairs * ENTRY_BYTES
+            block_entries = max(1, budget // (2 * ENTRY_BYTES * len(runs)))
+        pos = [0] * len(runs)
+
+        while True:
+            live = [i for i, run in enumerate(runs) if pos[i] < len(run[0])]
+            if not live:
+                return
+            # Take rows up to the lowest one any run reaches within its block
+            last_row = min(int(runs[i][0][min(pos[i] + block_entries, len(runs[i][0])) - 1])
+                           >> ID_BITS for i in live)
+            end_key = (last_row + 1) << ID_BITS
+
+            columns = [[] for _ in FIELDS]
+            for i in live:
+                end = pos[i] + int(np.searchsorted(runs[i][0][pos[i]:], end_key))
+                for column, values in zip(columns, runs[i]):
+                    column.append(np.asarray(values[pos[i]:end]))
+                pos[i] = end
+            yield reduce_entries(*(np.concatenate(column) for column in columns))
+
+    def merge(self, other):
+        """
+        Adds a finished matrix from another shard, remapping its tag IDs into
+        this vocabulary. Call finish() once every shard is merged.
+        """
+        remap = np.array(self.vocab.intern_many(other.vocab.names), dtype=np.int64)
+        size = len(self.vocab)
+        self.valid += other.valid
+
+        self.sidecar_counts = _grow(self.sidecar_counts, size)
+        self.sidecar_counts[remap] += other.sidecar_counts
+        self.canonical_counts = _grow(self.canonical_counts, size)
+        self.canonical_counts[remap] += other.canonical_counts
+        self.sidecar_first = _grow(self.sidecar_first, size, np.iinfo(np.int64).max)
+        self.sidecar_first[remap] = np.minimum(self.sidecar_first[remap], other.sidecar_first)
+
+        for keys, shared, overlap, first in other.blocks():
+            self._add_part(reduce_entries(
+                (remap[keys >> ID_BITS] << ID_BITS) | remap[keys & ID_MASK],
+                shared, overlap, first))
+        return self
+
+    def close(self):
+        """Deletes any spilled runs."""
+        for run in self.runs:
+            for path in run:
+                path.unlink(missing_ok=True)
+        self.runs = []
+
+    def sidecar_ids(self, min_count=1):
+        """IDs of sidecar tags seen at least `min_count` times, in first-seen order."""
+        ids = np.flatnonzero(self.sidecar_counts >= max(min_count, 1))
+        return ids[np.argsort(self.sidecar_first[ids], kind="stable")]
+
+    def sidecar_tags(self):
+        """Every sidecar tag seen, in first-seen order."""
+        return self.vocab.decode(self.sidecar_ids().tolist())
+
+    def canonical_count(self, tag, default=0):
+        """Images whose canonical tags include `tag`."""
+        tag_id = self.vocab.get(tag)
+        if tag_id is None or tag_id >= len(self.canonical_counts):
+            return default
+        return int(self.canonical_counts[tag_id]) or default
+
+    def best_matches(self, min_count=1):
+        """
+        Highest-Jaccard canonical tag for every sidecar tag seen `min_count`+ times.
+
+        Jaccard is shared / (sidecar count + canonical count - shared), computed
+        for a whole block of entries at once. Ties go to the pair seen first.
+
+        Returns:
+            dict: sidecar ID -> (canonical ID, score, overlap count)
+        """
+        best = {}
+        for keys, shared, overlap, first in self.blocks():
+            best.update(self._pick_best((keys >> ID_BITS, keys & ID_MASK, shared, overlap, first),
+                                        min_count))
+        return best
+
+    def _pick_best(self, entries, min_count):
+        """
+        Scores key-ordered (rows, cols, shared, overlap, first) entries and
+        keeps the top one of each row.
+        """
+        rows, cols, shared, overlap, first = entries
+        s_counts = self.sidecar_counts[rows]
+        keep = np.flatnonzero(s_counts >= min_count)
+        if not len(keep):
+            return {}
+        rows, cols, shared = rows[keep], cols[keep], shared[keep]
+        scores = shared / (s_counts[keep] + self.canonical_counts[cols] - shared)
+
+        order = np.lexsort((first[keep], -scores, rows))
+        sorted_rows = rows[order]
+        top = order[np.concatenate(([True], sorted_rows[1:] != sorted_rows[:-1]))]
+        return dict(zip(rows[top].tolist(),
+                        zip(cols[top].tolist(), scores[top].tolist(),
+                            overlap[keep][top].tolist())))
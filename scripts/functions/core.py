@@ -0,0 +1,96 @@
+"""
+Lightweight core helpers for shimmie2-tools (stdlib only, cheap to import)
+"""
+
+import importlib
+import os
+import sys
+import threading
+from pathlib import Path
+
+VIDEO_EXTS = {".gif", ".webm", ".mp4", ".flv", ".m4v", ".f4v", ".f4p", ".ogv"}
+
+class LazyModule:
+    """
+    Stands in for a module and imports it on first attribute access.
+
+    Keeps libvips, Pillow, tqdm and friends out of cold start for scripts
+    (and spawned workers) that never touch them. Hooks registered through
+    lazy_import run once, right after the real import.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                module = importlib.import_module(self._name)
+                for hook in self._hooks:
+                    hook(module)
+                self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+_LAZY_MODULES = {}
+
+def lazy_import(name, on_load=None):
+    """
+    Returns the shared LazyModule for `name`.
+
+    Args:
+        name (str): Dotted module name, e.g. "PIL.Image".
+        on_load (callable): Optional hook called with the module once it is imported.
+    """
+    module = _LAZY_MODULES.setdefault(name, LazyModule(name))
+    if on_load:
+        if module._module is not None: # pylint: disable=protected-access
+            on_load(module._module) # pylint: disable=protected-access
+        else:
+            module._hooks.append(on_load) # pylint: disable=protected-access
+    return module
+
+def rating_from_score(total_score: int, safe_max: int, questionable_max: int) -> str:
+    """Map a numeric total to the rating letter."""
+    if total_score <= safe_max:
+        return "s"          # safe
+    if total_score <= questionable_max:
+        return "q"          # questionable
+    return "e"              # explicit
+
+def validate_float(value):
+    """Validate if a number is a float between 0.00 and 1.00 and multiple of 0.01"""
+    value = float(value)  # Ensure the value is a float
+    if value < 0.00 or value > 1.00:
+        raise ValueError(f"Value must be between 0.00 and 1.00. Given: {value}")
+    if round(value*100) % 1 != 0:
+        raise ValueError(f"Value must be a multiple of 0.01. Given: {value}")
+    return value
+
+def get_cpu_threads():
+    """
+    Determine CPU threads for multithreading
+    """
+    return os.cpu_count()
+
+def add_module_path(relative_path: str):
+    """
+    Adds the given relative path to sys.path if it's not already present.
+
+    Args:
+        relative_path (str): The relative path from the current script to the module folder.
+    """
+    script_dir = Path(__file__).parent.resolve()
+    module_path = (script_dir / relative_path).resolve()
+    if not module_path.exists():
+        raise FileNotFoundError(f"Module path does not exist: {module_path}")
+    if str(module_path) not in sys.path:
+        sys.path.append(str(module_path))
@@ -0,0 +1,194 @@
+"""
+Compact, memory-mapped mapping index for shimmie2-tools
+"""
+
+from collections.abc import Mapping
+from pathlib import Path
+import mmap
+import os
+import sqlite3
+import struct
+import zlib
+
+MAGIC = b"SHMIDX01"
+# magic, entries, hash slots, value kind, source size, source mtime_ns
+HEADER = struct.Struct("<8sQQQqq")
+STR_VALUES, INT_VALUES = 0, 1
+EMPTY_SLOT = 0xFFFFFFFF
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+class MappingIndex(Mapping): # pylint: disable=too-many-instance-attributes
+    """
+    Read-only str -> str/int mapping backed by a single mmap'd file.
+
+    The file holds the keys sorted, as one UTF-8 blob plus an offsets table,
+    the values likewise (or as an int64 array), and an open-addressed hash
+    table of entry numbers keyed by crc32. Opening it maps the file and casts
+    a few memoryviews; nothing is parsed up front, and every process that maps
+    the same file shares its pages through the OS cache. Pickling sends only
+    the path, so worker processes reopen the map instead of copying it.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mm)
+        magic, count, slots, kind, size, mtime_ns = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"Not a mapping index: {self.path}")
+        self.kind, self.source_stat = kind, (size, mtime_ns)
+        self._count, self._mask = count, slots - 1
+
+        # cast() reads native byte order; indexes are written little-endian
+        pos = HEADER.size
+        self._key_offsets = view[pos:pos + (count + 1) * 8].cast("Q")
+        pos += (count + 1) * 8
+        self._slots = view[pos:pos + slots * 4].cast("I")
+        pos = _align(pos + slots * 4)
+        if kind == INT_VALUES:
+            self._ints = view[pos:pos + count * 8].cast("q")
+            pos += count * 8
+        else:
+            self._value_offsets = view[pos:pos + (count + 1) * 8].cast("Q")
+            pos += (count + 1) * 8
+        self._keys = view[pos:pos + self._key_offsets[count]]
+        self._values = view[pos + self._key_offsets[count]:]
+
+    def __reduce__(self):
+        return self.__class__, (self.path,)
+
+    def __len__(self):
+        return self._count
+
+    def _key(self, i):
+        return self._keys[self._key_offsets[i]:self._key_offsets[i + 1]]
+
+    def _find(self, key):
+        """Entry number of `key`, or -1."""
+        if not isinstance(key, str):
+            return -1
+        encoded = key.encode("utf-8")
+        slot = zlib.crc32(encoded) & self._mask
+        while True:
+            i = self._slots[slot]
+            if i == EMPTY_SLOT:
+                return -1
+            if self._key(i) == encoded:
+                return i
+            slot = (slot + 1) & self._mask
+
+    def _value(self, i):
+        if self.kind == INT_VALUES:
+            return self._ints[i]
+        start, end = self._value_offsets[i], self._value_offsets[i + 1]
+        return str(self._values[start:end], "utf-8")
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._value(i)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield str(self._key(i), "utf-8")
+
+    def items(self):
+        return ((str(self._key(i), "utf-8"), self._value(i)) for i in range(self._count))
+
+    def close(self):
+        """Releases the views and the map."""
+        for name in ("_key_offsets", "_slots", "_ints", "_value_offsets", "_keys", "_values"):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        self._mm.close()
+
+def _slot_table(keys):
+    """Open-addressed crc32 table of entry numbers, at least twice as many slots as keys."""
+    slots = 1
+    while slots < len(keys) * 2:
+        slots <<= 1
+    table = [EMPTY_SLOT] * slots
+    for i, key in enumerate(keys):
+        slot = zlib.crc32(key) & (slots - 1)
+        while table[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = i
+    return table
+
+def _offsets(blobs):
+    """Packed start offsets of `blobs` laid end to end, plus the total length."""
+    out, pos = [0], 0
+    for blob in blobs:
+        pos += len(blob)
+        out.append(pos)
+    return struct.pack(f"<{len(out)}Q", *out)
+
+def write_mapping_index(pairs, out_path, kind=STR_VALUES, source_stat=(0, 0)):
+    """
+    Writes (key, value) pairs as a mapping index. Later duplicates win, as in a dict.
+    """
+    entries = sorted(dict(pairs).items())
+    count = len(entries)
+    keys = [k.encode("utf-8") for k, _ in entries]
+    table = _slot_table(keys)
+
+    chunks = [HEADER.pack(MAGIC, count, len(table), kind, *source_stat),
+              _offsets(keys), struct.pack(f"<{len(table)}I", *table)]
+    pad = _align(sum(map(len, chunks))) - sum(map(len, chunks))
+    chunks.append(b"\0" * pad)
+    if kind == INT_VALUES:
+        chunks.append(struct.pack(f"<{count}q", *(int(v) for _, v in entries)))
+        values = b""
+    else:
+        encoded = [v.encode("utf-8") for _, v in entries]
+        chunks.append(_offsets(encoded))
+        values = b"".join(encoded)
+    chunks += [b"".join(keys), values]
+
+    # Write beside the target and swap in, so readers never see a partial file
+    tmp_path = Path(f"{out_path}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.writelines(chunks)
+    os.replace(tmp_path, out_path)
+
+def open_mapping_index(db_path, index_path, query, kind=STR_VALUES):
+    """
+    Opens the index for `db_path`, (re)building it first if the DB changed.
+
+    Args:
+        db_path (Path): SQLite source.
+        index_path (Path): Where the index lives.
+        query (str): SELECT yielding (key, value) rows.
+        kind (int): STR_VALUES (both sides stripped, empty pairs skipped) or
+            INT_VALUES (key stripped, value kept as an integer).
+
+    Returns:
+        MappingIndex: The opened index.
+    """
+    st = os.stat(db_path)
+    source_stat = (st.st_size, st.st_mtime_ns)
+    try:
+        index = MappingIndex(index_path)
+        if index.source_stat == source_stat and index.kind == kind:
+            return index
+        index.close()
+    except (OSError, ValueError, struct.error):
+        pass
+
+    print(f"[INFO] Building mapping index {index_path}...")
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute(query)
+        if kind == INT_VALUES:
+            pairs = ((row[0].strip(), row[1]) for row in rows if len(row) >= 2)
+        else:
+            pairs = ((row[0].strip(), row[1].strip()) for row in rows
+                     if len(row) >= 2 and row[0].strip() and row[1].strip())
+        write_mapping_index(pairs, index_path, kind, source_stat)
+    return MappingIndex(index_path)
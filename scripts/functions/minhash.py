@@ -0,0 +1,178 @@
+"""
+MinHash/LSH candidate generation for tag equivalency mining
+"""
+
+import numpy as np
+
+from functions.cooccurrence import ID_BITS, ID_MASK, CoOccurrenceMatrix
+
+# Image indices and hash coefficients stay below this, so a * x + b fits in int64
+PRIME = (1 << 31) - 1
+NOT_SEEN = np.iinfo(np.int64).max
+
+def _group(tag_ids, images):
+    """Postings sorted by tag (images stay in order): (tags, starts, sorted images)."""
+    order = np.argsort(tag_ids, kind="stable")
+    tag_ids, images = tag_ids[order], images[order]
+    starts = np.flatnonzero(np.concatenate(([True], tag_ids[1:] != tag_ids[:-1])))
+    return tag_ids[starts], starts, images
+
+def _expand(starts, counts):
+    """For ranges [start, start + count): (range number, position) of every element."""
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+def _entry_index(postings):
+    """
+    Sorted lookup keys (image << 32 | tag) of the postings: the canonical ones
+    with each entry's position, and the sidecar ones.
+    """
+    s_ids, s_img, c_ids, c_img, c_pos = postings
+    canon_keys = (c_img << ID_BITS) | c_ids
+    canon_order = np.argsort(canon_keys, kind="stable")
+    return canon_keys[canon_order], c_pos[canon_order], np.sort((s_img << ID_BITS) | s_ids)
+
+def _count_probes(counts, owner, probes, index):
+    """
+    Adds one batch of (image << 32 | canonical tag) probes to the (shared,
+    overlap, first) counts of the candidates in `owner`, in place.
+    """
+    shared, overlap, first = counts
+    canon_keys, canon_pos, side_keys = index
+    at = np.minimum(np.searchsorted(canon_keys, probes), len(canon_keys) - 1)
+    hit = canon_keys[at] == probes
+    in_side = np.isin(probes, side_keys, assume_unique=False)
+    shared += np.bincount(owner, hit, len(shared)).astype(np.int64)
+    overlap += np.bincount(owner, hit & in_side, len(overlap)).astype(np.int64)
+    np.minimum.at(first, owner[hit], canon_pos[at[hit]])
+
+class MinHashMatrix(CoOccurrenceMatrix):
+    """
+    Approximate drop-in for CoOccurrenceMatrix that never expands sidecar x
+    canonical pairs. It keeps each image's tag IDs, and best_matches() builds a
+    MinHash signature for every tag over the images it appears on (sidecar and
+    canonical occurrences separately). The signatures are cut into `bands` bands
+    of `rows` values, and a sidecar and a canonical tag that agree on a whole
+    band become a candidate. Exact Jaccard, overlap and first-seen position are
+    then computed for the candidates only.
+
+    A pair with Jaccard J is proposed with probability 1 - (1 - J**rows)**bands.
+    More bands or fewer rows raise recall and cost more candidates. When a
+    tag's true best match is proposed, its row is identical to the exact one.
+
+    Every image's tag IDs stay in memory until best_matches(), so there is
+    no memory_budget to spill against; passing one is an error.
+    """
+    def __init__(self, bands=32, rows=2, seed=0, **kwargs):
+        if kwargs.get("memory_budget"):
+            raise ValueError("MinHashMatrix keeps every image's tags in memory; "
+                             "it can't honour a memory_budget")
+        super().__init__(**kwargs)
+        self.bands, self.rows, self.seed = bands, rows, seed
+        self.candidates = 0
+        self._chunks = []
+
+    def _count_pairs(self, s_ids, c_ids, s_lens, c_lens):
+        self._chunks.append((s_ids, c_ids, s_lens, c_lens, self._c_seen))
+
+    def chunks(self):
+        """
+        The buffered images, as (sidecar IDs, canonical IDs, sidecar lengths,
+        canonical lengths, first canonical position) chunks.
+        """
+        return list(self._chunks)
+
+    def merge(self, other):
+        super().merge(other)
+        remap = np.array(self.vocab.intern_many(other.vocab.names), dtype=np.int64)
+        for s_ids, c_ids, s_lens, c_lens, c_base in other.chunks():
+            self._chunks.append((remap[s_ids], remap[c_ids], s_lens, c_lens, c_base))
+        return self
+
+    def _postings(self):
+        """Every (tag, image) entry of both sides, plus each canonical entry's position."""
+        columns = ([], [], [], [], [])
+        image_base = 0
+        for s_ids, c_ids, s_lens, c_lens, c_base in self._chunks:
+            images = np.arange(image_base, image_base + len(c_lens))
+            for column, values in zip(columns, (s_ids, np.repeat(images, s_lens), c_ids,
+                                                np.repeat(images, c_lens),
+                                                c_base + np.arange(len(c_ids)))):
+                column.append(values)
+            image_base += len(c_lens)
+        return [np.concatenate(c) if c else np.empty(0, np.int64) for c in columns]
+
+    def _signatures(self, group):
+        """(tags x bands*rows) MinHash signatures of grouped (tags, starts, images) postings."""
+        _, starts, images = group
+        rng = np.random.default_rng(self.seed)
+        perms = self.bands * self.rows
+        coef_a = rng.integers(1, PRIME, perms)
+        coef_b = rng.integers(0, PRIME, perms)
+        signatures = np.empty((len(starts), perms), np.int64)
+        for k in range(perms):
+            signatures[:, k] = np.minimum.reduceat((coef_a[k] * images + coef_b[k]) % PRIME,
+                                                   starts)
+        return signatures
+
+    def _band_keys(self, group):
+        """(tags x bands) hash of each band of the group's signatures."""
+        mix = np.random.default_rng(self.seed + 1).integers(
+            1, 1 << 63, self.rows, dtype=np.uint64) | np.uint64(1)
+        signatures = self._signatures(group).reshape((-1, self.bands, self.rows))
+        return (signatures.astype(np.uint64) * mix).sum(axis=2, dtype=np.uint64)
+
+    def _candidates(self, sidecar, canonical):
+        """Packed (sidecar << 32 | canonical) keys of pairs sharing at least one band."""
+        s_bands, c_bands = self._band_keys(sidecar), self._band_keys(canonical)
+        found = []
+        for band in range(self.bands):
+            s_keys = s_bands[:, band]
+            c_order = np.argsort(c_bands[:, band], kind="stable")
+            c_keys = c_bands[c_order, band]
+            low = np.searchsorted(c_keys, s_keys, "left")
+            owner, pos = _expand(low, np.searchsorted(c_keys, s_keys, "right") - low)
+            found.append((sidecar[0][owner] << ID_BITS) | canonical[0][c_order[pos]])
+        return np.unique(np.concatenate(found)) if found else np.empty(0, np.int64)
+
+    def best_matches(self, min_count=1):
+        """
+        Highest-Jaccard proposed canonical tag for every sidecar tag seen
+        `min_count`+ times; same shape as CoOccurrenceMatrix.best_matches().
+        """
+        postings = self._postings()
+        s_ids, s_img, c_ids, c_img, _ = postings
+        frequent = self.sidecar_counts[s_ids] >= min_count
+        sidecar = _group(s_ids[frequent], s_img[frequent])
+        canonical = _group(c_ids, c_img)
+        if not len(sidecar[0]) or not len(canonical[0]):
+            return {}
+        candidates = self._candidates(sidecar, canonical)
+        self.candidates = len(candidates)
+
+        counts = self._probe(candidates, sidecar, _entry_index(postings))
+        found = counts[0] > 0
+        return self._pick_best((candidates[found] >> ID_BITS, candidates[found] & ID_MASK,
+                                *(column[found] for column in counts)), min_count)
+
+    def _probe(self, candidates, sidecar, index):
+        """
+        Exact (shared, overlap, first) counts of each candidate, from probing
+        its sidecar tag's images for its canonical tag. Candidates are probed in
+        batches whose probes add up to about chunk_pairs.
+        """
+        s_starts, s_sorted = sidecar[1:]
+        tag_at = np.searchsorted(sidecar[0], candidates >> ID_BITS)
+        starts = s_starts[tag_at]
+        sizes = np.append(s_starts[1:], len(s_sorted))[tag_at] - starts
+        counts = (np.zeros(len(candidates), np.int64), np.zeros(len(candidates), np.int64),
+                  np.full(len(candidates), NOT_SEEN, np.int64))
+        bounds = np.searchsorted(np.cumsum(sizes),
+                                 np.arange(self.chunk_pairs, sizes.sum(), self.chunk_pairs))
+        for lo, hi in zip(np.concatenate(([0], bounds)), np.append(bounds, len(candidates))):
+            owner, pos = _expand(starts[lo:hi], sizes[lo:hi])
+            owner += lo
+            _count_probes(counts, owner, (s_sorted[pos] << ID_BITS) | (candidates[owner] & ID_MASK),
+                          index)
+        return counts
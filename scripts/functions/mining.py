@@ -0,0 +1,620 @@
+"""
+Sidecar tag equivalency mining for shimmie2-tools
+"""
+
+from collections import namedtuple
+from pathlib import Path
+import csv
+import json
+import re
+import sqlite3
+import tempfile
+import time
+
+from functions.core import lazy_import
+from functions.utils import (
+    SidecarCache, compute_md5, copy_keys, get_bulk_canonical_tags, get_pg_conn,
+    get_sidecar_tags, sidecar_stamp
+)
+from functions.wiki_flags import DEPRECATION_PATTERN, FLAGS_TABLE, SAFE_PATTERN
+
+futures = lazy_import("concurrent.futures")
+tqdm = lazy_import("tqdm")
+cooccurrence = lazy_import("functions.cooccurrence")
+minhash = lazy_import("functions.minhash")
+mining_state = lazy_import("functions.mining_state")
+
+# How mine_tag_equivalencies() counts and scores:
+# - thresholds: (min samples, min confidence) a mapping needs.
+# - workers: with more than 1, hashing and counting run in shards of the image
+#   list in a process pool; the partial counts are merged before scoring, so
+#   the output is the same as a single-process run.
+# - memory_mb/spill_dir: pair counts that outgrow the budget are spilled to
+#   sorted runs in a temporary directory (under spill_dir) and merged back in
+#   a streaming pass; the output is unchanged.
+# - lsh: (bands, rows) proposes candidate pairs with MinHash/LSH and scores
+#   only those, trading a little recall for not counting every pair. It holds
+#   every image's tags in memory, so it can't be combined with memory_mb.
+# - state_path: counts persist in a MiningState keyed by image md5 and the
+#   size/mtime of its sidecars. A run counts only images added or whose
+#   sidecars changed since the last one, subtracts removed ones and re-scores
+#   the tags whose counts changed. Counts are exact (lsh is ignored); images
+#   without canonical tags are remembered too, so they aren't looked up again.
+# - sweep: (min samples, confidence) settings that replace thresholds. Counts,
+#   DB context and best matches are computed once, then each setting writes
+#   its own map beside the output (map.min10_conf0.5.csv) and
+#   map.summary.csv lists how many mappings each produced.
+# - rebuild: with state_path, empties the state first and counts every image,
+#   picking up canonical tag changes in the DB.
+MiningOptions = namedtuple(
+    "MiningOptions",
+    ["thresholds", "workers", "memory_mb", "spill_dir", "lsh", "state_path", "sweep",
+     "rebuild"],
+    defaults=((10, 0.5), 1, None, None, None, None, None, False))
+
+# Where mining reads tags and context from:
+# - db_conn: Shimmie Postgres credentials, or None to work from the local caches only.
+# - sqlite_conn: connection to posts_cache.db.
+# - sidecar: SidecarCache of parsed sidecar files.
+# - stats: optional TagStats with corpus-wide tag counts from posts_cache.db; a tag counts as
+#   established if either Shimmie or the corpus uses it widely, and a pair the
+#   corpus tags together often enough (its top-k) is never mapped.
+# - context: GlobalContextCache keeping the Postgres counts and wiki context between
+#   runs, so only new or expired tags are queried.
+MiningStores = namedtuple("MiningStores",
+                          ["db_conn", "sqlite_conn", "sidecar", "stats", "context"],
+                          defaults=(None, None, None, None, None))
+
+def _hash_images(image_list):
+    """MD5 per image: taken from the filename where present, else computed."""
+    md5_regex = re.compile(r"[a-fA-F0-9]{32}")
+    hashes = []
+    for img_path in image_list:
+        match = md5_regex.search(img_path.stem)
+        hashes.append(match.group(0).lower() if match else compute_md5(img_path))
+    return hashes
+
+def _extract_hashes(image_list, workers=1):
+    """Helper to extract MD5s rapidly."""
+    if workers > 1:
+        shards = _shard(image_list, workers)
+        with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(tqdm.tqdm(pool.map(_hash_images, shards), total=len(shards),
+                                     desc="1/3: Extracting Hashes", unit="shard"))
+        hashes = [md5 for shard in results for md5 in shard]
+    else:
+        hashes = _hash_images(tqdm.tqdm(image_list, desc="1/3: Extracting Hashes", unit="img"))
+
+    img_to_md5 = dict(zip(image_list, hashes))
+    return img_to_md5, set(hashes)
+
+def _shard(items, workers):
+    """Contiguous slices of `items`, a few per worker so slow shards even out."""
+    size = max(1, -(-len(items) // (workers * 4)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+class TagCategoryGuard:
+    """Helper to enforce category rules during tag mining."""
+    def __init__(self, mappings, stats=None):
+        self.stats = stats
+        self.artists = set(mappings.artist.keys()) if mappings else set()
+        self.chars = set(mappings.char.keys()) if mappings else set()
+        self.series = set()
+        if mappings:
+            for val in mappings.char.values():
+                if isinstance(val, (list, tuple, set)):
+                    self.series.update(val)
+                else:
+                    self.series.add(val)
+        self.strict = {'character', 'artist', 'series'}
+
+    def get_category(self, tag):
+        """Determines the category of a given tag."""
+        if tag in self.chars:
+            return 'character'
+        if tag in self.artists:
+            return 'artist'
+        if tag in self.series:
+            return 'series'
+        return 'general'
+
+    def shares_lexical_root(self, tag1, tag2):
+        """Checks if two tags share a significant root word (useful for low confidence)."""
+        w1 = {w for w in re.findall(r'[a-z0-9]+', re.sub(r'\([^)]+\)', '', tag1)) if len(w) > 2}
+        w2 = {w for w in re.findall(r'[a-z0-9]+', re.sub(r'\([^)]+\)', '', tag2)) if len(w) > 2}
+        return bool(w1 & w2)
+
+    def check(self, s_tag, c_tag, s_count):
+        """Returns True if the mapping is permitted."""
+        cat_s = self.get_category(s_tag)
+        cat_c = self.get_category(c_tag)
+
+        # Block strict mismatch (e.g., character -> artist)
+        if cat_s in self.strict and cat_c in self.strict and cat_s != cat_c:
+            return False
+
+        # Block strict -> general (Do not downgrade known artists/characters)
+        if cat_s in self.strict and cat_c == 'general':
+            return False
+
+        if cat_s == 'character' and cat_c == 'character' and s_count < 50:
+            b1 = re.sub(r'_\([^)]+\)$', '', s_tag)
+            b2 = re.sub(r'_\([^)]+\)$', '', c_tag)
+            if b1 != b2 and b1 not in b2 and b2 not in b1:
+                return False
+
+        return True
+
+    def co_used(self, s_tag, c_tag, min_share):
+        """Checks if the corpus tags `c_tag` on at least `min_share` of `s_tag`'s posts."""
+        return bool(self.stats) and self.stats.confidence(s_tag, c_tag) >= min_share
+
+    def can_drop(self, s_tag, c_tag):
+        """Returns True if it's safe to drop a tag for redundancy."""
+        cat_s = self.get_category(s_tag)
+        cat_c = self.get_category(c_tag)
+
+        if cat_s in self.strict and cat_c in self.strict and cat_s != cat_c:
+            return False
+
+        if cat_s in self.strict and cat_c == 'general':
+            return False
+
+        return True
+
+def _new_matrix(options=None, shard=0):
+    """
+    Empty co-occurrence matrix. `options` may hold memory_budget/spill_dir for
+    spilling, or lsh=(bands, rows) for the approximate MinHash matrix.
+    """
+    options = dict(options or {})
+    options.pop("workers", None)
+    lsh = options.pop("lsh", None)
+    if lsh:
+        return minhash.MinHashMatrix(*lsh, shard=shard, **options)
+    return cooccurrence.CoOccurrenceMatrix(shard=shard, **options)
+
+def _count_shard(shard, image_list, shard_tags, sidecar_db=None, options=None):
+    """Co-occurrence matrix of one shard; runs in a worker process."""
+    sidecar_cache = SidecarCache(sidecar_db) if sidecar_db else None
+    try:
+        matrix = _new_matrix(options, shard)
+        for img_path, canonical in zip(image_list, shard_tags):
+            if canonical:
+                matrix.add(get_sidecar_tags(img_path, sidecar_cache), canonical)
+        return matrix.finish()
+    finally:
+        if sidecar_cache:
+            sidecar_cache.close()
+
+def _calculate_co_occurrences(img_to_md5, bulk_tags, sidecar_cache=None, options=None):
+    """
+    Helper to count co-occurrences of sidecar vs canonical tags as a sparse matrix.
+    `options` are the matrix options plus the number of `workers` to count with.
+    """
+    image_list = list(img_to_md5)
+    workers = (options or {}).get("workers", 1)
+    matrix = _new_matrix(options)
+    if workers <= 1:
+        for img_path in tqdm.tqdm(image_list, desc="3/3: Mapping Co-occurrences", unit="img"):
+            canonical = bulk_tags.get(img_to_md5[img_path])
+            if canonical:
+                matrix.add(get_sidecar_tags(img_path, sidecar_cache), canonical)
+        return matrix.finish()
+
+    # Map: each shard counts its images in a worker. Reduce: merge the partial matrices.
+    shards = _shard(image_list, workers)
+    shard_options = dict(options or {})
+    if shard_options.get("memory_budget"):
+        shard_options["memory_budget"] //= workers
+    with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = [
+            pool.submit(_count_shard, i, shard, [bulk_tags.get(img_to_md5[p]) for p in shard],
+                        sidecar_cache.db_path if sidecar_cache else None, shard_options)
+            for i, shard in enumerate(shards)
+        ]
+        for future in tqdm.tqdm(pending, desc="3/3: Mapping Co-occurrences", unit="shard"):
+            part = future.result()
+            matrix.merge(part)
+            part.close()
+    return matrix.finish()
+
+def build_tag_frequencies(image_list, conns, sidecar_cache=None, options=None):
+    """Scans image list, compares sidecar tags to DB canonical tags using bulk queries."""
+    img_to_md5, md5_set = _extract_hashes(image_list, (options or {}).get("workers", 1))
+
+    print(f"\n[INFO] Fetching database tags for {len(md5_set)} unique files...")
+    bulk_tags = get_bulk_canonical_tags(md5_set, *conns)
+
+    return _calculate_co_occurrences(img_to_md5, bulk_tags, sidecar_cache, options)
+
+def _pending_images(state, image_list, img_to_md5):
+    """{md5: (image path, sidecar stamp)} of the images the state has no current entry for."""
+    first_paths = {}
+    for img_path in image_list:
+        first_paths.setdefault(img_to_md5[img_path], img_path)
+    stamped = ((md5, (img_path, sidecar_stamp(img_path))) for md5, img_path in first_paths.items())
+    return {md5: entry for md5, entry in stamped if state.stamps.get(md5) != entry[1]}
+
+def update_mining_state(state, image_list, conns, sidecar_cache=None, options=None):
+    """
+    Brings a MiningState up to date with `image_list`: only images it has not
+    looked up, or whose sidecar stamp changed, are looked up and (re)counted,
+    and md5s no longer listed are subtracted. Returns the state, ready to score.
+    """
+    img_to_md5, md5_set = _extract_hashes(image_list, (options or {}).get("workers", 1))
+    pending = _pending_images(state, image_list, img_to_md5)
+    removed = set(state.stamps) - md5_set
+    edited = sum(md5 in state.stamps for md5 in pending)
+    print(f"\n[INFO] Incremental mining: {len(pending) - edited} new, {edited} edited and "
+          f"{len(removed)} removed images since the last run ({len(state.stamps)} stored).")
+
+    bulk_tags = get_bulk_canonical_tags(set(pending), *conns)
+    added = [
+        (md5, stamp, get_sidecar_tags(img_path, sidecar_cache) if bulk_tags.get(md5) else [],
+         bulk_tags.get(md5))
+        for md5, (img_path, stamp) in tqdm.tqdm(pending.items(),
+                                                desc="3/3: Mapping Co-occurrences", unit="img")
+    ]
+    rescored = state.update(added, removed, options)
+    print(f"[INFO] Re-scored {rescored} sidecar tags.")
+    return state
+
+class GlobalContextCache:
+    """
+    Local SQLite copy of the mining global context: each tag's Shimmie post
+    count, whether it has a wiki page, and whether that page deprecates it.
+
+    Entries expire after `ttl` seconds. Each run also fingerprints the Postgres
+    `tags` and `wiki_pages` tables: any change to `tags` expires every count,
+    and new wiki revisions expire only the titles they add (any other wiki
+    change expires every wiki entry). Only missing or expired tags are fetched.
+    """
+    def __init__(self, db_path, ttl=7 * 24 * 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tag_context (
+                tag TEXT PRIMARY KEY, count INTEGER, count_at REAL,
+                has_wiki INTEGER, deprecated INTEGER, wiki_at REAL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def sync(self, pg_conn):
+        """Expires the entries the Postgres tables changed under since the last run."""
+        with pg_conn.cursor() as cur:
+            cur.execute("SELECT count(*), COALESCE(max(id), 0), "
+                        "COALESCE(sum(count), 0)::bigint FROM tags")
+            tags_print = list(cur.fetchone())
+            if tags_print != self._meta("tags"):
+                self.conn.execute("UPDATE tag_context SET count_at = NULL")
+                self._set_meta("tags", tags_print)
+
+            cur.execute("SELECT count(*), COALESCE(max(id), 0) FROM wiki_pages")
+            wiki_print = list(cur.fetchone())
+            old = self._meta("wiki_pages")
+            if wiki_print != old:
+                titles = None
+                if old and wiki_print[1] > old[1]:
+                    cur.execute("SELECT REPLACE(LOWER(title), ' ', '_') FROM wiki_pages "
+                                "WHERE id > %s", (old[1],))
+                    titles = [row[0] for row in cur]
+                if titles is not None and len(titles) == wiki_print[0] - old[0]:
+                    # Only revisions were appended: expire just their titles
+                    self.conn.executemany("UPDATE tag_context SET wiki_at = NULL WHERE tag = ?",
+                                          ((t,) for t in set(titles)))
+                else:
+                    self.conn.execute("UPDATE tag_context SET wiki_at = NULL")
+                self._set_meta("wiki_pages", wiki_print)
+        self.conn.commit()
+
+    def lookup(self, tags, g_counts, deprecated, has_wiki):
+        """
+        Fills the context of every fresh cached tag in `tags`.
+
+        Returns:
+            tuple: (tags whose count must be fetched, tags whose wiki must be fetched)
+        """
+        cutoff = time.time() - self.ttl
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (tag TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM wanted")
+        self.conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((t,) for t in tags))
+        stale_counts, stale_wikis = [], []
+        for tag, count, count_at, wiki, dep, wiki_at in self.conn.execute(
+                "SELECT w.tag, c.count, c.count_at, c.has_wiki, c.deprecated, c.wiki_at "
+                "FROM wanted w LEFT JOIN tag_context c ON c.tag = w.tag"):
+            if count_at is None or count_at < cutoff:
+                stale_counts.append(tag)
+            elif count is not None:
+                g_counts[tag] = count
+            if wiki_at is None or wiki_at < cutoff:
+                stale_wikis.append(tag)
+            elif wiki:
+                has_wiki.add(tag)
+                if dep:
+                    deprecated.add(tag)
+        return stale_counts, stale_wikis
+
+    def store(self, count_tags, g_counts, wiki_tags, deprecated, has_wiki):
+        """Saves freshly fetched context; tags Postgres did not know are cached as absent."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO tag_context (tag, count, count_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (tag) DO UPDATE SET count = excluded.count, count_at = excluded.count_at",
+            ((t, g_counts.get(t), now) for t in count_tags))
+        self.conn.executemany(
+            "INSERT INTO tag_context (tag, has_wiki, deprecated, wiki_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (tag) DO UPDATE SET has_wiki = excluded.has_wiki, "
+            "deprecated = excluded.deprecated, wiki_at = excluded.wiki_at",
+            ((t, t in has_wiki, t in deprecated, now) for t in wiki_tags))
+        self.conn.commit()
+
+    def close(self):
+        """Closes the cache."""
+        self.conn.close()
+
+# Wiki deprecation classified in SQL, for servers whose flags were never built
+DEPRECATION_SQL = (
+    f"REGEXP_REPLACE(w.body, '{SAFE_PATTERN}', 'SAFE', 'ig') "
+    f"~* '({DEPRECATION_PATTERN})'"
+)
+
+def _query_tag_counts(conn, tags, itersize):
+    """True global counts of `tags` in Shimmie."""
+    if not tags:
+        return {}
+    copy_keys(conn, "mining_count_tags", tags)
+    with conn.cursor(name="mining_counts") as cur:
+        cur.itersize = itersize
+        cur.execute("SELECT t.tag, t.count FROM tags t "
+                    "JOIN mining_count_tags m ON m.key = t.tag")
+        return dict(cur)
+
+def _query_wiki_context(conn, tags, itersize):
+    """(deprecated, has_wiki) tag sets for `tags` from Shimmie's wiki pages."""
+    deprecated, has_wiki = set(), set()
+    if not tags:
+        return deprecated, has_wiki
+    copy_keys(conn, "mining_wiki_tags", tags)
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (FLAGS_TABLE,))
+        flagged = cur.fetchone()[0]
+    with conn.cursor(name="mining_wikis") as cur:
+        cur.itersize = itersize
+        if flagged:
+            # Classified once by import_danbooru_wikis.py; an indexed lookup
+            cur.execute(f"SELECT f.tag, f.deprecated FROM {FLAGS_TABLE} f "
+                        "JOIN mining_wiki_tags m ON m.key = f.tag")
+        else:
+            cur.execute(f"SELECT m.key, {DEPRECATION_SQL} FROM wiki_pages w "
+                        "JOIN mining_wiki_tags m ON m.key = REPLACE(LOWER(w.title), ' ', '_')")
+        for tag, is_deprecated in cur:
+            has_wiki.add(tag)
+            if is_deprecated:
+                deprecated.add(tag)
+    return deprecated, has_wiki
+
+def _fetch_global_context(tags_set, db_conn, context_cache=None, itersize=10000):
+    """
+    Fetches total database counts, wiki existence, and deprecation status.
+    With a GlobalContextCache, only tags missing from it or expired are queried.
+    """
+    g_counts, deprecated, has_wiki = {}, set(), set()
+    if not db_conn or not tags_set:
+        return g_counts, deprecated, has_wiki
+
+    print("\n[INFO] Fetching global DB stats and wiki context...")
+    count_tags = wiki_tags = list(tags_set)
+    try:
+        with get_pg_conn(db_conn) as conn:
+            if context_cache is not None:
+                context_cache.sync(conn)
+                count_tags, wiki_tags = context_cache.lookup(tags_set, g_counts,
+                                                             deprecated, has_wiki)
+                print(f"[INFO] Context cache: refetching {len(count_tags)} counts and "
+                      f"{len(wiki_tags)} wiki entries of {len(tags_set)} tags.")
+            fetched_counts = _query_tag_counts(conn, count_tags, itersize)
+            fetched_dep, fetched_wiki = _query_wiki_context(conn, wiki_tags, itersize)
+    except Exception as e: # pylint: disable=broad-exception-caught
+        print(f"\n[WARNING] Global context query failed: {e}")
+        return g_counts, deprecated, has_wiki
+
+    if context_cache is not None:
+        context_cache.store(count_tags, fetched_counts, wiki_tags, fetched_dep, fetched_wiki)
+    g_counts.update(fetched_counts)
+    deprecated |= fetched_dep
+    has_wiki |= fetched_wiki
+    return g_counts, deprecated, has_wiki
+
+def mine_tag_equivalencies(image_list, output_path, mappings, options=MiningOptions(),
+                           stores=MiningStores()):
+    """
+    Scans images to discover 1:1 tag mappings using Jaccard similarity.
+
+    Args:
+        image_list (list): Image paths whose sidecars are mined.
+        output_path (str): Map CSV to write.
+        mappings (Mappings): Character/artist lookups for the category guards.
+        options (MiningOptions): Thresholds and counting settings.
+        stores (MiningStores): Databases and caches to read and refresh.
+    """
+    print(f"\n[⛏️ MINING MODE] Analyzing {len(image_list)} images for 1:1 equivalencies...")
+
+    with tempfile.TemporaryDirectory(prefix="shimmie-mining-", dir=options.spill_dir) as tmp_dir:
+        conns = (stores.db_conn, stores.sqlite_conn)
+        matrix = _count_images(image_list, conns, options, stores.sidecar, tmp_dir)
+        if matrix.runs:
+            print(f"[INFO] Spilled pair counts to {len(matrix.runs)} sorted run(s).")
+
+        missing = len(image_list) - matrix.valid
+        if len(image_list) > 0 and (missing / len(image_list)) >= 0.5:
+            print(f"\n[⚠️ ALERT] High Missing Rate: {missing}/{len(image_list)} images "
+                  f"({(missing/len(image_list))*100:.1f}%) were not found in the DB!")
+        else:
+            print(f"Successfully aligned {matrix.valid} images with database records.")
+
+        # Fetch global context before doing the math
+        sidecar_tags = matrix.sidecar_tags()
+        global_ctx = _fetch_global_context(sidecar_tags, stores.db_conn, stores.context)
+        if stores.stats:
+            # A copy: the counts may be the ones GlobalContextCache holds
+            g_counts = dict(global_ctx[0])
+            for tag in sidecar_tags:
+                if (count := stores.stats.count(tag)) > g_counts.get(tag, 0):
+                    g_counts[tag] = count
+            global_ctx = (g_counts, *global_ctx[1:])
+
+        results = _score_settings(matrix, global_ctx, TagCategoryGuard(mappings, stores.stats),
+                                  options.sweep or [options.thresholds])
+        matrix.close()
+
+    if not options.sweep:
+        _write_map(output_path, results[0][1])
+        print(f"[✓] Mined {len(results[0][1])} highly confident equivalencies! "
+              f"Saved to {output_path}")
+    else:
+        _write_sweep(Path(output_path), results)
+
+def _count_images(image_list, conns, options, sidecar_cache, tmp_dir):
+    """Co-occurrence matrix of `image_list`, fresh or brought up to date from the state."""
+    count_options = {"workers": options.workers, "lsh": options.lsh}
+    if options.memory_mb:
+        count_options.update(memory_budget=int(options.memory_mb * 1024 * 1024),
+                             spill_dir=tmp_dir)
+    if options.state_path:
+        state = mining_state.MiningState(options.state_path, rebuild=options.rebuild)
+        return update_mining_state(state, image_list, conns, sidecar_cache, count_options)
+    return build_tag_frequencies(image_list, conns, sidecar_cache, count_options)
+
+def _score_settings(matrix, global_ctx, guard, settings):
+    """[((min samples, confidence), sorted equivalencies)] for every setting."""
+    # Best matches don't depend on the thresholds: score once for every setting
+    best = matrix.best_matches(min(setting[0] for setting in settings))
+    results = []
+    for setting in settings:
+        calculated = calculate_equivalencies(matrix, global_ctx, guard, setting, best)
+        calculated.sort(key=lambda x: x["Sample_Size"], reverse=True)
+        results.append((setting, calculated))
+    return results
+
+def _write_sweep(output_path, results):
+    """Writes one map per (min samples, confidence) setting and the sweep summary."""
+    summary = []
+    print("\n=== Threshold Sweep ===")
+    for (min_samples, confidence), calculated in results:
+        map_path = output_path.with_name(
+            f"{output_path.stem}.min{min_samples}_conf{confidence:g}{output_path.suffix}")
+        _write_map(map_path, calculated)
+        drops = sum(row["Canonical_Tag"] == "_DROP_" for row in calculated)
+        summary.append({"Min_Samples": min_samples, "Confidence": confidence,
+                        "Mappings": len(calculated), "Renames": len(calculated) - drops,
+                        "Drops": drops, "Map": map_path.name})
+        print(f"  min {min_samples:>5}  conf {confidence:<5g} {len(calculated):>7} mappings "
+              f"({drops} drops)")
+
+    summary_path = output_path.with_name(f"{output_path.stem}.summary.csv")
+    with open(summary_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(summary[0]))
+        writer.writeheader()
+        writer.writerows(summary)
+    print(f"[✓] Swept {len(summary)} threshold settings! Summary saved to {summary_path}")
+
+def _write_map(output_path, calculated):
+    """Writes mined equivalencies as a map CSV."""
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(
+            f, fieldnames=["Sidecar_Tag", "Canonical_Tag", "Confidence", "Sample_Size"]
+        )
+        writer.writeheader()
+        writer.writerows(calculated)
+
+def _is_variant(s_tag, c_tag):
+    """Whether the tags differ only by a modifier, or `s_tag` is qualified by `c_tag`."""
+    # GUARD 1: Modifier exclusion
+    if re.sub(r'_\([^)]+\)', '', s_tag) == re.sub(r'_\([^)]+\)', '', c_tag):
+        return True
+    # GUARD 1.2: Parenthetical Context Protection
+    # Prevents OC/Character tags from merging into their Artist/Series tags
+    return f"({c_tag})" in s_tag
+
+def calculate_equivalencies(matrix, global_ctx, guard, thresholds, best=None):
+    """
+    Calculates Jaccard similarity scores to map tags safely under local limits.
+    `best` reuses matrix.best_matches() from a run at the same or a lower minimum.
+    """
+    results = []
+    # Best canonical match per sidecar tag, scored over the whole matrix at once
+    if best is None:
+        best = matrix.best_matches(thresholds[0])
+
+    for s_id in matrix.sidecar_ids(thresholds[0]).tolist():
+        s_tag = matrix.vocab.name(s_id)
+        s_count = int(matrix.sidecar_counts[s_id])
+
+        # GUARD 0: Wiki Deprecation Forced Drop
+        if s_tag in global_ctx[1]:
+            results.append({
+                "Sidecar_Tag": s_tag,
+                "Canonical_Tag": "_DROP_",
+                "Confidence": 1.0,
+                "Sample_Size": s_count
+            })
+            continue
+
+        if s_id not in best:
+            continue
+        c_id, hi_score, overlap = best[s_id]
+        best_match = matrix.vocab.name(c_id)
+
+        if hi_score >= thresholds[1] and best_match != s_tag:
+
+            # GUARD 1 and 1.2: Modifier exclusion and parenthetical context protection
+            if _is_variant(s_tag, best_match):
+                continue
+
+            # GUARD 1.5: Lexical Overlap Check for Low Confidence Mappings
+            # (Requires a shared word like "daughter" if confidence is under 75%)
+            if hi_score < 0.75 and not guard.shares_lexical_root(s_tag, best_match):
+                continue
+
+            # GUARD 1.7: Corpus Companion Check
+            # (Tags the corpus already uses side by side are distinct, not synonyms)
+            if guard.co_used(s_tag, best_match, thresholds[1]):
+                continue
+
+            # Pre-calculate native DB robustness to save local variables
+            db_cnt = global_ctx[0].get(s_tag, matrix.canonical_count(s_tag))
+
+            # GUARD 2: Subset / Redundancy Check
+            if (overlap / s_count) >= thresholds[1]:
+                if (not guard.can_drop(s_tag, best_match)
+                        or db_cnt > (s_count * 0.5) or db_cnt > 500 or s_tag in global_ctx[2]):
+                    continue
+                best_match = "_DROP_"
+
+            # GUARD 3: General Category Mismatch & Strict Downgrades
+            elif not guard.check(s_tag, best_match, s_count):
+                continue
+
+            # GUARD 4: Established Tag Protection
+            # (Do not rename heavily used tags to other tags unless they are near-identical)
+            if (best_match != "_DROP_" and (db_cnt > 500 or db_cnt > (s_count * 0.5))
+                    and hi_score < 0.95):
+                continue
+
+            results.append({
+                "Sidecar_Tag": s_tag,
+                "Canonical_Tag": best_match,
+                "Confidence": round(hi_score, 4),
+                "Sample_Size": s_count
+            })
+
+    return results
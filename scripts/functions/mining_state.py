@@ -0,0 +1,257 @@
+"""
+Persisted, incrementally updated tag mining counts for shimmie2-tools
+"""
+
+from array import array
+import json
+import sqlite3
+
+import numpy as np
+
+from functions.cooccurrence import ID_BITS, ID_MASK, CoOccurrenceMatrix, _grow
+from functions.tag_vocab import TagVocabulary
+
+NOT_SEEN = np.iinfo(np.int64).max
+
+def _ids_blob(ids):
+    return array("q", ids).tobytes()
+
+class MiningState(CoOccurrenceMatrix): # pylint: disable=too-many-instance-attributes
+    """
+    A co-occurrence matrix kept in SQLite between mining runs.
+
+    Every looked-up image is stored by md5 with the stamp (size and mtime) of
+    its sidecar files and its sidecar and canonical tag IDs, which are NULL
+    when it had no canonical tags. Next to them are the per-tag counts, the
+    pair (shared, overlap, first-seen) counts and the best canonical match of
+    every sidecar tag. update() counts only new and re-stamped images (and
+    subtracts removed and re-stamped ones) with delta matrices, then re-scores
+    just the sidecar tags whose best match could have moved:
+    - those in a delta;
+    - those whose best canonical tag grew more common;
+    - those paired with a canonical tag that became rarer.
+
+    The query methods are CoOccurrenceMatrix's, so calculate_equivalencies()
+    takes a MiningState unchanged. Tag IDs are the vocabulary's, persisted in
+    order. Canonical tag changes in the DB don't touch the stamps; `rebuild`
+    empties the state so everything is counted again.
+    """
+    def __init__(self, db_path, rebuild=False, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        if rebuild:
+            self.conn.executescript("DROP TABLE IF EXISTS tags; DROP TABLE IF EXISTS pairs; "
+                                    "DROP TABLE IF EXISTS best; DROP TABLE IF EXISTS images; "
+                                    "DROP TABLE IF EXISTS meta;")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY, tag TEXT UNIQUE,
+                sidecar INTEGER DEFAULT 0, canonical INTEGER DEFAULT 0, first INTEGER);
+            CREATE TABLE IF NOT EXISTS pairs (
+                s INTEGER, c INTEGER, shared INTEGER, overlap INTEGER, first INTEGER,
+                PRIMARY KEY (s, c)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_pairs_c ON pairs (c);
+            CREATE TABLE IF NOT EXISTS best (
+                s INTEGER PRIMARY KEY, c INTEGER, score REAL, overlap INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_best_c ON best (c);
+            CREATE TABLE IF NOT EXISTS images (
+                md5 TEXT PRIMARY KEY, sidecar BLOB, canonical BLOB, stamp TEXT) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TEMP TABLE IF NOT EXISTS staged (
+                s INTEGER, c INTEGER, shared INTEGER, overlap INTEGER, first INTEGER);
+            CREATE TEMP TABLE IF NOT EXISTS lowered (s INTEGER, c INTEGER);
+        """)
+        if "stamp" not in [row[1] for row in self.conn.execute("PRAGMA table_info(images)")]:
+            # Images counted before stamps were kept get a NULL one, so they're recounted once
+            self.conn.execute("ALTER TABLE images ADD COLUMN stamp TEXT")
+
+        rows = self.conn.execute(
+            "SELECT tag, sidecar, canonical, first FROM tags ORDER BY id").fetchall()
+        self.vocab = TagVocabulary()
+        self.vocab.intern_many(row[0] for row in rows)
+        self.stored_tags = len(rows)
+        self.sidecar_counts = np.array([row[1] for row in rows], np.int64)
+        self.canonical_counts = np.array([row[2] for row in rows], np.int64)
+        self.sidecar_first = np.array(
+            [NOT_SEEN if row[3] is None else row[3] for row in rows], np.int64)
+        self.best = {s: (c, score, overlap) for s, c, score, overlap
+                     in self.conn.execute("SELECT s, c, score, overlap FROM best")}
+        self.stamps = dict(self.conn.execute("SELECT md5, stamp FROM images"))
+        self.valid = self._valid()
+        self.seen = self._meta("seen") or [0, 0]
+
+    def _valid(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM images WHERE canonical IS NOT NULL").fetchone()[0]
+
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, added, removed, options=None):
+        """
+        Applies the images counted since the last run.
+
+        Args:
+            added (list): (md5, stamp, sidecar tags, canonical tags) of new images
+                and of stored ones whose stamp changed; canonical may be empty.
+            removed (iterable): md5s of images no longer in the image list.
+            options (dict): Optional memory_budget/spill_dir for the delta matrices.
+
+        Returns:
+            int: Sidecar tags re-scored.
+        """
+        options = {k: v for k, v in (options or {}).items()
+                   if k in ("memory_budget", "spill_dir")}
+        plus = CoOccurrenceMatrix(vocab=self.vocab, **options)
+        minus = CoOccurrenceMatrix(vocab=self.vocab, **options)
+        s_base, c_base = self.seen
+        removed = list(removed)
+        images = []
+        for md5, stamp, sidecars, canonical in added:
+            if md5 in self.stamps:
+                removed.append(md5)
+            if not canonical:
+                images.append((md5, None, None, stamp))
+                continue
+            sidecars, canonical = list(dict.fromkeys(sidecars)), list(canonical)
+            plus.add(sidecars, canonical)
+            images.append((md5, _ids_blob(self.vocab.intern_many(sidecars)),
+                           _ids_blob(self.vocab.intern_many(canonical)), stamp))
+            self.seen = [self.seen[0] + len(sidecars), self.seen[1] + len(canonical)]
+        self._subtract(minus, removed)
+
+        self.conn.execute("DELETE FROM lowered")
+        rescore = self._apply(minus.finish(), -1, 0) | self._apply(plus.finish(), 1, c_base)
+        # Only pairs a removed image lowered can have dropped to zero
+        self.conn.execute("DELETE FROM pairs WHERE shared <= 0 AND (s, c) IN "
+                          "(SELECT s, c FROM lowered)")
+        rescore |= self._apply_counts(plus, minus, s_base)
+
+        self.conn.executemany("DELETE FROM images WHERE md5 = ?", ((m,) for m in removed))
+        self.conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)", images)
+        for md5 in removed:
+            self.stamps.pop(md5, None)
+        self.stamps.update((md5, stamp) for md5, _, _, stamp in images)
+        self.valid = self._valid()
+
+        self._rescore(sorted(rescore))
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('seen', ?)",
+                          (json.dumps(self.seen),))
+        self.conn.commit()
+        plus.close()
+        minus.close()
+        return len(rescore)
+
+    def _subtract(self, minus, md5s):
+        """Adds the stored images `md5s` to `minus`; those without canonical tags add nothing."""
+        for md5 in md5s:
+            s_blob, c_blob = self.conn.execute(
+                "SELECT sidecar, canonical FROM images WHERE md5 = ?", (md5,)).fetchone()
+            if c_blob is not None:
+                minus.add(self.vocab.decode(array("q", s_blob)),
+                          self.vocab.decode(array("q", c_blob)))
+
+    def _apply(self, matrix, sign, pos_base):
+        """
+        Adds (sign=1) or subtracts (sign=-1) a delta's pairs; returns its sidecar IDs.
+        Each block is staged in a temp table and upserted in one statement; the
+        pairs a subtraction touches are noted in `lowered`.
+        """
+        touched = set()
+        for keys, shared, overlap, first in matrix.blocks():
+            rows = keys >> ID_BITS
+            # Subtracting never moves a pair's first-seen position
+            first = first + pos_base if sign > 0 else np.full(len(keys), NOT_SEEN)
+            self.conn.execute("DELETE FROM staged")
+            self.conn.executemany(
+                "INSERT INTO staged VALUES (?, ?, ?, ?, ?)",
+                zip(rows.tolist(), (keys & ID_MASK).tolist(), (shared * sign).tolist(),
+                    (overlap * sign).tolist(), first.tolist()))
+            self.conn.execute(
+                "INSERT INTO pairs SELECT * FROM staged WHERE true "
+                "ON CONFLICT (s, c) DO UPDATE SET "
+                "shared = shared + excluded.shared, overlap = overlap + excluded.overlap, "
+                "first = MIN(first, excluded.first)")
+            if sign < 0:
+                self.conn.execute("INSERT INTO lowered SELECT s, c FROM staged")
+            touched.update(np.unique(rows).tolist())
+        return touched
+
+    def _apply_counts(self, plus, minus, s_base):
+        """
+        Folds the deltas' per-tag counts in and persists the tags that changed.
+        Returns the sidecar IDs whose best match a canonical count change may move.
+        """
+        size = len(self.vocab)
+        s_delta = _grow(plus.sidecar_counts, size) - _grow(minus.sidecar_counts, size)
+        c_delta = _grow(plus.canonical_counts, size) - _grow(minus.canonical_counts, size)
+        self.sidecar_counts = _grow(self.sidecar_counts, size) + s_delta
+        self.canonical_counts = _grow(self.canonical_counts, size) + c_delta
+        plus_first = _grow(plus.sidecar_first, size, NOT_SEEN).copy()
+        plus_first[plus_first != NOT_SEEN] += s_base
+        old_first = _grow(self.sidecar_first, size, NOT_SEEN)
+        self.sidecar_first = np.minimum(old_first, plus_first)
+
+        changed = np.flatnonzero((s_delta != 0) | (c_delta != 0)
+                                 | (self.sidecar_first != old_first)
+                                 | (np.arange(size) >= self.stored_tags))
+        self.conn.executemany(
+            "INSERT INTO tags VALUES (?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+            "sidecar = excluded.sidecar, canonical = excluded.canonical, first = excluded.first",
+            ((i, self.vocab.name(i), int(self.sidecar_counts[i]),
+              int(self.canonical_counts[i]),
+              None if self.sidecar_first[i] == NOT_SEEN else int(self.sidecar_first[i]))
+             for i in changed.tolist()))
+        self.stored_tags = size
+
+        # A canonical tag growing only lowers its own scores: just the rows it wins can move.
+        # One shrinking raises them, so every row it appears in can move.
+        grown = set(np.flatnonzero(c_delta > 0).tolist())
+        rescore = {s for s, (c, _, _) in self.best.items() if c in grown}
+        for c in np.flatnonzero(c_delta < 0).tolist():
+            rescore.update(row[0] for row in self.conn.execute(
+                "SELECT s FROM pairs WHERE c = ?", (c,)))
+        return rescore
+
+    def _rescore(self, sidecar_ids):
+        """Recomputes the best match of each sidecar tag in `sidecar_ids`."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS rescore (id INTEGER PRIMARY KEY)")
+        self.conn.execute("DELETE FROM rescore")
+        self.conn.executemany("INSERT INTO rescore VALUES (?)", ((s,) for s in sidecar_ids))
+        for s in sidecar_ids:
+            self.best.pop(s, None)
+
+        cur = self.conn.execute("SELECT p.s, p.c, p.shared, p.overlap, p.first "
+                                "FROM rescore r JOIN pairs p ON p.s = r.id ORDER BY p.s")
+        found = {}
+        pending = np.empty((0, 5), np.int64)
+        while True:
+            rows = cur.fetchmany(self.chunk_pairs)
+            block = np.concatenate((pending, np.array(rows, np.int64).reshape(-1, 5)))
+            if rows:
+                # Hold the last sidecar tag back; its row may continue in the next fetch
+                cut = int(np.searchsorted(block[:, 0], block[-1, 0]))
+                block, pending = block[:cut], block[cut:]
+            if len(block):
+                found.update(self._pick_best(block.T, 1))
+            if not rows:
+                break
+
+        self.best.update(found)
+        self.conn.execute("DELETE FROM best WHERE s IN (SELECT id FROM rescore)")
+        self.conn.executemany("INSERT INTO best VALUES (?, ?, ?, ?)",
+                              ((s, c, score, overlap)
+                               for s, (c, score, overlap) in found.items()))
+
+    def best_matches(self, min_count=1):
+        """Stored best match of every sidecar tag seen `min_count`+ times."""
+        return {s: match for s, match in self.best.items()
+                if self.sidecar_counts[s] >= min_count}
+
+    def close(self):
+        """Commits and closes the store."""
+        super().close()
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,90 @@
+"""
+Vectorised rating engine for shimmie2-tools
+"""
+
+import sqlite3
+
+from functions.core import lazy_import
+from functions.tag_vocab import TagVocabulary
+
+# NumPy loads on first scoring, keeping it out of update_ratings.py's cold start
+np = lazy_import("numpy")
+
+class RatingEngine:
+    """
+    Scores many images at once from a tag-weight vector indexed by tag ID.
+
+    Images are given as CSR-style arrays: the tag IDs of image i are
+    indices[indptr[i]:indptr[i + 1]], in the order they would have been seen by
+    the per-tag loop. The score matches that loop exactly: every weight > 1 is
+    summed, and a weight == 1 tag raises the score to 1 only if it appears
+    before the first weight > 1 tag (i.e. while the running total is still 0).
+    """
+    def __init__(self, rating_map, vocab=None):
+        self.vocab = vocab if vocab is not None else TagVocabulary()
+        ids = self.vocab.intern_many(t.strip() for t in rating_map)
+        self.weights = np.zeros(len(self.vocab), dtype=np.int64)
+        self.weights[ids] = np.fromiter((int(w) for w in rating_map.values()),
+                                        dtype=np.int64, count=len(ids))
+
+    @classmethod
+    def from_db(cls, db_path, vocab=None):
+        """Loads weights from a dominant_tag_ratings SQLite table."""
+        with sqlite3.connect(db_path) as conn:
+            rating_map = dict(conn.execute(
+                "SELECT tag_name, dominant_rating FROM dominant_tag_ratings"))
+        return cls(rating_map, vocab)
+
+    def _weight_vector(self):
+        """Weights sized to the vocabulary (tags interned later weigh 0)."""
+        if len(self.weights) < len(self.vocab):
+            grown = np.zeros(len(self.vocab), dtype=np.int64)
+            grown[:len(self.weights)] = self.weights
+            self.weights = grown
+        return self.weights
+
+    def score_csr(self, indptr, indices):
+        """Returns an int64 score per image."""
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+        rows = len(indptr) - 1
+        if rows <= 0:
+            return np.zeros(0, dtype=np.int64)
+
+        weights = self._weight_vector()[indices]
+        heavy = weights > 1
+        summed = np.concatenate(([0], np.cumsum(np.where(heavy, weights, 0))))
+        scores = summed[indptr[1:]] - summed[indptr[:-1]]
+
+        # Row of every entry; positions are increasing within a row
+        row_of = np.repeat(np.arange(rows), np.diff(indptr))
+        positions = np.arange(len(indices))
+        first_heavy = self._first_position(row_of, positions, heavy, rows)
+        first_one = self._first_position(row_of, positions, weights == 1, rows)
+
+        # The floor only applies while nothing heavier has been counted yet
+        return scores + (first_one < first_heavy)
+
+    @staticmethod
+    def _first_position(row_of, positions, mask, rows):
+        """Position of the first masked entry per row (len(positions) if none)."""
+        first = np.full(rows, len(positions), dtype=np.int64)
+        hit_rows, first_idx = np.unique(row_of[mask], return_index=True)
+        first[hit_rows] = positions[mask][first_idx]
+        return first
+
+    def score(self, tag_ids):
+        """Score of a single image."""
+        return int(self.score_csr([0, len(tag_ids)], tag_ids)[0])
+
+    @staticmethod
+    def letters(scores, safe_max, questionable_max):
+        """
+        Vectorised rating_from_score; rows with a score of 0 get '' (no opinion),
+        leaving the caller's fallback in charge.
+        """
+        scores = np.asarray(scores)
+        return np.select(
+            [scores <= 0, scores <= safe_max, scores <= questionable_max],
+            ["", "s", "q"], default="e"
+        )
@@ -0,0 +1,179 @@
+"""
+Source URL resolution for shimmie2-tools
+"""
+
+from functools import lru_cache
+from urllib.parse import urlsplit
+import json
+import re
+
+# Lower is better. Keys are registered domains; subdomains inherit their score.
+DEFAULT_SOURCE_PRIORITY = {
+    "pixiv.net": 1,
+    "fantia.jp": 2,
+    "tumblr.com": 3,
+    "baraag.net": 4,   # Mastodon 1
+    "misskey.io": 5,   # Mastodon 2
+    "pawoo.net": 6,    # Mastodon 3
+    "twitter.com": 7,
+    "x.com": 7,
+    "gelbooru.com": 8,
+    "konachan.com": 9,
+    "kemono.cr": 10,
+    "danbooru.donmai.us": 11,
+    "twimg.com": 12,
+    "yande.re": 13
+}
+UNKNOWN_SCORE = 100  # Unknown but valid URLs
+MISSING_SCORE = 999
+
+# --- CDN matchers, one per site, keyed by the domain they are dispatched on ---
+
+# Example: 'https://i.pximg.net/img-original/img/yyyy/mm/dd/00/00/00/id_p0.png'
+PIXIV_CDN = re.compile(
+    r"(?:i|img)\d{0,5}\.(?:pximg|pixiv)\.net/"
+    r"(?:(?:img-original|img\d{1,5})/img/|img/)"
+    r"(?:\d{4}/\d{2}/\d{2}/\d{2}/\d{2}/\d{2}/)?"
+    r"(?:[^/]+/)?"
+    r"(\d+)"
+    r"(?:_(?:[\w]+_)?p\d{1,3})?"
+    r"\.(?:jpg|jpeg|png|webp)"
+)
+# Example: 'https://c.fantia.jp/uploads/post/file/id/main_image.jpg'
+FANTIA_CDN = re.compile(r"c\.fantia\.jp/uploads/post/file/(\d+)/")
+# Example: 'https://username.tumblr.com/post/id/slug'
+TUMBLR_POST = re.compile(r"([\w-]+)\.tumblr\.com/post/(\d+)")
+# Example: 'https://files.yande.re/image/hash/yande.re/id/tags.jpg'
+YANDERE_FILE = re.compile(r"files\.yande\.re/.*?/yande\.re(?:%20|\s|\+)(\d+)")
+# Example: 'gelbooru_id_hash.jpg' (matched on any host)
+GELBOORU_FILE = re.compile(r"gelbooru_(\d+)_")
+
+CDN_MATCHERS = {
+    "pximg.net": (PIXIV_CDN, lambda m: f"https://www.pixiv.net/en/artworks/{m[1]}"),
+    "pixiv.net": (PIXIV_CDN, lambda m: f"https://www.pixiv.net/en/artworks/{m[1]}"),
+    "fantia.jp": (FANTIA_CDN, lambda m: f"https://fantia.jp/posts/{m[1]}"),
+    "tumblr.com": (TUMBLR_POST, lambda m: f"https://{m[1]}.tumblr.com/post/{m[2]}"),
+    "yande.re": (YANDERE_FILE, lambda m: f"https://yande.re/post/show/{m[1]}"),
+}
+
+# --- Filename patterns, tried in priority order (first site to match wins) ---
+# Examples: 'gelbooru_123456_hash.jpg', 'konachan_123456_hash.png',
+#           'fanbox/user_id/post_id_optional_text.jpg', 'yandere_123456_hash.jpg'
+FILENAME_SOURCES = (
+    (GELBOORU_FILE, lambda m: f"https://gelbooru.com/index.php?page=post&s=view&id={m[1]}"),
+    (re.compile(r"konachan_(\d+)_"), lambda m: f"https://konachan.com/post/show/{m[1]}"),
+    (re.compile(r"fanbox/(\d+)/(\d+)_"),
+     lambda m: f"https://kemono.cr/fanbox/user/{m[1]}/post/{m[2]}"),
+    (re.compile(r"yandere_(\d+)_"), lambda m: f"https://yande.re/post/show/{m[1]}"),
+)
+
+def load_source_priority(path=None):
+    """
+    Reads a {"domain": score} JSON priority table, or returns the defaults.
+
+    Raises:
+        ValueError: if the file isn't a JSON object of integer scores.
+    """
+    if not path:
+        return dict(DEFAULT_SOURCE_PRIORITY)
+    with open(path, "r", encoding="utf-8") as f:
+        priority = json.load(f)
+    if not isinstance(priority, dict) or not all(isinstance(v, int)
+                                                 for v in priority.values()):
+        raise ValueError(f"Source priority must map domains to integers: {path}")
+    return {domain.lower(): score for domain, score in priority.items()}
+
+def hostname(url):
+    """Lower-cased hostname of `url` (scheme optional), or None."""
+    try:
+        return urlsplit(url if "//" in url else f"//{url}").hostname
+    except ValueError:
+        return None
+
+def domain_suffixes(host):
+    """'a.b.pixiv.net' -> 'a.b.pixiv.net', 'b.pixiv.net', 'pixiv.net', 'net'."""
+    labels = host.split(".")
+    return (".".join(labels[i:]) for i in range(len(labels)))
+
+class SourceResolver:
+    """
+    Picks the best source URL for a post, compiled once per run.
+
+    Each URL is dispatched on its hostname to the one CDN matcher and one
+    priority entry for that site, so adding a site costs the others nothing.
+    Posts share CDN hosts and sources, so conversions and scores are memoised.
+    """
+    def __init__(self, priority=None, cache_size=65536):
+        self.priority = dict(DEFAULT_SOURCE_PRIORITY if priority is None else priority)
+        self.convert = lru_cache(maxsize=cache_size)(self._convert)
+        self.score = lru_cache(maxsize=cache_size)(self._score)
+
+    def _convert(self, url):
+        """
+        Converts CDN links to more descriptive URLs.
+
+        Returns:
+            str: The converted URL. If the URL is not a known CDN link, it is returned as is.
+
+        Raises:
+            TypeError: if input is not a string.
+        """
+        if not isinstance(url, str):
+            raise TypeError(f"Input image URL must be a string. Received {type(url)}")
+
+        host = hostname(url)
+        if host:
+            for domain in domain_suffixes(host):
+                matcher = CDN_MATCHERS.get(domain)
+                if matcher:
+                    pattern, canonical = matcher
+                    match = pattern.search(url)
+                    if match:
+                        return canonical(match)
+                    break
+
+        match = GELBOORU_FILE.search(url)
+        if match:
+            return f"https://gelbooru.com/index.php?page=post&s=view&id={match[1]}"
+        return url
+
+    def _score(self, url):
+        """Returns the priority score for a given URL. Lower is better."""
+        if not url:
+            return MISSING_SCORE
+        host = hostname(url)
+        if host:
+            for domain in domain_suffixes(host):
+                score = self.priority.get(domain)
+                if score is not None:
+                    return score
+        return UNKNOWN_SCORE
+
+    @staticmethod
+    def from_filename(filename):
+        """Extracts a canonical source URL from a standardized filename path."""
+        if not isinstance(filename, str):
+            return None
+        for pattern, canonical in FILENAME_SOURCES:
+            match = pattern.search(filename)
+            if match:
+                return canonical(match)
+        return None
+
+    def best(self, post_source, filename):
+        """
+        Evaluates both the metadata source and filename, returning the highest priority URL.
+        """
+        if isinstance(post_source, list):
+            candidates = [self.convert(src) for src in post_source]
+        elif post_source:
+            candidates = [self.convert(post_source)]
+        else:
+            candidates = []
+        candidates.append(self.from_filename(str(filename)))
+
+        candidates = [c for c in candidates if c]
+        if not candidates:
+            return None
+        # min() keeps the first of equal scores, like the stable sort did
+        return min(candidates, key=self.score)
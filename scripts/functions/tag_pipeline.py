@@ -0,0 +1,196 @@
+"""
+Precompiled tag pipeline for shimmie2-tools
+"""
+
+import re
+
+from functions.tag_vocab import TagVocabulary, CATEGORY_CODES
+from functions.utils import MASTER_MERGE_LIST
+
+RESOLUTION_TAGS = frozenset({"lowres", "highres", "absurdres",
+                             "incredibly_absurdres", "wide_image", "tall_image"})
+POST_CATEGORIES = (("general", ""), ("character", "character:"),
+                   ("series", "series:"), ("artist", "artist:"))
+PLACEHOLDER_CATEGORIES = ("artist", "character", "series")
+WHITESPACE = re.compile(r'\s+')
+SERIES_SUFFIX = re.compile(r'_series\)$')
+
+class TagWeights: # pylint: disable=too-few-public-methods
+    """
+    Rating weights by tag ID, looked up in the rating map on first use.
+
+    The rating map may be a memory-mapped MappingIndex of every rated tag, so
+    only the IDs an import actually sees are decoded and memoised.
+    """
+    def __init__(self, rating_map, vocab):
+        self.rating_map = rating_map
+        self.vocab = vocab
+        self._memo = {}
+
+    def get(self, tag_id, default=0):
+        """Weight of `tag_id`, or `default` for unrated tags."""
+        try:
+            weight = self._memo[tag_id]
+        except KeyError:
+            # Unrated tags are memoised as None too
+            weight = self._memo[tag_id] = self.rating_map.get(self.vocab.name(tag_id))
+        return default if weight is None else weight
+
+class TagPipeline: # pylint: disable=too-many-instance-attributes
+    """
+    Turns post data and sidecar tags into the curated tag list in a single pass.
+
+    Built once per run: it holds the character/artist lookups, the merged
+    curation dict (MASTER_MERGE_LIST + mined mappings), the rating weights and
+    the interned placeholder IDs. Tags are interned in a TagVocabulary and handled as
+    integer IDs throughout; compile_metadata decodes them only for the CSV.
+    Enrichment, resolution-tag filtering, normalisation and the optional
+    Danbooru alias/implication closure depend on nothing but the raw tag, so
+    their result is memoised per (prefix, tag).
+    """
+    def __init__(self, mappings, dynamic_mappings=None, pretags=(), vocab=None,
+                 relations=None):
+        self.vocab = vocab if vocab is not None else TagVocabulary()
+        self.relations = relations or None
+        intern = self.vocab.intern
+
+        self.char = mappings.char
+        self.artist = mappings.artist
+        merge = {**MASTER_MERGE_LIST, **(dynamic_mappings or {})}
+        self.merge = {intern(k): intern(v) for k, v in merge.items()}
+        self.weights = TagWeights(mappings.rating, self.vocab)
+
+        self.tagme = intern("tagme")
+        self.dropped = {self.tagme, intern("_DROP_")}
+        self.cosplay = intern("cosplay")
+        self.placeholders = {CATEGORY_CODES[c]: intern(f"{c}:tagme")
+                             for c in PLACEHOLDER_CATEGORIES}
+
+        self._memo = {prefix: {} for _, prefix in POST_CATEGORIES}
+        self._cosplay_of = {}
+        self.pretags = self._expand_all(pretags, "")
+
+    def normalize(self, tag):
+        """Collapses whitespace to underscores and strips redundant _series) suffixes."""
+        tag = WHITESPACE.sub('_', tag.strip())
+        return SERIES_SUFFIX.sub(')', tag)
+
+    def _candidates(self, tag):
+        """
+        `tag` plus its character:/series: forms, as enrich_tags adds them, minus
+        bare characters and with artists prefixed.
+        """
+        candidates = [tag]
+        if tag in self.char:
+            inferred = self.char[tag]
+            candidates.append(f"character:{tag}")
+            if isinstance(inferred, (list, tuple, set)):
+                candidates.extend(f"series:{t}" for t in inferred)
+            else:
+                candidates.append(f"series:{inferred}")
+
+        kept = []
+        for cand in candidates:
+            if cand in self.char:
+                continue
+            if cand in self.artist:
+                cand = f"artist:{cand}"
+                if cand in self.artist:
+                    continue
+            kept.append(cand)
+        return kept
+
+    def _expand(self, tag, implications=True):
+        """
+        Same result as enrich_tags + resolution filtering + normalisation for one tag,
+        followed by the alias/implication closure when relations are loaded.
+        """
+        expanded, aliased, implied = [], [], []
+        for cand in self._candidates(tag):
+            if cand not in RESOLUTION_TAGS:
+                name = self.normalize(cand)
+                if self.relations:
+                    # The closure is transitive: a canonical name is expanded once,
+                    # and implied names are enriched but not followed further
+                    canonical = self.relations.canonical(name)
+                    if canonical != name:
+                        aliased.append(canonical)
+                        continue
+                    if implications:
+                        implied.extend(self.relations.implied(name))
+                expanded.append(self.vocab.intern(name))
+
+        if not (aliased or implied):
+            return tuple(expanded)
+        for name in aliased:
+            expanded.extend(self._expand(name, implications))
+        for name in implied:
+            expanded.extend(self._expand(name, implications=False))
+        return tuple(dict.fromkeys(expanded))
+
+    def _expand_all(self, tags, prefix):
+        """Enriched, normalised tag IDs for every raw tag (memoised per prefix)."""
+        memo = self._memo[prefix]
+        ids = []
+        for tag in tags:
+            out = memo.get(tag)
+            if out is None:
+                out = memo[tag] = self._expand(prefix + tag)
+            ids.extend(out)
+        return ids
+
+    def build(self, post, sidecar_tags, extra_tags=()):
+        """
+        Produces the curated tag IDs for one file.
+
+        Args:
+            post (dict): Post data as returned by row_to_post_dict.
+            sidecar_tags (list): Tags parsed from the sidecar file(s).
+            extra_tags (iterable): Already-derived tags (resolution, source) appended
+                after enrichment, as compile_metadata always did.
+
+        Returns:
+            list: Tag IDs ready for the tagme/rating/placeholder steps.
+        """
+        ids = list(self.pretags)
+        for field, prefix in POST_CATEGORIES:
+            ids.extend(self._expand_all(post.get(field, []), prefix))
+        ids.extend(self._expand_all(sidecar_tags, ""))
+        ids.extend(self.vocab.intern(self.normalize(t)) for t in extra_tags)
+        return self.curate(ids)
+
+    def _cosplay_target(self, tag_id):
+        """ID of character:<base> for a <base>_(cosplay) tag, else -1."""
+        target = self._cosplay_of.get(tag_id)
+        if target is None:
+            name = self.vocab.name(tag_id)
+            target = -1
+            if name.endswith("_(cosplay)"):
+                target = self.vocab.intern(f"character:{name[:-10]}")
+            self._cosplay_of[tag_id] = target
+        return target
+
+    def curate(self, ids):
+        """Equivalent of apply_tag_curation, on tag IDs."""
+        bare, has_colon = self.vocab.bare, self.vocab.has_colon
+
+        # Drop bare tags whose prefixed form is present, before and after merging
+        prefixed = {bare[t] for t in ids}
+        merged = [self.merge.get(t, t) for t in ids if has_colon[t] or t not in prefixed]
+        prefixed = {bare[t] for t in merged}
+        kept = [t for t in merged if has_colon[t] or t not in prefixed]
+
+        present = set(kept)
+        result = []
+        for tag_id in kept:
+            if self._cosplay_target(tag_id) in present:
+                result.append(self.cosplay)
+            elif tag_id not in self.dropped:
+                result.append(tag_id)
+        return result
+
+    def missing_placeholders(self, ids):
+        """artist:/character:/series: tagme IDs for categories absent from `ids`."""
+        categories = self.vocab.categories
+        present = {categories[t] for t in ids}
+        return [tag_id for code, tag_id in self.placeholders.items() if code not in present]
@@ -0,0 +1,283 @@
+"""
+Danbooru tag alias and implication closure for shimmie2-tools
+"""
+
+from collections import defaultdict
+from pathlib import Path
+import csv
+import json
+import sqlite3
+
+from functions.mapping_index import open_mapping_index
+
+ALIAS, IMPLICATION = "alias", "implication"
+# Aliases and implications are between bare names; these prefixes are kept around them
+RELATION_PREFIXES = ("character:", "series:", "artist:")
+
+def load_relation_dump(path):
+    """
+    Yields active (antecedent, consequent) pairs from a Danbooru tag_aliases or
+    tag_implications dump: a CSV export, a JSON array as served by the API, or
+    JSON lines. Rows without a status count as active.
+    """
+    path = Path(path)
+    with path.open("r", encoding="utf-8") as f:
+        if path.suffix.lower() == ".csv":
+            rows = csv.DictReader(f)
+        elif f.read(1) == "[":
+            f.seek(0)
+            rows = json.load(f)
+        else:
+            f.seek(0)
+            rows = (json.loads(line) for line in f if line.strip())
+
+        for row in rows:
+            if row.get("status", "active") not in ("active", ""):
+                continue
+            antecedent = (row.get("antecedent_name") or "").strip()
+            consequent = (row.get("consequent_name") or "").strip()
+            if antecedent and consequent and antecedent != consequent:
+                yield antecedent, consequent
+
+def _reverse_reach(seeds, reverse):
+    """`seeds` plus every node with a path to one of them."""
+    reached, stack = set(seeds), list(seeds)
+    while stack:
+        for parent in reverse.get(stack.pop(), ()):
+            if parent not in reached:
+                reached.add(parent)
+                stack.append(parent)
+    return reached
+
+def _implication_closure(graph, roots):
+    """
+    Everything each node reachable from `roots` implies, transitively.
+
+    Computed per strongly connected component (iterative Tarjan), so every tag
+    on an implication cycle gets the full closure of the cycle. A component's
+    set is shared by its members and still contains them.
+    """
+    index, low, stack, on_stack, closure = {}, {}, [], set(), {}
+
+    def visit(node):
+        index[node] = low[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        return node, iter(graph.get(node, ()))
+
+    def close_component(node):
+        # `node` roots a component; components it points to are already closed
+        component = []
+        while not component or component[-1] != node:
+            component.append(stack.pop())
+            on_stack.discard(component[-1])
+        out = set()
+        for member in component:
+            for child in graph.get(member, ()):
+                out.add(child)
+                out.update(closure.get(child, ()))
+        for member in component:
+            closure[member] = out
+
+    for root in roots:
+        if root in index:
+            continue
+        work = [visit(root)]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    work.append(visit(child))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    close_component(node)
+    return closure
+
+class TagRelationStore:
+    """
+    SQLite store of alias/implication edges and their transitive closure.
+
+    Edges are kept per dump file together with the file's size and mtime, so
+    update() only re-reads dumps that changed and diffs their edges against
+    what was stored. The dumps given for a kind replace the stored set: the
+    edges of a dump no longer given are dropped, while a kind given no dumps
+    keeps what it has. Only tags whose chains pass through a changed edge are
+    re-resolved. A changed alias re-canonicalises the implication graph, so
+    in that case the implication closure is recomputed in full.
+    """
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dumps (
+                path TEXT PRIMARY KEY, kind TEXT, size INTEGER, mtime_ns INTEGER);
+            CREATE TABLE IF NOT EXISTS edges (
+                kind TEXT, source TEXT, antecedent TEXT, consequent TEXT,
+                PRIMARY KEY (kind, source, antecedent, consequent));
+            CREATE TABLE IF NOT EXISTS alias_closure (
+                antecedent TEXT PRIMARY KEY, canonical TEXT);
+            CREATE TABLE IF NOT EXISTS implication_closure (
+                antecedent TEXT PRIMARY KEY, implied TEXT);
+        """)
+
+    def update(self, aliases=(), implications=()):
+        """
+        Syncs the given dump files and refreshes the affected part of the closure.
+
+        Returns:
+            tuple: (changed alias antecedents, changed implication antecedents)
+        """
+        changed = {ALIAS: set(), IMPLICATION: set()}
+        for kind, paths in ((ALIAS, aliases), (IMPLICATION, implications)):
+            paths = [Path(path).resolve() for path in paths]
+            if paths:
+                changed[kind] |= self._drop_dumps(kind, {str(path) for path in paths})
+            for path in paths:
+                changed[kind] |= self._sync_dump(kind, path)
+
+        if changed[ALIAS]:
+            self._update_aliases(changed[ALIAS])
+        if changed[ALIAS] or changed[IMPLICATION]:
+            self._update_implications(changed[IMPLICATION], full=bool(changed[ALIAS]))
+        self.conn.commit()
+        return len(changed[ALIAS]), len(changed[IMPLICATION])
+
+    def _sync_dump(self, kind, path):
+        """Replaces a dump's edges if the file changed; returns the touched antecedents."""
+        st = path.stat()
+        row = self.conn.execute("SELECT size, mtime_ns FROM dumps WHERE path = ? AND kind = ?",
+                                (str(path), kind)).fetchone()
+        if row == (st.st_size, st.st_mtime_ns):
+            return set()
+
+        new = set(load_relation_dump(path))
+        old = set(self.conn.execute(
+            "SELECT antecedent, consequent FROM edges WHERE kind = ? AND source = ?",
+            (kind, str(path))))
+        removed, added = old - new, new - old
+        self.conn.executemany(
+            "DELETE FROM edges WHERE kind = ? AND source = ? AND antecedent = ? AND consequent = ?",
+            ((kind, str(path), a, c) for a, c in removed))
+        self.conn.executemany("INSERT INTO edges VALUES (?, ?, ?, ?)",
+                              ((kind, str(path), a, c) for a, c in added))
+        self.conn.execute("INSERT OR REPLACE INTO dumps VALUES (?, ?, ?, ?)",
+                          (str(path), kind, st.st_size, st.st_mtime_ns))
+        return {a for a, _ in removed | added}
+
+    def _drop_dumps(self, kind, keep):
+        """Removes the edges of stored `kind` dumps not in `keep`; returns their antecedents."""
+        dropped = [source for source, in self.conn.execute(
+            "SELECT path FROM dumps WHERE kind = ?", (kind,)) if source not in keep]
+        touched = set()
+        for source in dropped:
+            touched.update(a for a, in self.conn.execute(
+                "SELECT antecedent FROM edges WHERE kind = ? AND source = ?", (kind, source)))
+            self.conn.execute("DELETE FROM edges WHERE kind = ? AND source = ?", (kind, source))
+            self.conn.execute("DELETE FROM dumps WHERE path = ?", (source,))
+        return touched
+
+    def _edges(self, kind):
+        return self.conn.execute(
+            "SELECT DISTINCT antecedent, consequent FROM edges WHERE kind = ? "
+            "ORDER BY source, antecedent, consequent", (kind,))
+
+    def _update_aliases(self, changed):
+        graph = {}
+        for antecedent, consequent in self._edges(ALIAS):
+            graph.setdefault(antecedent, consequent)
+        reverse = defaultdict(list)
+        for antecedent, consequent in graph.items():
+            reverse[consequent].append(antecedent)
+
+        def resolve(tag):
+            seen, current = {tag}, tag
+            while current in graph:
+                current = graph[current]
+                if current in seen:
+                    return tag # Alias cycle: leave the tag alone
+                seen.add(current)
+            return current
+
+        affected = _reverse_reach(changed, reverse)
+        self.conn.executemany("DELETE FROM alias_closure WHERE antecedent = ?",
+                              ((t,) for t in affected))
+        self.conn.executemany("INSERT INTO alias_closure VALUES (?, ?)",
+                              ((t, c) for t in affected if (c := resolve(t)) != t))
+
+    def _update_implications(self, changed, full=False):
+        canon = dict(self.conn.execute("SELECT antecedent, canonical FROM alias_closure"))
+        graph = defaultdict(set)
+        for antecedent, consequent in self._edges(IMPLICATION):
+            antecedent = canon.get(antecedent, antecedent)
+            consequent = canon.get(consequent, consequent)
+            if antecedent != consequent:
+                graph[antecedent].add(consequent)
+
+        if full:
+            self.conn.execute("DELETE FROM implication_closure")
+            affected = set(graph)
+        else:
+            reverse = defaultdict(list)
+            for antecedent, consequents in graph.items():
+                for consequent in consequents:
+                    reverse[consequent].append(antecedent)
+            affected = _reverse_reach({canon.get(t, t) for t in changed}, reverse)
+            self.conn.executemany("DELETE FROM implication_closure WHERE antecedent = ?",
+                                  ((t,) for t in affected))
+
+        closure = _implication_closure(graph, affected)
+        self.conn.executemany("INSERT INTO implication_closure VALUES (?, ?)",
+                              ((t, " ".join(sorted(out))) for t in affected
+                               if (out := closure[t] - {t})))
+
+    def close(self):
+        """Commits and closes the store."""
+        self.conn.commit()
+        self.conn.close()
+
+class TagRelations:
+    """
+    Read side of the closure: one lookup per tag for its canonical name and
+    one for everything it implies. Both tables are MappingIndex files built
+    from the store, so loading them on every run costs next to nothing.
+    """
+    def __init__(self, aliases, implications):
+        self.aliases = aliases
+        self.implications = implications
+
+    @classmethod
+    def open(cls, db_path):
+        """Opens (building if stale) the alias and implication indexes beside `db_path`."""
+        db_path = Path(db_path)
+        aliases = open_mapping_index(db_path, db_path.with_suffix(".aliases.idx"),
+                                     "SELECT antecedent, canonical FROM alias_closure")
+        implications = open_mapping_index(db_path, db_path.with_suffix(".implications.idx"),
+                                          "SELECT antecedent, implied FROM implication_closure")
+        return cls(aliases, implications)
+
+    def __bool__(self):
+        return bool(len(self.aliases) or len(self.implications))
+
+    @staticmethod
+    def _split(tag):
+        for prefix in RELATION_PREFIXES:
+            if tag.startswith(prefix):
+                return prefix, tag[len(prefix):]
+        return "", tag
+
+    def canonical(self, tag):
+        """The alias target of `tag` (prefix kept), or `tag` itself."""
+        prefix, name = self._split(tag)
+        target = self.aliases.get(name)
+        return prefix + target if target else tag
+
+    def implied(self, tag):
+        """Bare names of every tag `tag` implies, transitively."""
+        implied = self.implications.get(self._split(tag)[1])
+        return implied.split(" ") if implied else ()
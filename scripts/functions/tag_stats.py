@@ -0,0 +1,318 @@
+"""
+Corpus-wide tag count and co-occurrence statistics for shimmie2-tools
+"""
+
+from array import array
+from pathlib import Path
+import sqlite3
+import tempfile
+
+from functions.core import lazy_import
+from functions.mapping_index import INT_VALUES, open_mapping_index
+
+np = lazy_import("numpy")
+cooccurrence = lazy_import("functions.cooccurrence")
+tqdm = lazy_import("tqdm")
+
+TAG_FIELDS = ("general", "character", "artist", "series")
+# Memory for the pair deltas before they spill to disk
+DEFAULT_MEMORY_MB = 512
+
+def post_tags(row):
+    """Distinct bare tag names of a posts_cache row (md5 first, then the tag fields)."""
+    return list(dict.fromkeys(t.strip() for field in row[1:] if field
+                              for t in field.split(",") if t.strip()))
+
+def _merge_join(new_rows, old_rows):
+    """
+    Walks two md5-ordered streams together, yielding (md5, new_row, old_tags)
+    with None on the side where a post is missing.
+    """
+    new, old = next(new_rows, None), next(old_rows, None)
+    while new is not None or old is not None:
+        if old is None or (new is not None and new[0] < old[0]):
+            yield new[0], new, None
+            new = next(new_rows, None)
+        elif new is None or old[0] < new[0]:
+            yield old[0], None, old[1]
+            old = next(old_rows, None)
+        else:
+            yield new[0], new, old[1]
+            new, old = next(new_rows, None), next(old_rows, None)
+
+class TagStatsStore:
+    """
+    SQLite store of per-tag post counts over the posts in posts_cache.db,
+    plus each tag's top-k co-occurring tags.
+
+    Every post's tag IDs are kept next to the counts, so update() can diff the
+    cache against what was counted last time in one md5-ordered pass. New and
+    changed posts add their pairs, and removed and changed posts subtract
+    theirs. The deltas are counted with CoOccurrenceMatrix, which spills to
+    disk past the memory budget, and applied a block at a time.
+
+    Only the top-k pairs of each tag are stored, not the full pair table, so
+    each tag also keeps `rest`, an upper bound on the count of any pair it
+    doesn't store (0 when it stores them all). Deltas keep the stored counts
+    exact, a pair dropped from the top-k raises the bound, and a new pair can
+    only be stored outright while the bound is 0; otherwise it raises the
+    bound by its delta. A touched tag whose bound could outrank its k-th pair
+    has its top-k recounted from the stored posts, which resets the bound, so
+    every stored top-k is the exact one. Changing top_k recounts everything.
+    """
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY, tag TEXT UNIQUE, count INTEGER DEFAULT 0,
+                rest INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS top (
+                tag INTEGER, other INTEGER, count INTEGER,
+                PRIMARY KEY (tag, other)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS posts (md5 TEXT PRIMARY KEY, tags BLOB) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+            CREATE TEMP TABLE IF NOT EXISTS staged (tag INTEGER, other INTEGER, delta INTEGER);
+            CREATE TEMP TABLE IF NOT EXISTS trimmed (tag INTEGER, other INTEGER, count INTEGER);
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(tags)")]
+        if "rest" not in columns:
+            # Stores from before the bound kept approximate top-k lists: recount
+            self.conn.executescript("ALTER TABLE tags ADD COLUMN rest INTEGER DEFAULT 0; "
+                                    "DELETE FROM meta WHERE key = 'top_k';")
+        self.ids = dict(self.conn.execute("SELECT tag, id FROM tags"))
+        self.names = {tag_id: tag for tag, tag_id in self.ids.items()}
+
+    def _tag_id(self, tag):
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            tag_id = self.conn.execute("INSERT INTO tags (tag) VALUES (?)", (tag,)).lastrowid
+            self.ids[tag] = tag_id
+            self.names[tag_id] = tag
+        return tag_id
+
+    def update(self, cache_path, top_k=50, spill=None):
+        """
+        Syncs the statistics with `cache_path` (a posts_cache.db).
+
+        Args:
+            cache_path (Path): posts_cache.db to read.
+            top_k (int): Co-occurring tags kept per tag.
+            spill (tuple): Optional (memory budget in MB, spill directory or None)
+                for the pair deltas; the budget defaults to DEFAULT_MEMORY_MB.
+
+        Returns:
+            dict: Counts of added, changed and removed posts and re-ranked tags.
+        """
+        budget, spill_dir = spill or (None, None)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'top_k'").fetchone()
+        if row is None or row[0] != top_k:
+            if row is not None:
+                print(f"[INFO] Top-k changed from {row[0]} to {top_k}; recounting every post.")
+            self.conn.executescript("DELETE FROM top; DELETE FROM main.posts; "
+                                    "UPDATE tags SET count = 0, rest = 0;")
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('top_k', ?)", (top_k,))
+
+        stats = {"added": 0, "changed": 0, "removed": 0, "tags": 0, "recounted": 0}
+        with tempfile.TemporaryDirectory(prefix="shimmie-tagstats-", dir=spill_dir) as tmp_dir:
+            options = {"memory_budget": int((budget or DEFAULT_MEMORY_MB) * 1024 * 1024),
+                       "spill_dir": tmp_dir}
+            added = cooccurrence.CoOccurrenceMatrix(**options)
+            removed = cooccurrence.CoOccurrenceMatrix(**options)
+
+            self._diff_posts(cache_path, added, removed, stats)
+            touched = set()
+            # Removals first, so they only lower pairs that were already kept
+            for matrix, sign in ((removed.finish(), -1), (added.finish(), 1)):
+                touched |= self._apply(matrix, sign, top_k)
+                matrix.close()
+
+            stats["recounted"] = self._recount(self._stale_tags(touched, top_k), top_k, options)
+
+        stats["tags"] = len(touched)
+        self.conn.commit()
+        return stats
+
+    def _diff_posts(self, cache_path, added, removed, stats):
+        """Streams the cache against the stored posts, filling the two delta matrices."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS post_changes "
+                          "(md5 TEXT PRIMARY KEY, tags BLOB)")
+        self.conn.execute("DELETE FROM post_changes")
+        cache = sqlite3.connect(f"file:{Path(cache_path).resolve()}?mode=ro", uri=True)
+        try:
+            new_rows = cache.execute(
+                f"SELECT md5, {', '.join(TAG_FIELDS)} FROM posts ORDER BY md5")
+            old_rows = self.conn.execute("SELECT md5, tags FROM main.posts ORDER BY md5")
+            changes = []
+            for md5, new, old_blob in tqdm.tqdm(_merge_join(iter(new_rows), iter(old_rows)),
+                                                desc="Diffing posts", unit="post"):
+                tags = post_tags(new) if new is not None else []
+                blob = array("q", sorted(map(self._tag_id, tags))).tobytes() if tags else None
+                if blob == old_blob:
+                    continue
+                if old_blob:
+                    old_tags = [self.names[i] for i in array("q", old_blob)]
+                    removed.add(old_tags, old_tags)
+                if tags:
+                    added.add(tags, tags)
+                stats["changed" if old_blob and tags else "added" if tags else "removed"] += 1
+                changes.append((md5, blob))
+                if len(changes) >= 10000:
+                    self.conn.executemany("INSERT INTO post_changes VALUES (?, ?)", changes)
+                    changes = []
+            self.conn.executemany("INSERT INTO post_changes VALUES (?, ?)", changes)
+        finally:
+            cache.close()
+
+        self.conn.execute("DELETE FROM main.posts WHERE md5 IN "
+                          "(SELECT md5 FROM post_changes WHERE tags IS NULL)")
+        self.conn.execute("INSERT OR REPLACE INTO main.posts "
+                          "SELECT md5, tags FROM post_changes WHERE tags IS NOT NULL")
+
+    def _apply(self, matrix, sign, top_k):
+        """
+        Adds (sign=1) or subtracts (sign=-1) a delta matrix a block at a time,
+        trimming the top-k of the tags each block touches; returns their IDs.
+        """
+        remap = np.array([self.ids.get(tag, -1) for tag in matrix.vocab.names], dtype=np.int64)
+        touched = set()
+        for keys, shared, _, _ in matrix.blocks():
+            rows = remap[keys >> cooccurrence.ID_BITS]
+            self._stage(rows, remap[keys & cooccurrence.ID_MASK], shared * sign)
+            # A tag paired with itself is its post count
+            self.conn.execute("UPDATE tags SET count = count + s.delta FROM staged s "
+                              "WHERE s.tag = s.other AND tags.id = s.tag")
+            self.conn.execute("UPDATE top SET count = count + s.delta FROM staged s "
+                              "WHERE top.tag = s.tag AND top.other = s.other")
+            # A pair that isn't stored is new (exact) while the bound is 0;
+            # otherwise its count is unknown and only raises the bound
+            new_pairs = ("FROM staged s JOIN tags t ON t.id = s.tag WHERE s.tag != s.other "
+                         "AND s.delta > 0 AND NOT EXISTS (SELECT 1 FROM top p "
+                         "WHERE p.tag = s.tag AND p.other = s.other)")
+            self.conn.execute("UPDATE tags SET rest = rest + n.delta FROM ("
+                              f"SELECT s.tag, MAX(s.delta) AS delta {new_pairs} AND t.rest > 0 "
+                              "GROUP BY s.tag) n WHERE tags.id = n.tag")
+            self.conn.execute(f"INSERT INTO top SELECT s.tag, s.other, s.delta {new_pairs} "
+                              "AND t.rest = 0")
+            self._trim(top_k)
+            touched.update(np.unique(rows).tolist())
+        return touched
+
+    def _stage(self, tags, others, deltas):
+        self.conn.execute("DELETE FROM staged")
+        self.conn.executemany("INSERT INTO staged VALUES (?, ?, ?)",
+                              zip(tags.tolist(), others.tolist(), deltas.tolist()))
+
+    def _trim(self, top_k):
+        """Cuts the staged tags' lists back to top_k, raising `rest` to what was cut."""
+        self.conn.execute("DELETE FROM trimmed")
+        self.conn.execute(
+            "INSERT INTO trimmed SELECT tag, other, count FROM ("
+            "SELECT tag, other, count, ROW_NUMBER() OVER ("
+            "PARTITION BY tag ORDER BY count DESC, other) AS rank FROM top "
+            "WHERE tag IN (SELECT DISTINCT tag FROM staged)) "
+            "WHERE count <= 0 OR rank > ?", (top_k,))
+        self.conn.execute("UPDATE tags SET rest = MAX(rest, d.count) FROM ("
+                          "SELECT tag, MAX(count) AS count FROM trimmed GROUP BY tag) d "
+                          "WHERE tags.id = d.tag")
+        self.conn.execute("DELETE FROM top WHERE (tag, other) IN (SELECT tag, other FROM trimmed)")
+
+    def _stale_tags(self, touched, top_k):
+        """Touched tags whose bound could place an unstored pair in their top-k."""
+        # No pair can outnumber the tag's own posts
+        self.conn.execute("UPDATE tags SET rest = count WHERE rest > count")
+        stale = []
+        for tag_id, rest, kept, lowest in self.conn.execute(
+                "SELECT t.id, t.rest, COUNT(p.other), MIN(p.count) FROM tags t "
+                "LEFT JOIN top p ON p.tag = t.id WHERE t.rest > 0 GROUP BY t.id"):
+            if tag_id in touched and (kept < top_k or lowest <= rest):
+                stale.append(tag_id)
+        return stale
+
+    def _posts_with(self, tag_ids):
+        """(wanted tag IDs, all tag IDs) of every stored post carrying any of `tag_ids`."""
+        wanted = np.array(sorted(tag_ids), dtype=np.int64)
+        blobs = self.conn.execute("SELECT tags FROM main.posts")
+        while chunk := blobs.fetchmany(10000):
+            ids = np.frombuffer(b"".join(blob for blob, in chunk), dtype=np.int64)
+            hits = np.isin(ids, wanted)
+            start = 0
+            for blob, in chunk:
+                end = start + len(blob) // 8
+                if hits[start:end].any():
+                    yield ids[start:end][hits[start:end]].tolist(), ids[start:end].tolist()
+                start = end
+
+    def _recount(self, stale, top_k, options):
+        """Recounts the pairs of the `stale` tag IDs over the stored posts; returns how many."""
+        if not stale:
+            return 0
+        matrix = cooccurrence.CoOccurrenceMatrix(**options)
+        for hits, post in self._posts_with(stale):
+            matrix.add([self.names[i] for i in hits], [self.names[i] for i in post])
+        matrix.finish()
+
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS recounted "
+                          "(tag INTEGER, other INTEGER, count INTEGER)")
+        self.conn.execute("DELETE FROM recounted")
+        remap = np.array([self.ids[tag] for tag in matrix.vocab.names], dtype=np.int64)
+        for keys, shared, _, _ in matrix.blocks():
+            self._stage(remap[keys >> cooccurrence.ID_BITS],
+                        remap[keys & cooccurrence.ID_MASK], shared)
+            self.conn.execute("INSERT INTO recounted SELECT * FROM staged WHERE tag != other")
+        matrix.close()
+
+        self.conn.executemany("DELETE FROM top WHERE tag = ?", ((t,) for t in stale))
+        self.conn.executemany("UPDATE tags SET rest = 0 WHERE id = ?", ((t,) for t in stale))
+        ranked = ("SELECT tag, other, count, ROW_NUMBER() OVER (PARTITION BY tag "
+                  "ORDER BY count DESC, other) AS rank FROM recounted")
+        self.conn.execute(f"INSERT INTO top SELECT tag, other, count FROM ({ranked}) "
+                          "WHERE rank <= ?", (top_k,))
+        self.conn.execute(f"UPDATE tags SET rest = r.count FROM ({ranked}) r "
+                          "WHERE tags.id = r.tag AND r.rank = ?", (top_k + 1,))
+        return len(stale)
+
+    def close(self):
+        """Commits and closes the store."""
+        self.conn.commit()
+        self.conn.close()
+
+class TagStats:
+    """
+    Read side of the statistics: a tag's corpus-wide post count and its top-k
+    co-occurring tags, each one lookup in a MappingIndex built from the store.
+    """
+    def __init__(self, counts, top):
+        self.counts = counts
+        self.top_lists = top
+
+    @classmethod
+    def open(cls, db_path):
+        """Opens (building if stale) the count and top-k indexes beside `db_path`."""
+        db_path = Path(db_path)
+        counts = open_mapping_index(db_path, db_path.with_suffix(".counts.idx"),
+                                    "SELECT tag, count FROM tags WHERE count > 0", INT_VALUES)
+        top = open_mapping_index(db_path, db_path.with_suffix(".top.idx"), (
+            "SELECT t.tag, group_concat(o.tag || ' ' || p.count, ' ') FROM "
+            "(SELECT * FROM top ORDER BY tag, count DESC, other) p "
+            "JOIN tags t ON t.id = p.tag JOIN tags o ON o.id = p.other GROUP BY p.tag"))
+        return cls(counts, top)
+
+    def count(self, tag):
+        """Posts in the corpus carrying `tag`."""
+        return self.counts.get(tag, 0)
+
+    def top(self, tag):
+        """[(tag, shared posts)] for the tags most often seen with `tag`, highest first."""
+        packed = self.top_lists.get(tag)
+        if not packed:
+            return []
+        parts = packed.split(" ")
+        pairs = [(parts[i], int(parts[i + 1])) for i in range(0, len(parts), 2)]
+        return sorted(pairs, key=lambda pair: -pair[1])
+
+    def confidence(self, tag, other):
+        """Share of `tag`'s posts that also carry `other` (0.0 if `other` is not in its top-k)."""
+        total = self.count(tag)
+        if not total:
+            return 0.0
+        return next((shared / total for name, shared in self.top(tag) if name == other), 0.0)
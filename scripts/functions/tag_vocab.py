@@ -0,0 +1,71 @@
+"""
+Interned tag vocabulary for shimmie2-tools
+"""
+
+CATEGORIES = ("general", "character", "series", "artist", "source")
+CATEGORY_CODES = {name: code for code, name in enumerate(CATEGORIES)}
+GENERAL = CATEGORY_CODES["general"]
+# Prefixes that make a tag non-general (everything but "general:" itself)
+PREFIX_CODES = {name: code for name, code in CATEGORY_CODES.items() if code != GENERAL}
+
+class TagVocabulary:
+    """
+    Maps every tag string to a dense integer ID exactly once.
+
+    A tag's category comes from its prefix ("character:foo" -> character), so
+    a (category, name) pair and its prefixed string share one ID. Alongside
+    the ID, the vocabulary records the category code, whether the string
+    contains a colon and, for prefixed tags, the ID of the bare name. That
+    lets the hot paths compare prefixed and bare forms as integers instead of
+    rebuilding f-strings.
+    """
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.categories = []
+        self.has_colon = []
+        self.bare = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, tag, category=None):
+        """Returns the ID for `tag` (optionally given as a bare name plus category)."""
+        if category and category != "general":
+            tag = f"{category}:{tag}"
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            tag_id = self._add(tag)
+        return tag_id
+
+    def _add(self, tag):
+        tag_id = len(self.names)
+        self.ids[tag] = tag_id
+        self.names.append(tag)
+
+        head, sep, rest = tag.partition(':')
+        code = PREFIX_CODES.get(head) if sep else None
+        self.categories.append(GENERAL if code is None else code)
+        self.has_colon.append(bool(sep))
+        # Reserve the slot first; interning the bare name may append more IDs
+        self.bare.append(-1)
+        if code is not None:
+            self.bare[tag_id] = self.intern(rest)
+        return tag_id
+
+    def intern_many(self, tags, category=None):
+        """Interns an iterable of tags, returning their IDs in order."""
+        return [self.intern(t, category) for t in tags]
+
+    def get(self, tag):
+        """Returns the ID for `tag` without interning it, or None."""
+        return self.ids.get(tag)
+
+    def name(self, tag_id):
+        """Returns the tag string for an ID."""
+        return self.names[tag_id]
+
+    def decode(self, tag_ids):
+        """Turns a sequence of IDs back into tag strings."""
+        names = self.names
+        return [names[i] for i in tag_ids]
@@ -0,0 +1,171 @@
+"""
+SQLite-backed thumbnail job queue for shimmie2-tools
+"""
+
+from pathlib import Path
+import os
+import socket
+import sqlite3
+import time
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+def _pid_alive(pid):
+    """Whether a local process `pid` exists; assumed alive where that can't be checked."""
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class ThumbnailQueue:
+    """
+    Durable queue of (source, thumbnail) jobs.
+
+    Jobs move pending -> running -> done, or back to pending when they fail.
+    Every claim counts as an attempt, so a job that keeps failing, or whose
+    lease keeps expiring because it crashes its worker, is parked as failed
+    once max_attempts is reached. Running jobs whose lease has expired are
+    handed out again until then. Each claim records its owner (host:pid), so
+    reclaim_orphans() can expire the leases of workers that have died on this
+    host right away.
+    """
+    def __init__(self, db_path, lease=600):
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.lease = lease
+        self.host = socket.gethostname()
+        self.owner = f"{self.host}:{os.getpid()}"
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS thumb_jobs (
+                id INTEGER PRIMARY KEY,
+                src TEXT NOT NULL,
+                dst TEXT NOT NULL UNIQUE,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL,
+                owner TEXT
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(thumb_jobs)")]
+        if "owner" not in columns:
+            self.conn.execute("ALTER TABLE thumb_jobs ADD COLUMN owner TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_thumb_state ON thumb_jobs(state)")
+
+    def enqueue(self, tasks):
+        """Adds (src, dst) pairs; an existing job for dst is reset unless it's running."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany("""
+            INSERT INTO thumb_jobs (src, dst, state, attempts, updated_at)
+            VALUES (?, ?, 'pending', 0, ?)
+            ON CONFLICT(dst) DO UPDATE SET
+                src = excluded.src, state = 'pending', attempts = 0,
+                last_error = NULL, updated_at = excluded.updated_at
+            WHERE thumb_jobs.state != 'running'
+        """, [(str(Path(src).resolve()), str(Path(dst).resolve()), now) for src, dst in tasks])
+        self.conn.execute("COMMIT")
+
+    def claim(self, limit, max_attempts):
+        """
+        Atomically marks up to `limit` jobs as running, counting an attempt for each,
+        and returns (id, src, dst) rows. Expired jobs out of attempts are parked first.
+        """
+        now = time.time()
+        expired = now - self.lease
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute("""
+            UPDATE thumb_jobs SET state = 'failed', updated_at = ?,
+                last_error = COALESCE(last_error, 'lease expired')
+            WHERE state = 'running' AND updated_at < ? AND attempts >= ?
+        """, (now, expired, max_attempts))
+        rows = self.conn.execute("""
+            SELECT id, src, dst FROM thumb_jobs
+            WHERE state = 'pending' OR (state = 'running' AND updated_at < ?)
+            ORDER BY id LIMIT ?
+        """, (expired, limit)).fetchall()
+        self.conn.executemany(
+            "UPDATE thumb_jobs SET state = 'running', attempts = attempts + 1, updated_at = ?, "
+            "owner = ? WHERE id = ?",
+            [(now, self.owner, row[0]) for row in rows]
+        )
+        self.conn.execute("COMMIT")
+        return rows
+
+    def finish(self, results, max_attempts):
+        """Records (id, error_or_None) results from a claimed batch."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        for job_id, error in results:
+            if error is None:
+                self.conn.execute(
+                    "UPDATE thumb_jobs SET state = 'done', last_error = NULL, updated_at = ? "
+                    "WHERE id = ?", (now, job_id))
+            else:
+                # The attempt was already counted by claim()
+                self.conn.execute("""
+                    UPDATE thumb_jobs SET
+                        state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                        last_error = ?, updated_at = ?
+                    WHERE id = ?
+                """, (max_attempts, error, now, job_id))
+        self.conn.execute("COMMIT")
+
+    def reclaim_orphans(self):
+        """
+        Expires the leases of running jobs claimed by processes on this host that
+        no longer exist, so the next claim() hands them out (or parks them) at
+        once. Returns the number of jobs reclaimed.
+        """
+        owners = self.conn.execute(
+            "SELECT DISTINCT owner FROM thumb_jobs WHERE state = 'running' AND owner LIKE ?",
+            (f"{self.host}:%",)).fetchall()
+        dead = [owner for owner, in owners
+                if owner != self.owner and not _pid_alive(int(owner.rpartition(":")[2]))]
+        reclaimed = 0
+        for owner in dead:
+            reclaimed += self.conn.execute(
+                "UPDATE thumb_jobs SET updated_at = 0 WHERE state = 'running' AND owner = ?",
+                (owner,)).rowcount
+        return reclaimed
+
+    def next_expiry(self):
+        """Seconds until the earliest running lease expires, or None if nothing is running."""
+        oldest = self.conn.execute(
+            "SELECT MIN(updated_at) FROM thumb_jobs WHERE state = 'running'").fetchone()[0]
+        if oldest is None:
+            return None
+        return max(0.0, oldest + self.lease - time.time())
+
+    def retry_failed(self):
+        """Moves every failed job back to pending with a fresh attempt count."""
+        cur = self.conn.execute(
+            "UPDATE thumb_jobs SET state = 'pending', attempts = 0, last_error = NULL "
+            "WHERE state = 'failed'")
+        return cur.rowcount
+
+    def counts(self):
+        """Returns {state: count} for the whole queue."""
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update(self.conn.execute(
+            "SELECT state, COUNT(*) FROM thumb_jobs GROUP BY state").fetchall())
+        return counts
+
+    def failures(self, limit=20):
+        """Returns the most recent (src, attempts, last_error) rows for failed jobs."""
+        return self.conn.execute("""
+            SELECT src, attempts, last_error FROM thumb_jobs
+            WHERE state = 'failed' ORDER BY updated_at DESC LIMIT ?
+        """, (limit,)).fetchall()
+
+    def close(self):
+        """Closes the underlying connection."""
+        self.conn.close()
@@ -2,221 +2,41 @@
 functions for shimmie2-tools
 """
 
-import os
 import sys
-from collections import defaultdict, Counter
+from collections import defaultdict
 from contextlib import contextmanager
 from pathlib import Path
 import csv
 import hashlib
 import html
 import io
+import json
 import re
 import sqlite3
-import subprocess
+import stat
 import threading
-import tqdm
-
-import pyvips
-from PIL import Image
-
-VIDEO_EXTS = {".gif", ".webm", ".mp4", ".flv", ".m4v", ".f4v", ".f4p", ".ogv"}
-
-def rating_from_score(total_score: int, safe_max: int, questionable_max: int) -> str:
-    """Map a numeric total to the rating letter."""
-    if total_score <= safe_max:
-        return "s"          # safe
-    if total_score <= questionable_max:
-        return "q"          # questionable
-    return "e"              # explicit
-
-def validate_float(value):
-    """Validate if a number is a float between 0.00 and 1.00 and multiple of 0.01"""
-    value = float(value)  # Ensure the value is a float
-    if value < 0.00 or value > 1.00:
-        raise ValueError(f"Value must be between 0.00 and 1.00. Given: {value}")
-    if round(value*100) % 1 != 0:
-        raise ValueError(f"Value must be a multiple of 0.01. Given: {value}")
-    return value
-
-def get_cpu_threads():
-    """
-    Determine CPU threads for multithreading
-    """
-    return os.cpu_count()
 
-def add_module_path(relative_path: str):
-    """
-    Adds the given relative path to sys.path if it's not already present.
-
-    Args:
-        relative_path (str): The relative path from the current script to the module folder.
-    """
-    script_dir = Path(__file__).parent.resolve()
-    module_path = (script_dir / relative_path).resolve()
-    if not module_path.exists():
-        raise FileNotFoundError(f"Module path does not exist: {module_path}")
-    if str(module_path) not in sys.path:
-        sys.path.append(str(module_path))
-
-def get_source_score(url):
-    """Returns the priority score for a given URL. Lower is better."""
-    source_priority = {
-        "pixiv.net": 1,
-        "fantia.jp": 2,
-        "tumblr.com": 3,
-        "baraag.net": 4,   # Mastodon 1
-        "misskey.io": 5,   # Mastodon 2
-        "pawoo.net": 6,    # Mastodon 3
-        "twitter.com": 7,
-        "x.com": 7,
-        "gelbooru.com": 8,
-        "konachan.com": 9,
-        "kemono.cr": 10,
-        "danbooru.donmai.us": 11,
-        "twimg.com": 12,
-        "yande.re": 13
-    }
-    if not url:
-        return 999
+from functions.core import ( # pylint: disable=unused-import
+    VIDEO_EXTS, add_module_path, get_cpu_threads, lazy_import, rating_from_score,
+    validate_float
+)
+from functions.source_resolver import SourceResolver
 
-    url_lower = url.lower()
-    for domain, score in source_priority.items():
-        if domain in url_lower:
-            return score
+# Heavy imaging, numeric and process modules load on first use, not at import
+pyvips = lazy_import("pyvips")
+Image = lazy_import("PIL.Image")
+subprocess = lazy_import("subprocess")
+futures = lazy_import("concurrent.futures")
+tqdm = lazy_import("tqdm")
+pg_pool = lazy_import("psycopg2.pool")
 
-    return 100 # Default score for unknown but valid URLs
+DEFAULT_SOURCE_RESOLVER = SourceResolver()
 
-def convert_filename_to_source(filename):
-    """
-    Extracts canonical source URLs from standardized filename paths.
-    """
-    if not isinstance(filename, str):
-        return None
-
-    # --- Gelbooru Logic ---
-    # Matches filename patterns
-    # Example: 'gelbooru_123456_hash.jpg'
-    gelbooru_match = re.search(r"gelbooru_(\d+)_", filename)
-    if gelbooru_match:
-        return f"https://gelbooru.com/index.php?page=post&s=view&id={gelbooru_match.group(1)}"
-
-    # --- Konachan Logic ---
-    # Matches filename patterns
-    # Example: 'konachan_123456_hash.png'
-    konachan_match = re.search(r"konachan_(\d+)_", filename)
-    if konachan_match:
-        return f"https://konachan.com/post/show/{konachan_match.group(1)}"
-
-    # --- Kemono/Fanbox Logic ---
-    # Matches file paths
-    # Example: 'fanbox/user_id/post_id_optional_text.jpg'
-    kemono_match = re.search(r"fanbox/(\d+)/(\d+)_", filename)
-    if kemono_match:
-        user_id = kemono_match.group(1)
-        post_id = kemono_match.group(2)
-        return f"https://kemono.cr/fanbox/user/{user_id}/post/{post_id}"
-
-    # --- Yande.re Logic ---
-    # Matches filename patterns
-    # Example: 'yandere_123456_hash.jpg'
-    yandere_match = re.search(r"yandere_(\d+)_", filename)
-    if yandere_match:
-        return f"https://yande.re/post/show/{yandere_match.group(1)}"
-
-    return None
-
-def convert_cdn_url(image_url):
-    """
-    Converts CDN links to more descriptive URLs. Currently supports Pixiv and Fantia.
-
-    Args:
-        image_url (str): The image URL.
-
-    Returns:
-        str: The converted URL.  If the URL is not a known CDN link, it is returned as is.
-
-    Raises:
-        TypeError: if input is not a string.
-    """
-    if not isinstance(image_url, str):
-        raise TypeError(f"Input image URL must be a string. Received {type(image_url)}")
-
-    # --- Pixiv Logic ---
-    # Matches original or CDN links
-    # Example: 'https://i.pximg.net/img-original/img/yyyy/mm/dd/00/00/00/id_p0.png'
-    pixiv_pattern = (
-        r"(?:i|img)\d{0,5}\.(?:pximg|pixiv)\.net/"
-        r"(?:(?:img-original|img\d{1,5})/img/|img/)"
-        r"(?:\d{4}/\d{2}/\d{2}/\d{2}/\d{2}/\d{2}/)?"
-        r"(?:[^/]+/)?"
-        r"(\d+)"
-        r"(?:_(?:[\w]+_)?p\d{1,3})?"
-        r"\.(?:jpg|jpeg|png|webp)"
-    )
-    pixiv_match = re.search(pixiv_pattern, image_url)
-    if pixiv_match:
-        artwork_id = pixiv_match.group(1)
-        return f"https://www.pixiv.net/en/artworks/{artwork_id}"
-
-    # --- Fantia Logic ---
-    # Matches post file uploads
-    # Example: 'https://c.fantia.jp/uploads/post/file/id/main_image.jpg'
-    fantia_match = re.search(r"c\.fantia\.jp/uploads/post/file/(\d+)/", image_url)
-    if fantia_match:
-        post_id = fantia_match.group(1)
-        return f"https://fantia.jp/posts/{post_id}"
-
-    # --- Tumblr Logic ---
-    # Matches post URLs
-    # Example: 'https://username.tumblr.com/post/id/slug'
-    tumblr_match = re.search(r"([\w-]+)\.tumblr\.com/post/(\d+)", image_url)
-    if tumblr_match:
-        username = tumblr_match.group(1)
-        post_id = tumblr_match.group(2)
-        return f"https://{username}.tumblr.com/post/{post_id}"
-
-    # --- Gelbooru Logic ---
-    # Matches filenames
-    # Example: 'gelbooru_id_hash.jpg'
-    gelbooru_match = re.search(r"gelbooru_(\d+)_", image_url)
-    if gelbooru_match:
-        post_id = gelbooru_match.group(1)
-        return f"https://gelbooru.com/index.php?page=post&s=view&id={post_id}"
-
-    # --- Yande.re Logic ---
-    # Matches file URLs
-    # Example: 'https://files.yande.re/image/hash/yande.re/id/tags.jpg'
-    yandere_match = re.search(r"files\.yande\.re/.*?/yande\.re(?:%20|\s|\+)(\d+)", image_url)
-    if yandere_match:
-        post_id = yandere_match.group(1)
-        return f"https://yande.re/post/show/{post_id}"
-
-    return image_url
-
-def resolve_best_source(post_source, filename):
+def resolve_best_source(post_source, filename, resolver=None):
     """
     Evaluates both the metadata source and filename, returning the highest priority URL.
     """
-    candidates = []
-
-    if post_source:
-        if isinstance(post_source, list):
-            candidates.extend([convert_cdn_url(src) for src in post_source])
-        else:
-            candidates.append(convert_cdn_url(post_source))
-
-    file_src = convert_filename_to_source(str(filename))
-    if file_src:
-        candidates.append(file_src)
-
-    candidates = [c for c in candidates if c]
-
-    if not candidates:
-        return None
-
-    candidates.sort(key=get_source_score)
-    return candidates[0]
+    return (resolver or DEFAULT_SOURCE_RESOLVER).best(post_source, filename)
 
 def compute_md5(image_path: Path) -> str:
     """
@@ -236,6 +56,95 @@ def compute_md5(image_path: Path) -> str:
     md5_hash = hash_md5.hexdigest()
     return md5_hash
 
+# Larger files (and every video) are hashed in chunks instead of read into memory
+MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+
+class MediaContext:
+    """
+    Per-file media state shared by hashing and resolution tagging.
+
+    Images up to MAX_BUFFERED_BYTES are read from disk once; the md5, the
+    Danbooru pixel hash and the dimensions all come from that buffer. Larger
+    files and videos are streamed from disk instead. Decoded pixels only live
+    while the pixel hash is computed, and release() drops the buffer once a
+    post is resolved, so a batch holds just the derived values. Thumbnailers
+    read the file themselves in their worker processes.
+    """
+    def __init__(self, path, md5=None):
+        self.path = Path(path)
+        self.is_video = self.path.suffix.lower() in VIDEO_EXTS
+        self._data = None
+        self._md5 = md5
+        self._pixel_hash = None
+        self._size = None
+        # ffprobe result for videos, filled from the ProbeCache when available.
+        # A failed probe is cached with width/height None and not retried.
+        self.probe = {}
+
+    @property
+    def buffered(self) -> bool:
+        """Whether the file is small enough to be read into memory once."""
+        if self._data is not None:
+            return True
+        return not self.is_video and self.path.stat().st_size <= MAX_BUFFERED_BYTES
+
+    @property
+    def data(self) -> bytes:
+        """Raw file contents, read on first access."""
+        if self._data is None:
+            self._data = self.path.read_bytes()
+        return self._data
+
+    @property
+    def md5(self) -> str:
+        """MD5 of the file contents (or the one taken from the filename)."""
+        if self._md5 is None:
+            self._md5 = hashlib.md5(self.data).hexdigest() if self.buffered \
+                else compute_md5(self.path)
+        return self._md5
+
+    @property
+    def pixel_hash(self) -> str:
+        """Danbooru pixel hash (falls back to the md5 for videos)."""
+        if self.is_video:
+            return self.md5
+        if self._pixel_hash is None:
+            if self.buffered:
+                source = pyvips.Image.new_from_buffer(self.data, "")
+            else:
+                source = pyvips.Image.new_from_file(str(self.path), access="sequential")
+            image = normalize_danbooru_pixels(source)
+            self._size = (image.width, image.height)
+            # The decoded pixels are dropped as soon as they are hashed
+            self._pixel_hash = danbooru_pixel_hash(image)
+        return self._pixel_hash
+
+    @property
+    def dimensions(self) -> tuple:
+        """(width, height) read from the header, or (None, None) if unknown."""
+        if self._size is None:
+            if self.is_video and self.probe:
+                self._size = (self.probe["width"], self.probe["height"])
+            elif self.is_video:
+                self._size = get_video_resolution(self.path)
+            elif self._data is not None:
+                # Header-only parse; pixels are not decoded here
+                header = pyvips.Image.new_from_buffer(self._data, "", access="sequential")
+                self._size = (header.width, header.height)
+            else:
+                header = pyvips.Image.new_from_file(str(self.path), access="sequential")
+                self._size = (header.width, header.height)
+        return self._size
+
+    def release(self):
+        """
+        Drops the file buffer; derived values stay cached. Image dimensions are
+        read from the buffer first so the file is not opened again for them.
+        """
+        if self._data is not None and self._size is None:
+            _ = self.dimensions
+        self._data = None
+
 @contextmanager
 def get_cache_conn(cache):
     '''Use a connection cache'''
@@ -246,6 +155,59 @@ def get_cache_conn(cache):
         thread_local.conn = conn
     yield conn
 
+_PG_POOLS = {}
+_PG_POOLS_LOCK = threading.Lock()
+
+@contextmanager
+def get_pg_conn(db_conn):
+    """
+    Borrows the pooled psycopg2 connection for a Shimmie DB config.
+
+    One connection per config is opened on first use and reused by every later
+    query. The block runs in one transaction, committed on exit and rolled back
+    if it raises.
+
+    Args:
+        db_conn (dict): host, dbname, user and password, as from
+            get_shimmie_db_credentials().
+    """
+    key = tuple(sorted(db_conn.items()))
+    with _PG_POOLS_LOCK:
+        pool = _PG_POOLS.get(key)
+        if pool is None:
+            pool = pg_pool.ThreadedConnectionPool(
+                1, 1, host=db_conn['host'], dbname=db_conn['dbname'],
+                user=db_conn['user'], password=db_conn.get('password') or None)
+            _PG_POOLS[key] = pool
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+def close_pg_pools():
+    """Closes every pooled PostgreSQL connection."""
+    with _PG_POOLS_LOCK:
+        for pool in _PG_POOLS.values():
+            pool.closeall()
+        _PG_POOLS.clear()
+
+def copy_keys(conn, table, values):
+    """
+    Fills a transaction-scoped temp table `table` (key TEXT PRIMARY KEY) with
+    the distinct `values` through COPY, ready to be joined server-side.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TEMP TABLE {table} (key TEXT PRIMARY KEY) ON COMMIT DROP")
+        escaped = (v.replace("\\", "\\\\").replace("\t", "\\t")
+                   .replace("\n", "\\n").replace("\r", "\\r") for v in dict.fromkeys(values))
+        cur.copy_expert(f"COPY {table} (key) FROM STDIN", io.StringIO("\n".join(escaped) + "\n"))
+        cur.execute(f"ANALYZE {table}")
+
 def _check_shimmie_for_md5(md5, shimmie_path, dbuser):
     """Helper to check if MD5 exists in Shimmie via PHP subprocess."""
     try:
@@ -266,8 +228,8 @@ def resolve_post(image: Path, shimmie_path, skip_existing, dbuser, cache) -> tup
         post = None
 
         match = re.compile(r"[a-fA-F0-9]{32}").search(image.stem)
-        md5 = match.group(0).lower() if match else compute_md5(image)
-        is_video = image.suffix.lower() in VIDEO_EXTS
+        media = MediaContext(image, match.group(0).lower() if match else None)
+        md5 = media.md5
         px_hash = None
 
         if md5:
@@ -280,7 +242,7 @@ def resolve_post(image: Path, shimmie_path, skip_existing, dbuser, cache) -> tup
                 px_hash = px_res[0] if px_res else None
 
         if not px_hash:
-            px_hash = md5 if is_video else compute_danbooru_pixel_hash(image)
+            px_hash = md5 if media.is_video else media.pixel_hash
 
         if not post:
             cur.execute("SELECT * FROM posts WHERE pixel_hash = ?", (px_hash,))
@@ -296,7 +258,8 @@ def resolve_post(image: Path, shimmie_path, skip_existing, dbuser, cache) -> tup
         if skip_existing and shimmie_path:
             exists = _check_shimmie_for_md5(md5, shimmie_path, dbuser)
 
-        return image, post, md5, px_hash, exists
+        media.release()
+        return image, post, md5, px_hash, exists, media
 
 def add_post_to_cache(md5, px_hash, cache):
     """For adding new images to cache"""
@@ -399,15 +362,20 @@ def row_to_post_dict(row: tuple) -> dict:
 def compute_danbooru_pixel_hash(image_path: Path) -> str:
     """because the original database contained pixel hash I kept this"""
     image = pyvips.Image.new_from_file(str(image_path), access="sequential")
+    return danbooru_pixel_hash(normalize_danbooru_pixels(image))
 
-    # Match Danbooru's ICC transform and color space normalization
+def normalize_danbooru_pixels(image):
+    """Match Danbooru's ICC transform and color space normalization."""
     if image.get_typeof("icc-profile-data") != 0:
         image = image.icc_transform("srgb")
     if image.interpretation != "srgb":
         image = image.colourspace("srgb")
     if not image.hasalpha():
         image = image.addalpha()
+    return image
 
+def danbooru_pixel_hash(image) -> str:
+    """Hashes an already normalized pyvips image the way Danbooru does."""
     # Write raw P7 header
     header = (
         b"P7\n"
@@ -430,19 +398,35 @@ def process_webp(task):
     '''for some reason this was necessary'''
     src_path, dst_path = task
 
+    try:
+        make_thumbnail(src_path, dst_path)
+    except Exception as e: # pylint: disable=broad-exception-caught
+        print(f"Error creating thumbnail of {src_path}! ({type(e).__name__}: {e})")
+
+def make_thumbnail(src_path: Path, dst_path: Path):
+    """Creates one WebP thumbnail, raising the last error if every engine fails."""
     if Path(src_path).suffix.lower() in VIDEO_EXTS:
+        extract_video_thumbnail(src_path, dst_path)
+        return
+
+    error = None
+    # In-process libvips first, then ImageMagick, then Pillow as the last resort
+    for engine in THUMBNAIL_ENGINES.values():
         try:
-            extract_video_thumbnail(src_path, dst_path)
-        except subprocess.CalledProcessError as e:
-            print(f"Error creating video thumbnail for {src_path}! ({e})")
-    else:
-        try:
-            convert_to_webp(src_path, dst_path)
-        except subprocess.CalledProcessError:
-            try:
-                fallback_to_webp(src_path, dst_path)
-            except Exception as e: # pylint: disable=broad-exception-caught
-                print(f"Error creating thumbnail of {src_path}! ({type(e).__name__}: {e})")
+            engine(src_path, dst_path)
+            return
+        except Exception as e: # pylint: disable=broad-exception-caught
+            error = e
+    raise error
+
+def vips_to_webp(src_path: Path, dst_path: Path):
+    """Thumbnail in-process with libvips, using shrink-on-load where the format allows it."""
+    dst_path = Path(dst_path)
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    fbres = 512
+
+    thumb = pyvips.Image.thumbnail(str(src_path), fbres, height=fbres, size="down")
+    thumb.webpsave(str(dst_path), Q=92)
 
 def convert_to_webp(src_path: Path, dst_path: Path):
     """Convert images using ImageMagick."""
@@ -482,31 +466,39 @@ def fallback_to_webp(src_path: Path, dst_path: Path):
     # Save to WebP
     im.save(dst_path, ftype, quality=92, method=6)
 
+THUMBNAIL_ENGINES = {
+    "vips": vips_to_webp,
+    "magick": convert_to_webp,
+    "pillow": fallback_to_webp
+}
+
+MASTER_MERGE_LIST = {
+    "character:samurai_(7th_dragon_series)": "character:samurai_(7th_dragon)",
+    "deep-blue_series": "series:deep-blue",
+    "samurai_(7th_dragon)": "character:samurai_(7th_dragon)",
+    "series:fate_(series)": "series:fate",
+    "series:pokemon_(anime)": "series:pokemon",
+    "series:pokemon_(classic_anime)": "series:pokemon",
+    "series:pokemon_(game)": "series:pokemon",
+    "series:pokemon_bw_(anime)": "series:pokemon_bw",
+    "series:pokemon_dppt_(anime)": "series:pokemon_dppt",
+    "series:pokemon_emerald": "series:pokemon_rse",
+    "series:pokemon_rse_(anime)": "series:pokemon_rse",
+    "series:pokemon_sm_(anime)": "series:pokemon_sm",
+    "series:pokemon_xy_(anime)": "series:pokemon_xy",
+    "series:x-men:_the_animated_series": "series:x-men",
+    "x-men:_the_animated_series": "series:x-men",
+    "x-men_film_series": "series:x-men"
+    # You can keep adding your custom merges here
+    # just make sure the last one has no comma
+}
+
 def apply_tag_curation(tags, dynamic_mappings=None):
     """
     In‑place fixing of tags that need messing.
     """
     prefixes = ('artist:', 'character:', 'series:', 'source:')
-    master_merge_list = {
-        "character:samurai_(7th_dragon_series)": "character:samurai_(7th_dragon)",
-        "deep-blue_series": "series:deep-blue",
-        "samurai_(7th_dragon)": "character:samurai_(7th_dragon)",
-        "series:fate_(series)": "series:fate",
-        "series:pokemon_(anime)": "series:pokemon",
-        "series:pokemon_(classic_anime)": "series:pokemon",
-        "series:pokemon_(game)": "series:pokemon",
-        "series:pokemon_bw_(anime)": "series:pokemon_bw",
-        "series:pokemon_dppt_(anime)": "series:pokemon_dppt",
-        "series:pokemon_emerald": "series:pokemon_rse",
-        "series:pokemon_rse_(anime)": "series:pokemon_rse",
-        "series:pokemon_sm_(anime)": "series:pokemon_sm",
-        "series:pokemon_xy_(anime)": "series:pokemon_xy",
-        "series:x-men:_the_animated_series": "series:x-men",
-        "x-men:_the_animated_series": "series:x-men",
-        "x-men_film_series": "series:x-men"
-        # You can keep adding your custom merges here
-        # just make sure the last one has no comma
-    }
+    master_merge_list = dict(MASTER_MERGE_LIST)
 
     # Merge the mined data!
     if dynamic_mappings:
@@ -544,22 +536,117 @@ def apply_tag_curation(tags, dynamic_mappings=None):
 
     tags[:] = [t for t in step4_tags if t not in ("tagme", "_DROP_")]
 
+def probe_video(file_path: Path) -> dict:
+    """Reads width, height, duration and codec of the first video stream using ffprobe."""
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,codec_name:format=duration",
+        "-of", "json", str(file_path)
+    ]
+    info = json.loads(subprocess.check_output(cmd, text=True))
+    stream = (info.get("streams") or [{}])[0]
+    duration = info.get("format", {}).get("duration")
+    return {
+        "width": stream.get("width"),
+        "height": stream.get("height"),
+        "duration": float(duration) if duration not in (None, "N/A") else None,
+        "codec": stream.get("codec_name")
+    }
+
 def get_video_resolution(file_path: Path):
     """Extracts resolution from a video/gif using ffprobe."""
     try:
-        cmd = [
-            "ffprobe", "-v", "error", "-select_streams", "v:0",
-            "-show_entries", "stream=width,height", "-of", "csv=s=x:p=0",
-            str(file_path)
-        ]
-        output = subprocess.check_output(cmd, text=True).strip()
-        if output and 'x' in output:
-            parts = output.split('\n', maxsplit=1)[0].split('x')
-            return int(parts[0]), int(parts[1])
+        info = probe_video(file_path)
+        if info["width"] and info["height"]:
+            return int(info["width"]), int(info["height"])
     except Exception as e: #pylint: disable=broad-exception-caught
         print(f"Error getting resolution for {file_path}: {e}")
     return None, None
 
+FAILED_PROBE = {"width": None, "height": None, "duration": None, "codec": None}
+
+class ProbeCache:
+    """
+    Persistent ffprobe results keyed by md5, so each video is only probed once.
+    Files ffprobe cannot read are stored as FAILED_PROBE (NULL columns).
+    """
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS media_probe (
+                md5 TEXT PRIMARY KEY,
+                width INTEGER,
+                height INTEGER,
+                duration REAL,
+                codec TEXT
+            )
+        """)
+        self.conn.commit()
+
+    def get_many(self, md5s):
+        """Returns {md5: probe dict} for every cached md5."""
+        found = {}
+        md5s = list(md5s)
+        for i in range(0, len(md5s), 999):
+            chunk = md5s[i:i+999]
+            placeholders = ','.join(['?'] * len(chunk))
+            for row in self.conn.execute(
+                "SELECT md5, width, height, duration, codec "
+                f"FROM media_probe WHERE md5 IN ({placeholders})", chunk
+            ):
+                found[row[0]] = {
+                    "width": row[1], "height": row[2], "duration": row[3], "codec": row[4]
+                }
+        return found
+
+    def probe(self, media_list, max_workers):
+        """
+        Attaches probe data to each video MediaContext in `media_list`.
+
+        Cached entries are used as is; the rest are probed concurrently with at most
+        `max_workers` ffprobe processes and written back to the cache.
+        """
+        videos = defaultdict(list)
+        for media in media_list:
+            if media is not None and media.is_video:
+                videos[media.md5].append(media)
+        if not videos:
+            return
+        cached = self.get_many(videos)
+        missing = [md5 for md5 in videos if md5 not in cached]
+
+        def _safe_probe(md5):
+            try:
+                info = probe_video(videos[md5][0].path)
+            except OSError as e:
+                # ffprobe missing or the file unreadable: try again next run
+                print(f"Error probing {videos[md5][0].path}: {e}")
+                return md5, None
+            except Exception as e: #pylint: disable=broad-exception-caught
+                print(f"Error probing {videos[md5][0].path}: {e}")
+                return md5, FAILED_PROBE
+            return md5, info if info["width"] and info["height"] else FAILED_PROBE
+
+        if missing:
+            with futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                fresh = {md5: info for md5, info in executor.map(_safe_probe, missing) if info}
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO media_probe (md5, width, height, duration, codec) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(md5, i["width"], i["height"], i["duration"], i["codec"])
+                 for md5, i in fresh.items()]
+            )
+            self.conn.commit()
+            cached.update(fresh)
+
+        for md5, group in videos.items():
+            for media in group:
+                media.probe = cached.get(md5, {})
+
+    def close(self):
+        """Closes the underlying connection."""
+        self.conn.close()
+
 def extract_video_thumbnail(src_path: Path, dst_path: Path):
     """Extracts the first frame of a video and saves it directly as a WebP thumbnail via ffmpeg."""
     src_path = Path(src_path)
@@ -577,306 +664,6 @@ def extract_video_thumbnail(src_path: Path, dst_path: Path):
     subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     temp_webp_path.replace(dst_path)
 
-def _extract_hashes(image_list):
-    """Helper to extract MD5s rapidly."""
-    md5_regex = re.compile(r"[a-fA-F0-9]{32}")
-    img_to_md5 = {}
-    md5_set = set()
-
-    for img_path in tqdm.tqdm(image_list, desc="1/3: Extracting Hashes", unit="img"):
-        match = md5_regex.search(img_path.stem)
-        md5 = match.group(0).lower() if match else compute_md5(img_path)
-        img_to_md5[img_path] = md5
-        md5_set.add(md5)
-
-    return img_to_md5, md5_set
-
-class TagCategoryGuard:
-    """Helper to enforce category rules during tag mining."""
-    def __init__(self, mappings):
-        self.artists = set(mappings.artist.keys()) if mappings else set()
-        self.chars = set(mappings.char.keys()) if mappings else set()
-        self.series = set()
-        if mappings:
-            for val in mappings.char.values():
-                if isinstance(val, (list, tuple, set)):
-                    self.series.update(val)
-                else:
-                    self.series.add(val)
-        self.strict = {'character', 'artist', 'series'}
-
-    def get_category(self, tag):
-        """Determines the category of a given tag."""
-        if tag in self.chars:
-            return 'character'
-        if tag in self.artists:
-            return 'artist'
-        if tag in self.series:
-            return 'series'
-        return 'general'
-
-    def shares_lexical_root(self, tag1, tag2):
-        """Checks if two tags share a significant root word (useful for low confidence)."""
-        w1 = {w for w in re.findall(r'[a-z0-9]+', re.sub(r'\([^)]+\)', '', tag1)) if len(w) > 2}
-        w2 = {w for w in re.findall(r'[a-z0-9]+', re.sub(r'\([^)]+\)', '', tag2)) if len(w) > 2}
-        return bool(w1 & w2)
-
-    def check(self, s_tag, c_tag, s_count):
-        """Returns True if the mapping is permitted."""
-        cat_s = self.get_category(s_tag)
-        cat_c = self.get_category(c_tag)
-
-        # Block strict mismatch (e.g., character -> artist)
-        if cat_s in self.strict and cat_c in self.strict and cat_s != cat_c:
-            return False
-
-        # Block strict -> general (Do not downgrade known artists/characters)
-        if cat_s in self.strict and cat_c == 'general':
-            return False
-
-        if cat_s == 'character' and cat_c == 'character' and s_count < 50:
-            b1 = re.sub(r'_\([^)]+\)$', '', s_tag)
-            b2 = re.sub(r'_\([^)]+\)$', '', c_tag)
-            if b1 != b2 and b1 not in b2 and b2 not in b1:
-                return False
-
-        return True
-
-    def can_drop(self, s_tag, c_tag):
-        """Returns True if it's safe to drop a tag for redundancy."""
-        cat_s = self.get_category(s_tag)
-        cat_c = self.get_category(c_tag)
-
-        if cat_s in self.strict and cat_c in self.strict and cat_s != cat_c:
-            return False
-
-        if cat_s in self.strict and cat_c == 'general':
-            return False
-
-        return True
-
-def _calculate_co_occurrences(image_list, img_to_md5, bulk_tags):
-    """Helper to compute co-occurrences of sidecar vs canonical tags."""
-    sidecar_counts = Counter()
-    canonical_counts = Counter()
-    co_occurrences = defaultdict(Counter)
-    sidecar_overlap = defaultdict(Counter)
-    valid_pairs = 0
-
-    for img_path in tqdm.tqdm(image_list, desc="3/3: Mapping Co-occurrences", unit="img"):
-        md5 = img_to_md5[img_path]
-        canonical = bulk_tags.get(md5)
-
-        if not canonical:
-            continue
-
-        valid_pairs += 1
-        sidecars = set(get_sidecar_tags(img_path))
-
-        for s_tag in sidecars:
-            sidecar_counts[s_tag] += 1
-            for c_tag in canonical:
-                co_occurrences[s_tag][c_tag] += 1
-                # Track if the canonical target is ALREADY in the sidecar organically
-                if c_tag in sidecars:
-                    sidecar_overlap[s_tag][c_tag] += 1
-
-        for c_tag in canonical:
-            canonical_counts[c_tag] += 1
-
-    return valid_pairs, sidecar_counts, canonical_counts, co_occurrences, sidecar_overlap
-
-def build_tag_frequencies(image_list, db_conn, sqlite_conn):
-    """Scans image list, compares sidecar tags to DB canonical tags using bulk queries."""
-    img_to_md5, md5_set = _extract_hashes(image_list)
-
-    print(f"\n[INFO] Fetching database tags for {len(md5_set)} unique files...")
-    bulk_tags = get_bulk_canonical_tags(md5_set, db_conn, sqlite_conn)
-
-    return _calculate_co_occurrences(image_list, img_to_md5, bulk_tags)
-
-def _fetch_global_context(tags_set, db_conn, chunk_size=1000):
-    """Fetches total database counts, wiki existence, and deprecation status."""
-    g_counts, deprecated, has_wiki = {}, set(), set()
-    if not db_conn:
-        return g_counts, deprecated, has_wiki
-
-    env = os.environ.copy()
-    if db_conn.get('password'):
-        env['PGPASSWORD'] = db_conn['password']
-
-    tags_set = list(tags_set)
-    print("\n[INFO] Fetching global DB stats and wiki context...")
-
-    # 1. Strip out comma-prefixed conversational phrases dynamically
-    # 2. Check the remaining text against your strict deprecation patterns
-    dep_sql = (
-        r"REGEXP_REPLACE(body, ',\s*(do not use|ambiguous)', 'SAFE', 'ig') ~* '("
-        r"deprecated tag\.|"
-        r"ambiguous tag\. do not use\.|"
-        r"ambiguous\. do not use\.|"
-        r"do not use\. use|"
-        r"do not use this tag\. instead|"
-        r"do not use this tag\. use|"
-        r"\. do not use this tag\.</p>|"
-        r"; do not use this tag\.</p>|"
-        r"<p>do not use this tag\.</p>|"
-        r"\ndo not use this tag\.</p>|"
-        r"^do not use this tag\.</p>"
-        r")'"
-    )
-
-    for i in tqdm.tqdm(range(0, len(tags_set), chunk_size), leave=False):
-        escaped = [t.replace("'", "''") for t in tags_set[i:i+chunk_size]]
-        if not escaped:
-            continue
-
-        # 1. Fetch True Global Counts
-        try:
-            res = subprocess.run(
-                [
-                    "psql", "-d", db_conn['dbname'], "-U", db_conn['user'],
-                    "-h", db_conn['host'], "-t", "-A", "-c",
-                    "SELECT tag, count FROM tags WHERE tag IN ('"
-                    + "', '".join(escaped) + "');"
-                ],
-                env=env, capture_output=True, text=True, check=True
-            )
-            for line in res.stdout.strip().split('\n'):
-                if '|' in line:
-                    parts = line.rsplit('|', 1)
-                    g_counts[parts[0]] = int(parts[1])
-        except Exception as e: # pylint: disable=broad-exception-caught
-            print(f"\n[WARNING] Global counts query failed: {e}")
-
-        # 2. Fetch Wiki Existence & Deprecation Status
-        try:
-            res = subprocess.run(
-                [
-                    "psql", "-d", db_conn['dbname'], "-U", db_conn['user'],
-                    "-h", db_conn['host'], "-t", "-A", "-c",
-                    "SELECT REPLACE(LOWER(title), ' ', '_'), "
-                    f"CASE WHEN {dep_sql} THEN 1 ELSE 0 END "
-                    "FROM wiki_pages "
-                    "WHERE REPLACE(LOWER(title), ' ', '_') IN ('"
-                    + "', '".join(escaped) + "');"
-                ],
-                env=env, capture_output=True, text=True, check=True
-            )
-            for line in res.stdout.strip().split('\n'):
-                if '|' in line:
-                    parts = line.rsplit('|', 1)
-                    has_wiki.add(parts[0])
-                    if parts[1] == '1':
-                        deprecated.add(parts[0])
-        except Exception as e: # pylint: disable=broad-exception-caught
-            print(f"\n[WARNING] Wiki check query failed: {e}")
-
-    return g_counts, deprecated, has_wiki
-
-def mine_tag_equivalencies(image_list, conns, output_path, mappings, thresholds=(10, 0.5)):
-    """Scans images to discover 1:1 tag mappings using Jaccard similarity."""
-    print(f"\n[⛏️ MINING MODE] Analyzing {len(image_list)} images for 1:1 equivalencies...")
-
-    db_conn, sqlite_conn = conns
-    freqs = build_tag_frequencies(image_list, db_conn, sqlite_conn)
-
-    missing = len(image_list) - freqs[0]
-    if len(image_list) > 0 and (missing / len(image_list)) >= 0.5:
-        print(f"\n[⚠️ ALERT] High Missing Rate: {missing}/{len(image_list)} images "
-              f"({(missing/len(image_list))*100:.1f}%) were not found in the DB!")
-    else:
-        print(f"Successfully aligned {freqs[0]} images with database records.")
-
-    # Fetch global context before doing the math
-    global_ctx = _fetch_global_context(freqs[1].keys(), db_conn)
-
-    guard = TagCategoryGuard(mappings)
-    calculated = calculate_equivalencies(freqs, global_ctx, guard, thresholds)
-    calculated.sort(key=lambda x: x["Sample_Size"], reverse=True)
-
-    with open(output_path, "w", encoding="utf-8", newline="") as f:
-        writer = csv.DictWriter(
-            f, fieldnames=["Sidecar_Tag", "Canonical_Tag", "Confidence", "Sample_Size"]
-        )
-        writer.writeheader()
-        writer.writerows(calculated)
-
-    print(f"[✓] Mined {len(calculated)} highly confident equivalencies! Saved to {output_path}")
-
-def calculate_equivalencies(freqs, global_ctx, guard, thresholds):
-    """Calculates Jaccard similarity scores to map tags safely under local limits."""
-    results = []
-
-    for s_tag, s_count in freqs[1].items():
-        if s_count < thresholds[0]:
-            continue
-
-        # GUARD 0: Wiki Deprecation Forced Drop
-        if s_tag in global_ctx[1]:
-            results.append({
-                "Sidecar_Tag": s_tag,
-                "Canonical_Tag": "_DROP_",
-                "Confidence": 1.0,
-                "Sample_Size": s_count
-            })
-            continue
-
-        best_match, hi_score = None, 0
-        for c_tag, shared in freqs[3][s_tag].items():
-            union = s_count + freqs[2][c_tag] - shared
-            if union > 0 and (shared / union) > hi_score:
-                hi_score = shared / union
-                best_match = c_tag
-
-        if hi_score >= thresholds[1] and best_match != s_tag:
-
-            # GUARD 1: Modifier exclusion
-            if re.sub(r'_\([^)]+\)', '', s_tag) == re.sub(r'_\([^)]+\)', '', best_match):
-                continue
-
-            # GUARD 1.2: Parenthetical Context Protection
-            # Prevents OC/Character tags from merging into their Artist/Series tags
-            if f"({best_match})" in s_tag:
-                continue
-
-            # GUARD 1.5: Lexical Overlap Check for Low Confidence Mappings
-            # (Requires a shared word like "daughter" if confidence is under 75%)
-            if hi_score < 0.75 and not guard.shares_lexical_root(s_tag, best_match):
-                continue
-
-            # Pre-calculate native DB robustness to save local variables
-            db_cnt = global_ctx[0].get(s_tag, freqs[2].get(s_tag, 0))
-
-            # GUARD 2: Subset / Redundancy Check
-            if (freqs[4][s_tag][best_match] / s_count) >= thresholds[1]:
-                if not guard.can_drop(s_tag, best_match):
-                    continue
-                if db_cnt > (s_count * 0.5) or db_cnt > 500:
-                    continue
-                if s_tag in global_ctx[2]:
-                    continue
-                best_match = "_DROP_"
-
-            # GUARD 3: General Category Mismatch & Strict Downgrades
-            elif not guard.check(s_tag, best_match, s_count):
-                continue
-
-            # GUARD 4: Established Tag Protection
-            # (Do not rename heavily used tags to other tags unless they are near-identical)
-            if best_match != "_DROP_" and (db_cnt > 500 or db_cnt > (s_count * 0.5)):
-                if hi_score < 0.95:
-                    continue
-
-            results.append({
-                "Sidecar_Tag": s_tag,
-                "Canonical_Tag": best_match,
-                "Confidence": round(hi_score, 4),
-                "Sample_Size": s_count
-            })
-
-    return results
-
 def load_dynamic_mappings(csv_path):
     """Reads the mined tag map CSV and returns a dictionary of mappings."""
     dynamic_map = {}
@@ -951,42 +738,27 @@ def _fetch_sqlite_tags(md5_list, sqlite_conn, results):
 
 def _fetch_postgres_tags(md5_list, db_conn, chunk_size, results):
     """Helper to fetch tags from PostgreSQL to reduce local variables."""
-    if not db_conn:
-        return
-    env = os.environ.copy()
-    if db_conn.get('password'):
-        env['PGPASSWORD'] = db_conn['password']
-
     missing = [m for m in md5_list if m not in results]
+    if not db_conn or not missing:
+        return
 
-    for i in tqdm.tqdm(range(0, len(missing), chunk_size), desc="Querying Postgres", leave=False):
-        chunk = missing[i:i+chunk_size]
-        if not chunk:
-            continue
-
-        query = (
-            "SELECT i.hash, t.tag FROM tags t "
-            "JOIN image_tags it ON t.id = it.tag_id "
-            "JOIN images i ON i.id = it.image_id "
-            "WHERE i.hash IN ('" + "', '".join(chunk) + "');"
-        )
-
-        try:
-            res = subprocess.run(
-                [
-                    "psql", "-d", db_conn['dbname'], "-U", db_conn['user'],
-                    "-h", db_conn['host'], "-t", "-A", "-c", query
-                ],
-                env=env, capture_output=True, text=True, check=True
-            )
-            for line in res.stdout.strip().split('\n'):
-                if '|' in line:
-                    hsh, tag = line.split('|', 1)
+    try:
+        with get_pg_conn(db_conn) as conn:
+            copy_keys(conn, "mining_md5s", missing)
+            with conn.cursor(name="mining_image_tags") as cur:
+                cur.itersize = chunk_size
+                cur.execute(
+                    "SELECT i.hash, t.tag FROM mining_md5s m "
+                    "JOIN images i ON i.hash = m.key "
+                    "JOIN image_tags it ON it.image_id = i.id "
+                    "JOIN tags t ON t.id = it.tag_id"
+                )
+                for hsh, tag in tqdm.tqdm(cur, desc="Querying Postgres", unit="tag", leave=False):
                     results[hsh].add(tag.strip())
-        except Exception as e: # pylint: disable=broad-exception-caught
-            print(f"\n[WARNING] Bulk DB query failed for a chunk: {e}")
+    except Exception as e: # pylint: disable=broad-exception-caught
+        print(f"\n[WARNING] Bulk DB query failed: {e}")
 
-def get_bulk_canonical_tags(md5_set, db_conn, sqlite_conn, chunk_size=1000):
+def get_bulk_canonical_tags(md5_set, db_conn, sqlite_conn, chunk_size=10000):
     """Fetches canonical tags for a large set of MD5s in bulk to avoid N+1 queries."""
     results = defaultdict(set)
     md5_list = list(md5_set)
@@ -996,23 +768,103 @@ def get_bulk_canonical_tags(md5_set, db_conn, sqlite_conn, chunk_size=1000):
 
     return results
 
-def get_sidecar_tags(image_path):
-    """Scans for .txt files associated with the image and parses tags."""
-    extra_tags = []
+SIDECAR_SPLIT = re.compile(r"[,;]")
+WHITESPACE = re.compile(r"\s+")
+
+def parse_sidecar(txt_path):
+    """Parses one sidecar .txt file into normalised tags."""
+    tags = []
+    with txt_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = html.unescape(line.strip())
+            if not line or line.startswith("#"):
+                continue
+            parts = [t.strip() for t in SIDECAR_SPLIT.split(line) if t.strip()]
+            tags.extend(WHITESPACE.sub("_", t) for t in parts if t)
+    return tags
+
+def _sidecar_files(image_path):
+    """(path, stat result) of each .txt file associated with the image."""
     txt_candidates = [
         image_path.with_suffix(".txt"),
         image_path.with_name(image_path.name + ".txt")
     ]
-
     for txt_path in txt_candidates:
-        if not txt_path.is_file():
+        try:
+            st = txt_path.stat()
+        except OSError:
             continue
+        if stat.S_ISREG(st.st_mode):
+            yield txt_path, st
 
-        with txt_path.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = html.unescape(line.strip())
-                if not line or line.startswith("#"):
-                    continue
-                parts = [t.strip() for t in re.split(r"[,;]", line) if t.strip()]
-                extra_tags.extend(re.sub(r"\s+", "_", t) for t in parts if t)
+def sidecar_stamp(image_path):
+    """Size and mtime of the image's sidecar files; changes whenever one is edited."""
+    return ";".join(f"{st.st_size}:{st.st_mtime_ns}" for _, st in _sidecar_files(image_path))
+
+def get_sidecar_tags(image_path, sidecar_cache=None):
+    """Scans for .txt files associated with the image and parses tags."""
+    extra_tags = []
+    for txt_path, st in _sidecar_files(image_path):
+        tags = sidecar_cache.get(txt_path, st) if sidecar_cache else None
+        if tags is None:
+            tags = parse_sidecar(txt_path)
+            if sidecar_cache:
+                sidecar_cache.put(txt_path, st, tags)
+        extra_tags.extend(tags)
     return extra_tags
+
+class SidecarCache:
+    """
+    Parsed sidecar tags stored in SQLite, keyed by the sidecar's path and
+    validated against its size and mtime, so unchanged files are never re-parsed.
+    """
+    def __init__(self, db_path, flush_every=1000):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.flush_every = flush_every
+        self.pending = []
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS sidecar_cache (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                tags TEXT
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, txt_path, st):
+        """Returns the cached tags if the file is unchanged, else None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, tags FROM sidecar_cache WHERE path = ?",
+                (str(Path(txt_path).absolute()),)
+            ).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return None
+        # Tags never contain newlines (whitespace is normalised to underscores)
+        return row[2].split("\n") if row[2] else []
+
+    def put(self, txt_path, st, tags):
+        """Queues a parse result; written in batches of flush_every."""
+        with self.lock:
+            self.pending.append((str(Path(txt_path).absolute()), st.st_size,
+                                 st.st_mtime_ns, "\n".join(tags)))
+            if len(self.pending) >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO sidecar_cache (path, size, mtime_ns, tags) "
+            "VALUES (?, ?, ?, ?)", self.pending
+        )
+        self.conn.commit()
+        self.pending = []
+
+    def close(self):
+        """Writes any queued entries and closes the connection."""
+        with self.lock:
+            if self.pending:
+                self._flush()
+            self.conn.close()
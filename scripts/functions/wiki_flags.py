@@ -0,0 +1,89 @@
+"""
+Wiki page deprecation flags for shimmie2-tools
+"""
+
+import re
+
+from functions.core import lazy_import
+
+pg_extras = lazy_import("psycopg2.extras")
+
+FLAGS_TABLE = "wiki_tag_flags"
+
+# Comma-prefixed conversational phrases ("..., do not use it for ...") are
+# neutralised first, then the rest is checked against the strict patterns.
+# Both are also valid PostgreSQL regexes, for servers without flags yet.
+SAFE_PATTERN = r",\s*(do not use|ambiguous)"
+DEPRECATION_PATTERN = (
+    r"deprecated tag\.|"
+    r"ambiguous tag\. do not use\.|"
+    r"ambiguous\. do not use\.|"
+    r"do not use\. use|"
+    r"do not use this tag\. instead|"
+    r"do not use this tag\. use|"
+    r"\. do not use this tag\.</p>|"
+    r"; do not use this tag\.</p>|"
+    r"<p>do not use this tag\.</p>|"
+    r"\ndo not use this tag\.</p>|"
+    r"^do not use this tag\.</p>"
+)
+SAFE_RE = re.compile(SAFE_PATTERN, re.IGNORECASE)
+DEPRECATION_RE = re.compile(DEPRECATION_PATTERN, re.IGNORECASE)
+# A suggested replacement is the first wiki link shortly after the notice
+WIKI_LINK_RE = re.compile(r"\[\[([^\]|]+)")
+REPLACEMENT_WINDOW = 200
+
+def wiki_tag(title):
+    """The tag a wiki title describes ("Foo Bar" -> "foo_bar"), as mining matches it."""
+    return title.lower().replace(" ", "_")
+
+def classify_deprecation(body):
+    """
+    Classifies a wiki page body.
+
+    Returns:
+        tuple: (deprecated, suggested replacement tag or None)
+    """
+    text = SAFE_RE.sub("SAFE", body or "")
+    match = DEPRECATION_RE.search(text)
+    if not match:
+        return False, None
+    link = WIKI_LINK_RE.search(text, match.start(), match.end() + REPLACEMENT_WINDOW)
+    return True, wiki_tag(link.group(1).strip()) if link else None
+
+def refresh_wiki_flags(pg_conn):
+    """
+    Classifies the latest revision of every wiki page whose flags are missing
+    or older than it, into the indexed wiki_tag_flags table.
+
+    Returns:
+        int: Pages classified.
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {FLAGS_TABLE} (
+                tag TEXT PRIMARY KEY,
+                revision INTEGER NOT NULL,
+                deprecated BOOLEAN NOT NULL,
+                replacement TEXT
+            )
+        """)
+
+    classified = 0
+    with pg_conn.cursor(name="wiki_flags_stale") as stale, pg_conn.cursor() as cur:
+        stale.execute(f"""
+            SELECT w.title, w.revision, w.body FROM wiki_pages w
+            JOIN (SELECT title, MAX(revision) AS revision FROM wiki_pages GROUP BY title) latest
+                USING (title, revision)
+            LEFT JOIN {FLAGS_TABLE} f ON f.tag = REPLACE(LOWER(w.title), ' ', '_')
+            WHERE f.tag IS NULL OR f.revision <> w.revision
+        """)
+        while rows := stale.fetchmany(1000):
+            pg_extras.execute_batch(cur, f"""
+                INSERT INTO {FLAGS_TABLE} VALUES (%s, %s, %s, %s)
+                ON CONFLICT (tag) DO UPDATE SET revision = EXCLUDED.revision,
+                    deprecated = EXCLUDED.deprecated, replacement = EXCLUDED.replacement
+            """, [(wiki_tag(title), revision, *classify_deprecation(body))
+                  for title, revision, body in rows])
+            classified += len(rows)
+    return classified
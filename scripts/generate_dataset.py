@@ -0,0 +1,282 @@
+"""Generates a synthetic Danbooru-shaped dataset for scale testing"""
+from bisect import bisect
+from collections import defaultdict
+from itertools import accumulate
+from pathlib import Path
+import argparse
+import hashlib
+import io
+import json
+import random
+import sqlite3
+
+from functions.core import lazy_import
+
+Image = lazy_import("PIL.Image")
+tqdm = lazy_import("tqdm")
+
+SYLLABLES = ("a", "ka", "ki", "ko", "mi", "na", "no", "ri", "ru", "sa", "shi", "ta", "to",
+             "ya", "yu", "ze", "ha", "ne", "mo", "ro", "lu", "fe", "ga", "do", "be")
+IMAGE_EXTS = (".jpg", ".png", ".webp")
+RATING_WEIGHTS = {"g": 45, "s": 25, "q": 18, "e": 12}
+# Weight: share of rated tags, roughly as in the shipped tag_rating_dominant.db
+DOMINANT_RATINGS = {1: 890, 30: 39, 50: 50, 250: 20, 150: 1}
+
+def zipf_sampler(items, exponent, rng):
+    """
+    sample(k): up to k distinct items (duplicates drawn are dropped), each drawn
+    with probability proportional to 1 / rank**exponent.
+    """
+    cum_weights = list(accumulate(1 / (rank ** exponent) for rank in range(1, len(items) + 1)))
+    total = cum_weights[-1]
+
+    def sample(k):
+        picks = (items[bisect(cum_weights, rng.random() * total)] for _ in range(k))
+        return list(dict.fromkeys(picks))
+    return sample
+
+def make_names(rng, count, prefix=""):
+    """`count` unique, pronounceable tag names."""
+    names = {}
+    while len(names) < count:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        name = f"{prefix}{word}_{rng.choice(SYLLABLES)}{rng.randint(0, 99)}"
+        names[name] = None
+    return list(names)
+
+class Vocabulary:
+    """General, character, series and artist names, and the tags posts and sidecars draw."""
+    def __init__(self, args, rng):
+        self.general = make_names(rng, args.tags)
+        series = make_names(rng, args.series)
+        characters = [f"{name}_({rng.choice(series)})"
+                      for name in make_names(rng, args.characters)]
+        self.artists = make_names(rng, args.artists)
+        self.char_series = {c: c[c.rindex("(") + 1:-1] for c in characters}
+        # Tags that sidecars spell differently (same root word), for tag mining to find again
+        renamed = rng.sample(self.general, int(len(self.general) * args.sidecar_renames))
+        self.sidecar_names = {tag: f"{tag.split('_')[0]}_alt{i}" for i, tag in enumerate(renamed)}
+
+        self.samplers = {name: zipf_sampler(items, args.zipf, rng) for name, items in
+                         (("general", self.general), ("character", characters),
+                          ("artist", self.artists))}
+
+    def post_tags(self, per_post, rng):
+        """(general, characters, series, artists) for one post."""
+        general = self.samplers["general"](rng.randint(max(1, per_post // 2), per_post * 3 // 2))
+        characters = self.samplers["character"](rng.choice((0, 1, 1, 1, 2)))
+        series = list(dict.fromkeys(self.char_series[c] for c in characters))
+        artists = self.samplers["artist"](rng.choice((0, 1, 1, 1, 1, 2)))
+        return general, characters, series, artists
+
+    def sidecar_tags(self, post, noise, rng):
+        """
+        Tags for a file's sidecar: its post's general tags as sidecars spell
+        them, with a share (`noise`) dropped and as many unrelated tags mixed
+        in. Files without a post get unrelated tags only.
+        """
+        if not post:
+            return self.samplers["general"](rng.randint(3, 12))
+        general = post["tag_string_general"].split()
+        tags = [self.sidecar_names.get(tag, tag) for tag in general if rng.random() >= noise]
+        return tags + self.samplers["general"](round(len(general) * noise))
+
+def make_post(post_id, media, vocab, args, rng):
+    """One posts.json record shaped like Danbooru's export, for (md5, ext, width, height)."""
+    md5, ext, width, height = media
+    general, characters, series, artists = vocab.post_tags(args.tags_per_post, rng)
+    source = rng.choice((
+        f"https://i.pximg.net/img-original/img/2023/05/{rng.randint(10, 28)}/00/00/00/"
+        f"{post_id + 90000000}_p0.png",
+        f"https://twitter.com/{rng.choice(vocab.artists)}/status/{post_id}",
+        f"https://www.pixiv.net/en/artworks/{post_id + 90000000}",
+        ""))
+    return {
+        "id": post_id,
+        "md5": md5,
+        "file_ext": ext,
+        "image_width": width,
+        "image_height": height,
+        "rating": rng.choices(list(RATING_WEIGHTS), weights=RATING_WEIGHTS.values())[0],
+        "source": source,
+        "tag_string_general": " ".join(general),
+        "tag_string_character": " ".join(characters),
+        "tag_string_copyright": " ".join(series),
+        "tag_string_artist": " ".join(artists),
+        "media_asset": {"md5": md5, "pixel_hash": hashlib.md5(f"px{md5}".encode()).hexdigest()}
+    }
+
+def render_image(rng, max_side, ext):
+    """Encoded bytes of a small noise image (blocky, so files stay compressible)."""
+    width, height = rng.randint(max_side // 4, max_side), rng.randint(max_side // 4, max_side)
+    block = Image.frombytes("RGB", (max(1, width // 16), max(1, height // 16)),
+                            rng.randbytes(max(1, width // 16) * max(1, height // 16) * 3))
+    buf = io.BytesIO()
+    image_format = {".jpg": "JPEG", ".png": "PNG", ".webp": "WEBP"}[ext]
+    block.resize((width, height), Image.Resampling.NEAREST).save(buf, format=image_format)
+    return buf.getvalue(), width, height
+
+def render_animation(rng, max_side):
+    """Encoded bytes of a short animated GIF (treated as video by the importer)."""
+    side = max(16, max_side // 2)
+    frames = [Image.frombytes("RGB", (side // 8, side // 8), rng.randbytes((side // 8) ** 2 * 3))
+              .resize((side, side), Image.Resampling.NEAREST) for _ in range(3)]
+    buf = io.BytesIO()
+    frames[0].save(buf, format="GIF", save_all=True, append_images=frames[1:], duration=100)
+    return buf.getvalue(), side, side
+
+def render_media(args, rng):
+    """A new image or (--video-fraction of the time) video: (bytes, ext, is_video, (w, h))."""
+    is_video = rng.random() < args.video_fraction
+    ext = ".gif" if is_video else rng.choice(IMAGE_EXTS)
+    data, width, height = (render_animation(rng, args.image_size) if is_video
+                           else render_image(rng, args.image_size, ext))
+    return data, ext, is_video, (width, height)
+
+def write_media(out, args, rng):
+    """
+    Writes the image/video trees and picks the files that get a sidecar.
+
+    Returns:
+        tuple: ([(md5, ext, width, height) for every distinct file with a post],
+                {md5: [sidecar paths]} to write once the posts exist, stats)
+    """
+    posted, written = [], []
+    sidecars = defaultdict(list)
+    stats = {"images": 0, "videos": 0, "duplicates": 0, "misses": 0, "sidecars": 0}
+
+    for i in tqdm.tqdm(range(args.images), desc="Media", unit="file"):
+        if written and rng.random() < args.duplicate_rate:
+            # Same bytes under another name and folder, as re-downloads end up
+            path, md5, ext, is_video = rng.choice(written)
+            data = path.read_bytes()
+            stem = f"dup_{i:08d}"
+            stats["duplicates"] += 1
+        else:
+            data, ext, is_video, size = render_media(args, rng)
+            md5 = hashlib.md5(data).hexdigest()
+            stem = md5 if rng.random() < 0.5 else f"file_{i:08d}"
+            if rng.random() < args.miss_rate:
+                stats["misses"] += 1
+            else:
+                posted.append((md5, ext[1:], *size))
+
+        path = out / ("videos" if is_video else "images") / f"set_{i % 16:02d}" / f"{stem}{ext}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        written.append((path, md5, ext, is_video))
+        stats["videos" if is_video else "images"] += 1
+
+        if rng.random() < args.sidecar_rate:
+            sidecars[md5].append(path.with_name(path.name + ".txt"))
+            stats["sidecars"] += 1
+
+    return posted, sidecars, stats
+
+def write_sidecars(sidecars, media_posts, vocab, args, rng):
+    """Writes every sidecar from its file's post; files without a post get unrelated tags."""
+    for md5, paths in sidecars.items():
+        for txt_path in paths:
+            tags = vocab.sidecar_tags(media_posts.get(md5), args.sidecar_noise, rng)
+            txt_path.write_text(", ".join(tags), encoding="utf-8")
+
+def write_posts(path, posted, vocab, args, rng):
+    """
+    Streams posts.json (JSON lines), scattering the media posts among filler posts.
+
+    Returns:
+        tuple: (total posts, {md5: post} of the media posts)
+    """
+    total = max(args.posts, len(posted))
+    media_at = dict(zip(sorted(rng.sample(range(total), len(posted))), posted))
+    media_posts = {}
+
+    with path.open("w", encoding="utf-8") as f:
+        for post_id in tqdm.tqdm(range(1, total + 1), desc="posts.json", unit="post"):
+            media = media_at.get(post_id - 1)
+            if media:
+                post = media_posts[media[0]] = make_post(post_id, media, vocab, args, rng)
+            else:
+                md5 = hashlib.md5(f"filler-{args.seed}-{post_id}".encode()).hexdigest()
+                post = make_post(post_id, (md5, "jpg", 0, 0), vocab, args, rng)
+            f.write(json.dumps(post, separators=(",", ":")))
+            f.write("\n")
+    return total, media_posts
+
+def write_databases(db_dir, vocab, rng):
+    """characters.db, artists.db and tag_rating_dominant.db in the shapes the importer reads."""
+    db_dir.mkdir(parents=True, exist_ok=True)
+    tables = (
+        ("characters.db", "CREATE TABLE data (tag TEXT, series TEXT)",
+         "INSERT INTO data VALUES (?, ?)", vocab.char_series.items()),
+        ("artists.db", "CREATE TABLE data (tag TEXT, artist TEXT)",
+         "INSERT INTO data VALUES (?, ?)", ((a, a) for a in vocab.artists)),
+        ("tag_rating_dominant.db",
+         "CREATE TABLE dominant_tag_ratings (tag_name TEXT PRIMARY KEY, dominant_rating NUMERIC)",
+         "INSERT INTO dominant_tag_ratings VALUES (?, ?)",
+         zip(vocab.general[:len(vocab.general) // 2],
+             rng.choices(list(DOMINANT_RATINGS), weights=DOMINANT_RATINGS.values(),
+                         k=len(vocab.general) // 2))),
+    )
+    for name, create, insert, rows in tables:
+        db_path = db_dir / name
+        db_path.unlink(missing_ok=True)
+        with sqlite3.connect(db_path) as conn:
+            conn.execute(create)
+            conn.executemany(insert, rows)
+
+def main(args):
+    """Generates the dataset described by args."""
+    out = Path(args.out)
+    db_dir = Path(args.db_dir) if args.db_dir else out / "database"
+    out.mkdir(parents=True, exist_ok=True)
+
+    print("=== Synthetic Dataset Summary ===")
+    print(f"📁  Output:          {out}")
+    print(f"🗄️  Databases:       {db_dir}")
+    print(f"📄  Posts:           {args.posts:,}")
+    print(f"🖼️  Media files:     {args.images:,} ({args.video_fraction:.0%} video)")
+    print(f"🎲  Seed:            {args.seed}")
+    print()
+
+    rng = random.Random(args.seed)
+    vocab = Vocabulary(args, rng)
+    write_databases(db_dir, vocab, rng)
+    posted, sidecars, stats = write_media(out, args, rng)
+    stats["posts"], media_posts = write_posts(out / "posts.json", posted, vocab, args, rng)
+    write_sidecars(sidecars, media_posts, vocab, args, rng)
+
+    manifest = {"params": {k: v for k, v in vars(args).items() if k != "func"}, "stats": stats}
+    (out / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    print(f"\n[✓] {stats['posts']:,} posts, {stats['images']:,} images, {stats['videos']:,} "
+          f"videos ({stats['duplicates']:,} duplicates, {stats['misses']:,} without a post).")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates a synthetic dataset for scale testing.")
+    parser.add_argument("--artists", type=int, default=30000, help="Artist names")
+    parser.add_argument("--characters", type=int, default=20000, help="Character names")
+    parser.add_argument("--db-dir", help="Where to write the .db files (default: <out>/database)")
+    parser.add_argument("--duplicate-rate", type=float, default=0.02,
+                        help="Share of media files that are byte-identical copies")
+    parser.add_argument("--image-size", type=int, default=512, help="Max image side in pixels")
+    parser.add_argument("--images", type=int, default=1000, help="Media files to write")
+    parser.add_argument("--miss-rate", type=float, default=0.1,
+                        help="Share of distinct media files with no post in posts.json")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--posts", type=int, default=100000, help="Lines in posts.json")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--series", type=int, default=2000, help="Series names")
+    parser.add_argument("--sidecar-noise", type=float, default=0.1,
+                        help="Share of sidecar tags replaced by an unrelated tag")
+    parser.add_argument("--sidecar-rate", type=float, default=0.5,
+                        help="Share of media files with a .txt sidecar")
+    parser.add_argument("--sidecar-renames", type=float, default=0.02,
+                        help="Share of general tags that sidecars spell differently")
+    parser.add_argument("--tags", type=int, default=50000, help="General tag vocabulary size")
+    parser.add_argument("--tags-per-post", type=int, default=25, help="Mean general tags per post")
+    parser.add_argument("--video-fraction", type=float, default=0.05,
+                        help="Share of media files written as animated GIFs")
+    parser.add_argument("--zipf", type=float, default=1.1,
+                        help="Zipf exponent of the tag, character and artist distributions")
+
+    main(parser.parse_args())
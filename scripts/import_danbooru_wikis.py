@@ -7,6 +7,8 @@ import sqlite3
 from datetime import datetime
 from pathlib import Path
 
+from functions.wiki_flags import refresh_wiki_flags
+
 DANBOORU_URL = "https://danbooru.donmai.us/wiki_pages.json"
 WIKI_LINK_BASE = "/wiki/"
 SQLITE_DB = Path("database/danbooru_wiki_cache.db")
@@ -336,12 +338,16 @@ def main(args):
         if result != "skipped":
             cache_cur.execute("UPDATE wiki_cache SET imported = 1 WHERE title = ?", (title,))
 
+    # Classify new and changed pages once, so tag mining reads flags instead of regex scans
+    flagged = refresh_wiki_flags(pg_conn)
+
     pg_conn.commit()
     cache_conn.commit()
 
     print(f"\n✅ Inserted: {results['inserted']}")
     print(f"🔁 Updated: {results['updated']}")
     print(f"⏭️ Skipped: {results['skipped']}")
+    print(f"🚩 Deprecation flags refreshed: {flagged}")
 
     pg_conn.close()
     cache_conn.close()
@@ -0,0 +1,120 @@
+"""Drains the thumbnail job queue written by booru_csv_maker.py --thumb-queue"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import argparse
+import time
+
+from functions.core import lazy_import
+from functions.thumb_queue import ThumbnailQueue
+from functions.utils import get_cpu_threads, make_thumbnail
+
+# Shared with functions.utils, so the limit is lifted in every worker process too
+Image = lazy_import("PIL.Image", on_load=lambda im: setattr(im, "MAX_IMAGE_PIXELS", None))
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+QUEUE_PATH = SCRIPT_DIR / ".." / "database" / "thumb_queue.db"
+# Longest sleep while another worker's leased jobs are outstanding
+POLL_SECONDS = 5
+
+def run_job(job):
+    """Builds one thumbnail and returns (id, error_or_None) for the queue."""
+    job_id, src, dst = job
+    try:
+        make_thumbnail(Path(src), Path(dst))
+        return job_id, None
+    except Exception as e: # pylint: disable=broad-exception-caught
+        return job_id, f"{type(e).__name__}: {e}"
+
+def run_batch(pool, jobs):
+    """
+    Runs claimed jobs on the pool and returns (results, broken). If a worker
+    process dies (e.g. OOM-killed), the jobs that didn't finish are reported
+    as failed and `broken` is True; the pool can't be used again.
+    """
+    pending = [(job[0], pool.submit(run_job, job)) for job in jobs]
+    results, broken = [], False
+    for job_id, future in pending:
+        try:
+            results.append(future.result())
+        except BrokenProcessPool:
+            results.append((job_id, "BrokenProcessPool: a worker process died"))
+            broken = True
+    return results, broken
+
+def drain(queue, args):
+    """Claims and runs jobs until none are pending or leased; returns (done, failed)."""
+    done = failed = 0
+    pool = ProcessPoolExecutor(max_workers=args.workers)
+    try:
+        while True:
+            jobs = queue.claim(args.workers * args.claim, args.max_attempts)
+            if not jobs:
+                wait = queue.next_expiry()
+                if wait is None:
+                    break
+                # Leased by another worker: take them over if it died, else wait out the lease
+                if not queue.reclaim_orphans():
+                    time.sleep(min(wait, POLL_SECONDS))
+                continue
+            results, broken = run_batch(pool, jobs)
+            queue.finish(results, args.max_attempts)
+            if broken:
+                pool.shutdown(cancel_futures=True)
+                pool = ProcessPoolExecutor(max_workers=args.workers)
+            done += sum(1 for _, error in results if error is None)
+            failed += sum(1 for _, error in results if error is not None)
+            print(f"Processed {done + failed:,} job(s), {failed:,} error(s)", end="\r")
+    finally:
+        pool.shutdown()
+    return done, failed
+
+def print_status(queue):
+    """Prints queue counts and the latest failures."""
+    counts = queue.counts()
+    print(" | ".join(f"{state}: {count:,}" for state, count in counts.items()))
+    for src, attempts, error in queue.failures():
+        print(f"  [FAILED x{attempts}] {src}: {error}")
+
+def main(args):
+    """Claims jobs in batches and runs them across a process pool until the queue is empty."""
+    print("=== Thumbnail Worker Summary ===")
+    print(f"🗃️  Queue:           {args.queue}")
+    print(f"🧵  Workers:         {args.workers}")
+    print(f"🔁  Max Attempts:    {args.max_attempts}")
+    print()
+
+    queue = ThumbnailQueue(args.queue, lease=args.lease)
+    try:
+        if args.retry_failed:
+            print(f"[INFO] Re-queued {queue.retry_failed():,} failed job(s).")
+        if args.status:
+            print_status(queue)
+            return
+        reclaimed = queue.reclaim_orphans()
+        if reclaimed:
+            print(f"[INFO] Resuming {reclaimed:,} job(s) left running by a dead worker.")
+
+        done, failed = drain(queue, args)
+        print(" " * 60, end="\r")
+        print(f"[✓] Thumbnails created: {done:,}, errors: {failed:,}")
+        print_status(queue)
+    finally:
+        queue.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates thumbnails from the job queue.")
+    parser.add_argument("--claim", type=int, default=8,
+                        help="Jobs claimed per worker per round")
+    parser.add_argument("--lease", type=int, default=600,
+                        help="Seconds before a running job is considered abandoned")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Attempts before a job is parked as failed")
+    parser.add_argument("--queue", default=str(QUEUE_PATH), help="Path to the queue DB")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Move failed jobs back to pending first")
+    parser.add_argument("--status", action="store_true", help="Print queue status and exit")
+    parser.add_argument("--workers", type=int, default=get_cpu_threads() // 2,
+                        help="Worker processes")
+
+    main(parser.parse_args())
@@ -1,24 +1,49 @@
 '''For updating existing ratings in shimmiedb'''
-import sqlite3
+from array import array
 from pathlib import Path
 import argparse
-import psycopg2
 
-from functions.utils import rating_from_score
+from functions.core import lazy_import
+from functions.rating_engine import RatingEngine
+
+psycopg2 = lazy_import("psycopg2")
+pg_extras = lazy_import("psycopg2.extras")
 
 script_dir = Path(__file__).parent.resolve()
 db_path = script_dir.parent / "database" / "tag_rating_dominant.db"
-tag_rating_map = {}
+
+def fetch_tag_csr(pg_conn, vocab):
+    '''Streams every image's rated tag IDs into CSR arrays (image_ids, indptr, indices).'''
+    image_ids, indptr, indices = array("q"), array("q", [0]), array("q")
+    lookup = vocab.get
+    current = None
+
+    with pg_conn.cursor(name="rating_tags") as pg_cur:
+        pg_cur.itersize = 100_000
+        pg_cur.execute("""
+            SELECT it.image_id, t.tag
+            FROM image_tags it
+            JOIN tags t ON t.id = it.tag_id
+            ORDER BY it.image_id
+        """)
+        for image_id, tag in pg_cur:
+            if image_id != current:
+                if current is not None:
+                    indptr.append(len(indices))
+                image_ids.append(image_id)
+                current = image_id
+            # Unrated tags weigh 0 and can't affect the score, so they're skipped
+            tag_id = lookup(tag)
+            if tag_id is not None:
+                indices.append(tag_id)
+    if current is not None:
+        indptr.append(len(indices))
+
+    return image_ids, indptr, indices
 
 def main(args):
     '''For updating existing ratings in shimmiedb'''
-
-    with sqlite3.connect(db_path) as conn:
-        tag_rating_map.update(
-            {t.strip(): int(r) for t, r in conn.execute(
-                "SELECT tag_name, dominant_rating FROM dominant_tag_ratings"
-            )}
-        )
+    engine = RatingEngine.from_db(db_path)
 
     pg_config = {
         "dbname": args.db,
@@ -28,59 +53,32 @@ def main(args):
     }
 
     with psycopg2.connect(**pg_config) as pg_conn:
-        pg_cur = pg_conn.cursor()
+        print("Fetching image tags...", end="\r")
+        image_ids, indptr, indices = fetch_tag_csr(pg_conn, engine.vocab)
+
+        print(f"Scoring {len(image_ids):,} images...", end="\r")
+        letters = engine.letters(engine.score_csr(indptr, indices), args.smax, args.qmax)
+        computed = {image_id: letter for image_id, letter in zip(image_ids, letters) if letter}
 
-        # Get all image IDs
-        pg_cur.execute("SELECT id FROM images")
-        ids = [row[0] for row in pg_cur.fetchall()]
-
-        updated = 0
-
-        for i, image_id in enumerate(ids, start=1):
-            print(f"Processing image {i}/{len(ids)}", end="\r")
-
-            # Get tags for this image
-            pg_cur.execute("""
-                SELECT t.tag
-                FROM tags t
-                JOIN image_tags it ON t.id = it.tag_id
-                WHERE it.image_id = %s
-            """, (image_id,))
-            tags = [t[0] for t in pg_cur.fetchall()]
-
-            total_score = 0
-
-            for tag in tags:
-                weight = tag_rating_map.get(tag)
-                if weight is None:
-                    continue
-                if weight == 1:
-                    if total_score == 0:
-                        total_score = 1
-                elif weight > 1:
-                    total_score += weight
-
-            rating_letter = None
-            if total_score > 0:
-                rating_letter = rating_from_score(
-                    total_score, args.smax, args.qmax
-                )
-
-            pg_cur.execute(
-                "SELECT rating FROM images WHERE id = %s", (image_id,)
-            )
-            current_rating = pg_cur.fetchone()[0]
+        pg_cur = pg_conn.cursor()
+        pg_cur.execute("SELECT id, rating FROM images")
 
+        updates = []
+        for image_id, current_rating in pg_cur.fetchall():
+            rating_letter = computed.get(image_id)
             if rating_letter is None:
                 rating_letter = current_rating if current_rating is not None else "?"
 
             # Update the image rating if needed
             if current_rating != rating_letter:
-                pg_cur.execute(
-                    "UPDATE images SET rating = %s WHERE id = %s",
-                    (rating_letter, image_id)
-                )
-                updated += 1
+                updates.append((image_id, str(rating_letter)))
+
+        pg_extras.execute_values(pg_cur, """
+            UPDATE images SET rating = v.rating
+            FROM (VALUES %s) AS v(id, rating)
+            WHERE images.id = v.id
+        """, updates, page_size=1000)
+        updated = len(updates)
 
         print(" " * 60, end="\r")
         print(f"Updated {updated} image rating{'s' if updated != 1 else ''}.")
@@ -0,0 +1,6 @@
+"""Scripts import their helpers as `functions.*`, so tests run with scripts/ on the path."""
+from pathlib import Path
+import sys
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
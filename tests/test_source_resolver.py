@@ -0,0 +1,22 @@
+"""Tests for functions.source_resolver"""
+import pytest
+
+from functions.source_resolver import SourceResolver
+
+@pytest.mark.parametrize("filename, expected", [
+    ("gelbooru_123_abc.jpg", "https://gelbooru.com/index.php?page=post&s=view&id=123"),
+    ("konachan_456_abc.png", "https://konachan.com/post/show/456"),
+    ("fanbox/11/22_text.jpg", "https://kemono.cr/fanbox/user/11/post/22"),
+    ("yandere_789_abc.jpg", "https://yande.re/post/show/789"),
+    ("plain.jpg", None),
+])
+def test_from_filename(filename, expected):
+    assert SourceResolver.from_filename(filename) == expected
+
+def test_from_filename_prefers_site_priority_over_position():
+    # Both patterns match; gelbooru wins although konachan comes first in the path
+    filename = "konachan_1_x/gelbooru_2_hash.jpg"
+    assert SourceResolver.from_filename(filename) == \
+        "https://gelbooru.com/index.php?page=post&s=view&id=2"
+    assert SourceResolver.from_filename("yandere_3_x/fanbox/4/5_y.jpg") == \
+        "https://kemono.cr/fanbox/user/4/post/5"
@@ -0,0 +1,43 @@
+"""Importing the CLI scripts must stay cheap and not load what they only use lazily."""
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SCRIPTS_DIR
+
+# Same budget as `benchmark.py startup`; the benchmark harness itself is exempt
+BUDGET_MS = 250
+SCRIPTS = sorted(p.stem for p in SCRIPTS_DIR.glob("*.py") if p.stem != "benchmark")
+LAZY_MODULES = {
+    "booru_csv_maker": ("PIL", "pyvips", "concurrent.futures"),
+    "update_ratings": ("numpy", "psycopg2"),
+}
+
+def import_time_ms(script):
+    """Cumulative import time of `script` in a fresh interpreter (-X importtime)."""
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {script}"],
+                         cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+    for line in reversed(res.stderr.splitlines()):
+        fields = [part.strip() for part in line.split("|")]
+        if line.startswith("import time:") and fields[-1] == script:
+            return int(fields[1]) / 1000
+    raise AssertionError(f"no import time reported for {script}")
+
+@pytest.mark.parametrize("script", SCRIPTS)
+def test_import_time_within_budget(script):
+    try:
+        compile((SCRIPTS_DIR / f"{script}.py").read_text(encoding="utf-8"), script, "exec")
+    except SyntaxError:
+        pytest.skip(f"{script}.py needs a newer Python than {sys.version.split()[0]}")
+    # Best of three; the first run can include writing .pyc files
+    best = min(import_time_ms(script) for _ in range(3))
+    assert best <= BUDGET_MS, f"{script} imports in {best:.1f} ms"
+
+@pytest.mark.parametrize("script", sorted(LAZY_MODULES))
+def test_import_is_lazy(script):
+    code = (f"import sys, {script}; "
+            f"print(','.join(m for m in {LAZY_MODULES[script]!r} if m in sys.modules))")
+    res = subprocess.run([sys.executable, "-c", code], cwd=SCRIPTS_DIR,
+                         capture_output=True, text=True, check=True)
+    assert res.stdout.strip() == ""
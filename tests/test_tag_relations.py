@@ -0,0 +1,61 @@
+"""Tests for functions.tag_relations"""
+import csv
+
+from functions.tag_relations import TagRelationStore
+
+def write_dump(path, pairs):
+    with path.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["antecedent_name", "consequent_name", "status"])
+        writer.writerows((a, c, "active") for a, c in pairs)
+
+def closure(store):
+    return {antecedent: set(implied.split(" ")) for antecedent, implied
+            in store.conn.execute("SELECT antecedent, implied FROM implication_closure")}
+
+def test_implication_cycle_closes_over_every_member(tmp_path):
+    dump = tmp_path / "implications.csv"
+    # a -> b -> c -> a is a cycle that leads out to d; x enters it
+    write_dump(dump, [("a", "b"), ("b", "c"), ("c", "a"), ("c", "d"), ("x", "a")])
+    store = TagRelationStore(tmp_path / "relations.db")
+    try:
+        store.update(implications=[dump])
+        assert closure(store) == {
+            "a": {"b", "c", "d"},
+            "b": {"a", "c", "d"},
+            "c": {"a", "b", "d"},
+            "x": {"a", "b", "c", "d"},
+        }
+    finally:
+        store.close()
+
+def test_incremental_update_matches_full_closure(tmp_path):
+    dump = tmp_path / "implications.csv"
+    write_dump(dump, [("a", "b"), ("b", "c")])
+    store = TagRelationStore(tmp_path / "relations.db")
+    try:
+        store.update(implications=[dump])
+        # Closing the cycle only re-resolves the tags whose chains reach c
+        write_dump(dump, [("a", "b"), ("b", "c"), ("c", "a"), ("y", "z")])
+        store.update(implications=[dump])
+        assert closure(store) == {
+            "a": {"b", "c"}, "b": {"a", "c"}, "c": {"a", "b"}, "y": {"z"},
+        }
+    finally:
+        store.close()
+
+def test_dump_no_longer_given_is_dropped(tmp_path):
+    first, second = tmp_path / "first.csv", tmp_path / "second.csv"
+    write_dump(first, [("a", "b")])
+    write_dump(second, [("b", "c"), ("x", "y")])
+    store = TagRelationStore(tmp_path / "relations.db")
+    try:
+        store.update(implications=[first, second])
+        assert closure(store) == {"a": {"b", "c"}, "b": {"c"}, "x": {"y"}}
+        store.update(implications=[first])
+        assert closure(store) == {"a": {"b"}}
+        # Passing no implication dumps keeps the stored ones
+        store.update()
+        assert closure(store) == {"a": {"b"}}
+    finally:
+        store.close()
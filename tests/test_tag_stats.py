@@ -0,0 +1,92 @@
+"""Tests for functions.tag_stats"""
+from collections import Counter
+import random
+import sqlite3
+
+from functions.tag_stats import TagStats, TagStatsStore
+
+def write_cache(path, posts):
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS posts (md5 TEXT PRIMARY KEY, "
+                     "general TEXT, character TEXT, artist TEXT, series TEXT)")
+        conn.execute("DELETE FROM posts")
+        conn.executemany("INSERT INTO posts VALUES (?, ?, '', '', '')", posts.items())
+
+def snapshot(store):
+    counts = dict(store.conn.execute("SELECT tag, count FROM tags WHERE count > 0"))
+    top = {}
+    for tag, other, count in store.conn.execute(
+            "SELECT a.tag, b.tag, p.count FROM top p JOIN tags a ON a.id = p.tag "
+            "JOIN tags b ON b.id = p.other ORDER BY p.count DESC, b.tag"):
+        top.setdefault(tag, []).append((other, count))
+    return counts, top
+
+def test_counts_and_bounded_top_k(tmp_path):
+    cache = tmp_path / "posts_cache.db"
+    write_cache(cache, {"m1": "a,b,c", "m2": "a,b", "m3": "a,c,d", "m4": "a,b"})
+    store = TagStatsStore(tmp_path / "stats.db")
+    try:
+        assert store.update(cache, top_k=2)["added"] == 4
+        counts, top = snapshot(store)
+        assert counts == {"a": 4, "b": 3, "c": 2, "d": 1}
+        assert top["a"] == [("b", 3), ("c", 2)]
+
+        # m2 loses b and m4 goes away: only the touched tags are re-ranked
+        write_cache(cache, {"m1": "a,b,c", "m2": "a", "m3": "a,c,d"})
+        stats = store.update(cache, top_k=2)
+        assert (stats["changed"], stats["removed"]) == (1, 1)
+        counts, top = snapshot(store)
+        assert counts == {"a": 3, "b": 1, "c": 2, "d": 1}
+        assert top["a"] == [("c", 2), ("b", 1)]
+        assert top["b"] == [("a", 1), ("c", 1)]
+    finally:
+        store.close()
+
+def test_incremental_top_k_matches_full_build(tmp_path):
+    rng = random.Random(7)
+    tags = [f"t{i}" for i in range(30)]
+    # Skewed draws, so pairs keep crossing the top-k cut as posts change
+    weights = [1 / (i + 1) for i in range(len(tags))]
+    def post():
+        return ",".join(sorted(set(rng.choices(tags, weights, k=rng.randint(1, 8)))))
+    posts = {f"m{i}": post() for i in range(300)}
+    cache = tmp_path / "posts_cache.db"
+    store = TagStatsStore(tmp_path / "stats.db")
+    try:
+        for _ in range(6):
+            for md5 in rng.sample(sorted(posts), 60):
+                if rng.random() < 0.2:
+                    del posts[md5]
+                else:
+                    posts[md5] = post()
+            posts.update({f"n{rng.random()}": post() for _ in range(20)})
+            write_cache(cache, posts)
+            store.update(cache, top_k=3)
+
+            pairs = Counter()
+            for value in posts.values():
+                names = value.split(",")
+                pairs.update((a, b) for a in names for b in names if a != b)
+            counts, top = snapshot(store)
+            assert counts == dict(Counter(t for value in posts.values() for t in value.split(",")))
+            for tag in counts:
+                # Ties at the cut may keep either tag, but the counts are the exact top 3
+                ranked = sorted((n for (a, _), n in pairs.items() if a == tag), reverse=True)
+                assert [n for _, n in top.get(tag, [])] == ranked[:3]
+                assert all(pairs[tag, other] == n for other, n in top.get(tag, []))
+    finally:
+        store.close()
+
+def test_reader_top_and_confidence(tmp_path):
+    cache = tmp_path / "posts_cache.db"
+    write_cache(cache, {"m1": "a,b,c", "m2": "a,b", "m3": "a,c,d", "m4": "a,b"})
+    store = TagStatsStore(tmp_path / "stats.db")
+    store.update(cache, top_k=2)
+    store.close()
+
+    stats = TagStats.open(tmp_path / "stats.db")
+    assert stats.count("a") == 4
+    assert stats.top("a") == [("b", 3), ("c", 2)]
+    assert stats.confidence("b", "a") == 1.0
+    assert stats.confidence("a", "d") == 0.0
+    assert stats.top("missing") == []